@@ -10,3 +10,6 @@ python manage.py collectstatic --no-input
 
 # Run migrations
 python manage.py migrate
+
+# Table of the shared cache (CACHE_URL unset, see settings.CACHES)
+python manage.py createcachetable
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Asset, Portfolio, Holding, PortfolioHistory
+from .models import Asset, AssetPrice, Portfolio, Holding, PortfolioHistory, NetWorthHistory
 
 @admin.register(Asset)
 class AssetAdmin(admin.ModelAdmin):
@@ -7,6 +7,12 @@ class AssetAdmin(admin.ModelAdmin):
     search_fields = ('ticker', 'name')
     list_filter = ('category',)
 
+@admin.register(AssetPrice)
+class AssetPriceAdmin(admin.ModelAdmin):
+    list_display = ('asset', 'date', 'close')
+    search_fields = ('asset__ticker',)
+    date_hierarchy = 'date'
+
 class HoldingInline(admin.TabularInline):
     model = Holding
     extra = 1
@@ -28,3 +34,10 @@ class PortfolioHistoryAdmin(admin.ModelAdmin):
     list_display = ('portfolio', 'date', 'total_value', 'invested_value')
     list_filter = ('portfolio', 'date')
     date_hierarchy = 'date'
+
+@admin.register(NetWorthHistory)
+class NetWorthHistoryAdmin(admin.ModelAdmin):
+    list_display = ('user', 'date', 'total_value', 'invested_value')
+    list_filter = ('date',)
+    search_fields = ('user__username',)
+    date_hierarchy = 'date'
@@ -0,0 +1,749 @@
+"""
+Performance scenarios run by `python manage.py benchmark <scenario>`.
+Each scenario builds its own fixtures inside a transaction that is rolled back
+afterwards, so it can be pointed at a development database safely. Scenarios
+whose fixtures must be seen from other threads run outside of it
+(atomic=False) and delete them themselves.
+"""
+import asyncio
+import datetime
+import hashlib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+import numpy as np
+import pandas as pd
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache, caches
+from django.db import connection, transaction
+from django.test import AsyncClient, Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from .cache import get_or_refresh
+from .history import rebuild_portfolio_history, refresh_net_worth_history
+from .models import Asset, AssetCategory, AssetPrice, Holding, Portfolio, PortfolioHistory, Transaction
+from .pubsub import get_broker
+from .pagination import TRANSACTION_ORDERING, TRANSACTIONS_PAGE_SIZE, encode_cursor
+from .exchanges import TICKERS_CHUNK_SIZES
+from .providers import YFinanceProvider, close_series, get_provider
+from .scheduling import SCHEDULER_TICK, select_due
+from . import search as search_module
+from .search import TickerIndex, build_index, normalize_query
+from .valuation import compute_portfolio_valuation, compute_user_valuation
+from .valuation_engine import HoldingArrays
+from .services import (
+    MARKET_OVERVIEW_KEY, _write_prices, asset_details_key, import_assets, search_assets_online, update_asset_prices,
+)
+from .snapshots import snapshot_portfolios
+from .tasks import PRICE_SHARD_SIZE
+from .warming import WARM_WORKERS, warm_market_cache, warm_tickers
+
+SCENARIOS = {}
+
+def scenario(name, atomic=True):
+    def register(func):
+        func.atomic = atomic
+        SCENARIOS[name] = func
+        return func
+    return register
+
+def run(name, out, sizes=None):
+    """
+    Runs a registered scenario; `out` receives one line of text per result.
+    """
+    if not SCENARIOS[name].atomic:
+        SCENARIOS[name](out, sizes)
+        return
+    with transaction.atomic():
+        try:
+            SCENARIOS[name](out, sizes)
+        finally:
+            transaction.set_rollback(True)
+
+def _bench_user(label):
+    user = User.objects.create_user(username=f'bench-{label}-{time.monotonic_ns()}')
+    client = Client()
+    client.force_login(user)
+    return user, client
+
+@scenario('dashboard_history')
+def dashboard_history(out, sizes):
+    """Dashboard query count and latency as the net worth history grows"""
+    today = timezone.localdate()
+    asset = Asset.objects.create(ticker=f'BENCH{time.monotonic_ns() % 10**8}', name='Bench', category=AssetCategory.STOCKS, current_price=Decimal('100'))
+
+    for days in sizes or [30, 365, 1095]:
+        user, client = _bench_user(days)
+        portfolios = [Portfolio.objects.create(user=user, name=f'Bench {i}') for i in range(3)]
+        for portfolio in portfolios:
+            Holding.objects.create(portfolio=portfolio, asset=asset, quantity=10, average_buy_price=90)
+        PortfolioHistory.objects.bulk_create([
+            PortfolioHistory(portfolio=portfolio, date=today - datetime.timedelta(days=i), total_value=1000 + i, invested_value=900)
+            for portfolio in portfolios
+            for i in range(1, days + 1)
+        ], batch_size=1000)
+        refresh_net_worth_history(user_ids=[user.pk])
+
+        url = reverse('portfolio:dashboard')
+        client.get(url)  # warm template and URL caches
+        with CaptureQueriesContext(connection) as ctx:
+            start = time.perf_counter()
+            client.get(url)
+            elapsed = time.perf_counter() - start
+        out(f"{days:>6} days of history: {len(ctx.captured_queries):>3} queries, {elapsed * 1000:8.1f} ms")
+
+@scenario('snapshot')
+def snapshot(out, sizes):
+    """Throughput of the set-based daily snapshot vs. number of portfolios"""
+    user, _ = _bench_user('snapshot')
+    assets = Asset.objects.bulk_create([
+        Asset(ticker=f'SNAP{i}-{time.monotonic_ns() % 10**6}', name=f'Snap {i}', category=AssetCategory.STOCKS, current_price=Decimal(10 + i))
+        for i in range(20)
+    ])
+    created = 0
+    for count in sizes or [1000, 10000]:
+        portfolios = Portfolio.objects.bulk_create([
+            Portfolio(user=user, name=f'Snap {i}') for i in range(created, count)
+        ], batch_size=1000)
+        Holding.objects.bulk_create([
+            Holding(portfolio=portfolio, asset=assets[(portfolio.pk + j) % len(assets)], quantity=j + 1, average_buy_price=10)
+            for portfolio in portfolios
+            for j in range(5)
+        ], batch_size=1000)
+        created = count
+
+        stats = snapshot_portfolios(timezone.localdate())
+        out(f"{count:>7} portfolios: {stats['rows']} rows in {stats['duration']:.2f}s ({stats['rows_per_second']:.0f} rows/s)")
+
+@scenario('valuation_pages')
+def valuation_pages(out, sizes):
+    """Query count of the valuation pages vs. number of portfolios and holdings"""
+    assets = Asset.objects.bulk_create([
+        Asset(ticker=f'VAL{i}-{time.monotonic_ns() % 10**6}', name=f'Val {i}', category=AssetCategory.values[i % 2], current_price=Decimal(10 + i))
+        for i in range(10)
+    ])
+    for count in sizes or [1, 10, 50]:
+        user, client = _bench_user(f'pages-{count}')
+        portfolios = Portfolio.objects.bulk_create([Portfolio(user=user, name=f'Val {i}') for i in range(count)])
+        Holding.objects.bulk_create([
+            Holding(portfolio=portfolio, asset=asset, quantity=3, average_buy_price=8)
+            for portfolio in portfolios
+            for asset in assets
+        ])
+        urls = {
+            'dashboard': reverse('portfolio:dashboard'),
+            'portfolio_list': reverse('portfolio:portfolio_list'),
+            'portfolio_detail': reverse('portfolio:portfolio_detail', args=[portfolios[0].pk]),
+            'insights': reverse('portfolio:insights'),
+        }
+        counts = []
+        for name, url in urls.items():
+            client.get(url)
+            with CaptureQueriesContext(connection) as ctx:
+                client.get(url)
+            counts.append(f"{name}={len(ctx.captured_queries)}")
+        out(f"{count:>4} portfolios x {len(assets)} holdings: " + ", ".join(counts))
+
+@scenario('dashboard_poll')
+def dashboard_poll(out, sizes):
+    """Requests per second of unchanged dashboard table polls, full render vs. ETag revalidation"""
+    asset = Asset.objects.create(ticker=f'POLL{time.monotonic_ns() % 10**8}', name='Poll', category=AssetCategory.STOCKS, current_price=Decimal('50'))
+    user, client = _bench_user('poll')
+    portfolio = Portfolio.objects.create(user=user, name='Poll')
+    Holding.objects.create(portfolio=portfolio, asset=asset, quantity=4, average_buy_price=40)
+    url = reverse('portfolio:dashboard_table')
+    etag = client.get(url, HTTP_HX_REQUEST='true')['ETag']
+
+    for requests in sizes or [500]:
+        for label, headers in [('full render', {}), ('If-None-Match', {'HTTP_IF_NONE_MATCH': etag})]:
+            start = time.perf_counter()
+            for _ in range(requests):
+                response = client.get(url, HTTP_HX_REQUEST='true', **headers)
+            elapsed = time.perf_counter() - start
+            out(f"{label:>14}: {requests / elapsed:8.0f} req/s (status {response.status_code}, {requests} polls)")
+
+@scenario('history_rebuild')
+def history_rebuild(out, sizes):
+    """Vectorized history reconstruction over 10 years vs. number of portfolios"""
+    years = 10
+    today = timezone.localdate()
+    since = today - datetime.timedelta(days=365 * years)
+    user, _ = _bench_user('rebuild')
+    assets = Asset.objects.bulk_create([
+        Asset(ticker=f'HIST{i}-{time.monotonic_ns() % 10**6}', name=f'Hist {i}', category=AssetCategory.STOCKS, current_price=Decimal(100))
+        for i in range(50)
+    ])
+    AssetPrice.objects.bulk_create([
+        AssetPrice(asset=asset, date=since + datetime.timedelta(days=d), close=Decimal(50 + (d + i) % 100))
+        for i, asset in enumerate(assets)
+        for d in range(0, 365 * years, 1)
+        if (since + datetime.timedelta(days=d)).weekday() < 5
+    ], batch_size=5000)
+
+    created = 0
+    for count in sizes or [100, 1000]:
+        portfolios = Portfolio.objects.bulk_create([Portfolio(user=user, name=f'Hist {i}') for i in range(created, count)])
+        Holding.objects.bulk_create([
+            Holding(portfolio=portfolio, asset=assets[(portfolio.pk + j) % len(assets)], quantity=j + 1, average_buy_price=60)
+            for portfolio in portfolios
+            for j in range(5)
+        ], batch_size=5000)
+        created = count
+
+        stats = rebuild_portfolio_history(since, portfolio_ids=[p.pk for p in Portfolio.objects.filter(user=user)])
+        out(
+            f"{count:>6} portfolios x {years} years: {stats['rows']} rows in {stats['duration']:.1f}s "
+            f"({stats['rows'] / stats['duration']:.0f} rows/s)"
+        )
+
+@scenario('transactions_scroll')
+def transactions_scroll(out, sizes):
+    """Latency of the first vs. the last page of the transactions list as the history grows"""
+    user, client = _bench_user('scroll')
+    url = reverse('portfolio:transactions')
+    today = timezone.localdate()
+    created = 0
+    for count in sizes or [1000, 10000, 50000]:
+        Transaction.objects.bulk_create([
+            Transaction(user=user, amount=Decimal('9.99'), category='Bench', date=today - datetime.timedelta(days=i % 3650))
+            for i in range(created, count)
+        ], batch_size=5000)
+        created = count
+
+        # Cursor pointing just before the oldest page
+        last = Transaction.objects.filter(user=user).order_by(*TRANSACTION_ORDERING)[count - TRANSACTIONS_PAGE_SIZE - 1]
+        timings = []
+        for label, params in [('first page', {}), ('last page', {'cursor': encode_cursor(last)})]:
+            client.get(url, params, HTTP_HX_REQUEST='true')
+            with CaptureQueriesContext(connection) as ctx:
+                start = time.perf_counter()
+                client.get(url, params, HTTP_HX_REQUEST='true')
+                elapsed = time.perf_counter() - start
+            timings.append(f"{label} {elapsed * 1000:6.1f} ms ({len(ctx.captured_queries)} queries)")
+        out(f"{count:>6} transactions: " + ", ".join(timings))
+
+@scenario('price_writes')
+def price_writes(out, sizes):
+    """Queries and latency of writing fetched prices, per-asset save() vs. batched UPDATE"""
+    for count in sizes or [1000, 5000]:
+        assets = Asset.objects.bulk_create([
+            Asset(ticker=f'PW{i}-{time.monotonic_ns() % 10**6}', name=f'Pw {i}', category=AssetCategory.STOCKS, current_price=Decimal(10))
+            for i in range(count)
+        ], batch_size=5000)
+
+        with CaptureQueriesContext(connection) as ctx:
+            start = time.perf_counter()
+            for i, asset in enumerate(assets):
+                asset.current_price = Decimal(20 + i % 7)
+                asset.last_updated = timezone.now()
+                asset.save(update_fields=['current_price', 'last_updated'])
+            elapsed = time.perf_counter() - start
+        out(f"{count:>6} assets, save() per asset: {len(ctx.captured_queries):>5} queries, {elapsed * 1000:8.1f} ms")
+
+        # Half of the prices move, the other half is skipped as unchanged
+        prices = {asset.ticker: 30 + i % 7 if i % 2 else asset.current_price for i, asset in enumerate(assets)}
+        stats = {'updated': 0, 'unchanged': 0, 'failed': 0}
+        with CaptureQueriesContext(connection) as ctx:
+            start = time.perf_counter()
+            _write_prices(assets, prices, stats)
+            elapsed = time.perf_counter() - start
+        out(
+            f"{count:>6} assets, batched write:   {len(ctx.captured_queries):>5} queries, {elapsed * 1000:8.1f} ms "
+            f"({stats['updated']} updated, {stats['unchanged']} unchanged)"
+        )
+
+def _fake_download(bad_tickers, latency=0.05, per_ticker=0.0005):
+    """
+    Stand-in for yf.download: sleeps like a request whose cost grows with the
+    number of tickers and fails as a whole when it contains a bad ticker.
+    """
+    def download(tickers, **kwargs):
+        time.sleep(latency + per_ticker * len(tickers))
+        if bad_tickers.intersection(tickers):
+            raise ValueError("bad ticker in request")
+        columns = pd.MultiIndex.from_product([tickers, ['Close']])
+        return pd.DataFrame([np.arange(1, len(tickers) + 1, dtype=float)], columns=columns)
+    return download
+
+@scenario('stock_download')
+def stock_download(out, sizes):
+    """Stock price download against a fake provider, one request vs. chunked parallel requests"""
+    for count in sizes or [1000, 5000, 20000]:
+        tickers = [f'FAKE{i}' for i in range(count)]
+        download = _fake_download({tickers[count // 3]})
+        for label, chunk_size, workers in [('single request', count, 1), ('chunked', None, None)]:
+            start = time.perf_counter()
+            prices = YFinanceProvider(download=download, chunk_size=chunk_size, workers=workers).quotes(tickers)
+            elapsed = time.perf_counter() - start
+            out(f"{count:>6} tickers, {label:>14}: {len(prices):>6} prices in {elapsed:6.2f}s")
+
+@scenario('price_update')
+def price_update(out, sizes):
+    """Full price update run (fetch + write) offline, on the synthetic provider with 50 ms per call"""
+    synthetic = {'default': {'BACKEND': 'portfolio.providers.SyntheticProvider', 'OPTIONS': {'latency': 0.05}}}
+    with override_settings(MARKET_DATA_PROVIDERS=synthetic):
+        created = 0
+        for count in sizes or [1000, 5000]:
+            Asset.objects.bulk_create([
+                Asset(ticker=f'SYN{i}', name=f'Syn {i}', category=AssetCategory.values[i % 2], current_price=Decimal(10))
+                for i in range(created, count)
+            ], batch_size=5000)
+            created = count
+            assets = list(Asset.objects.filter(ticker__startswith='SYN'))
+
+            start = time.perf_counter()
+            stats = update_asset_prices(assets)
+            elapsed = time.perf_counter() - start
+            out(
+                f"{count:>6} assets: {elapsed:6.2f}s ({stats['updated']} updated, "
+                f"{stats['unchanged']} unchanged, {stats['failed']} failed)"
+            )
+
+@scenario('cache_stampede')
+def cache_stampede(out, sizes):
+    """Upstream calls and latency when concurrent requests hit an expired entry, plain get/set vs. get_or_refresh"""
+    def upstream(calls):
+        def fetch():
+            calls.append(1)
+            time.sleep(0.2)
+            return {'price': 1}
+        return fetch
+
+    def plain(key, fetch):
+        value = cache.get(key)
+        if value is None:
+            value = fetch()
+            cache.set(key, value, 300)
+        return value
+
+    def timed(read):
+        start = time.perf_counter()
+        read()
+        return time.perf_counter() - start
+
+    for clients in sizes or [10, 50]:
+        for label in ('expired', 'stale'):
+            key = f'bench:stampede:{clients}:{label}:{time.monotonic_ns()}'
+            reads = {
+                'plain get/set': lambda fetch: plain(key + ':plain', fetch),
+                'get_or_refresh': lambda fetch: get_or_refresh(key, fetch, 300, 3600),
+            }
+            for name, read in reads.items():
+                if label == 'stale':
+                    # A value exists but is past its soft expiry
+                    cache.set(key, {'value': {'price': 0}, 'fresh_until': 0}, 3600)
+                calls = []
+                fetch = upstream(calls)
+                with ThreadPoolExecutor(max_workers=clients) as pool:
+                    latencies = sorted(pool.map(lambda _: timed(lambda: read(fetch)), range(clients)))
+                time.sleep(0.3)  # let a background refresh land
+                out(
+                    f"{clients:>4} clients, {label:>7} entry, {name:>14}: {len(calls):>3} upstream calls, "
+                    f"p50 {latencies[len(latencies) // 2] * 1000:6.1f} ms, max {latencies[-1] * 1000:6.1f} ms"
+                )
+            cache.delete_many([key, key + ':plain'])
+
+@scenario('tiered_cache')
+def tiered_cache(out, sizes):
+    """Latency of hot market data reads from the shared cache alone vs. through the in-process L1"""
+    value = {'value': {'price': 1.0, 'chart_data': list(range(30))}, 'fresh_until': time.time() + 300}
+    shared = caches['shared']
+    for reads in sizes or [10000]:
+        key = f'bench:tiered:{reads}:{time.monotonic_ns()}'
+        cache.set(key, value, 300)
+        before = cache.stats()
+        for label, read in [('shared only', shared.get), ('tiered', cache.get)]:
+            start = time.perf_counter()
+            for _ in range(reads):
+                read(key)
+            elapsed = time.perf_counter() - start
+            out(f"{reads:>7} reads, {label:>11}: {elapsed / reads * 1e6:7.1f} us/read")
+        after = cache.stats()
+        counts = {name: after[name] - before[name] for name in ('l1_hits', 'l1_misses', 'l2_hits', 'l2_misses')}
+        out(f"{reads:>7} reads, tier counters: " + ", ".join(f"{name}={count}" for name, count in counts.items()))
+        cache.delete(key)
+
+@scenario('asset_detail_cold')
+def asset_detail_cold(out, sizes):
+    """Latency of /market/<ticker>/ on a cold cache, on the synthetic provider with 200 ms per call"""
+    synthetic = {'default': {'BACKEND': 'portfolio.providers.SyntheticProvider', 'OPTIONS': {'latency': 0.2}}}
+    _, client = _bench_user('detail')
+    with override_settings(MARKET_DATA_PROVIDERS=synthetic):
+        for requests in sizes or [5]:
+            timings = []
+            for i in range(requests):
+                ticker = f'COLD{i}'
+                cache.delete(f'asset_details:{ticker}')
+                start = time.perf_counter()
+                response = client.get(reverse('portfolio:market_asset_detail', args=[ticker]))
+                timings.append(time.perf_counter() - start)
+                cache.delete(f'asset_details:{ticker}')
+            timings.sort()
+            out(
+                f"{requests:>4} cold misses: p50 {timings[len(timings) // 2] * 1000:6.0f} ms, "
+                f"max {timings[-1] * 1000:6.0f} ms (status {response.status_code})"
+            )
+
+@scenario('cache_warming')
+def cache_warming(out, sizes):
+    """Warm-up run over the market overview and held assets, then request latency of the warmed pages, synthetic provider with 200 ms per call"""
+    synthetic = {'default': {'BACKEND': 'portfolio.providers.SyntheticProvider', 'OPTIONS': {'latency': 0.2}}}
+    user, client = _bench_user('warming')
+    portfolio = Portfolio.objects.create(user=user, name='Warm')
+    created = 0
+    with override_settings(MARKET_DATA_PROVIDERS=synthetic):
+        for held in sizes or [10, 50]:
+            assets = Asset.objects.bulk_create([
+                Asset(ticker=f'WARM{i}', name=f'Warm {i}', category=AssetCategory.STOCKS, current_price=Decimal(10))
+                for i in range(created, held)
+            ])
+            Holding.objects.bulk_create([Holding(portfolio=portfolio, asset=asset, quantity=1, average_buy_price=10) for asset in assets])
+            created = held
+            tickers = warm_tickers()
+            cache.delete_many([MARKET_OVERVIEW_KEY] + [asset_details_key(ticker) for ticker in tickers])
+
+            stats = warm_market_cache(workers=WARM_WORKERS)
+            out(
+                f"{held:>5} held assets: warmed {stats['refreshed']}/{stats['targets']} entries in "
+                f"{stats['duration']:.2f}s, coverage {stats['coverage']:.0%}"
+            )
+            timings = []
+            for url in [reverse('portfolio:asset_list'), reverse('portfolio:market_asset_detail', args=[tickers[-1]])]:
+                start = time.perf_counter()
+                client.get(url)
+                timings.append(f"{url} {(time.perf_counter() - start) * 1000:.0f} ms")
+            out(f"{held:>5} held assets: " + ", ".join(timings))
+
+@scenario('ticker_search')
+def ticker_search(out, sizes):
+    """Local ticker index build time, query latency and query count of search_assets_online vs. number of assets"""
+    words = ['alpha', 'global', 'energy', 'tech', 'capital', 'bio', 'digital', 'pacific', 'royal', 'united']
+    queries = ['AAP', 'tk12', 'global en', 'glbal energy', 'digital bio', 'royl', 'TK4321', 'capi']
+    created = 0
+    for count in sizes or [10000, 100000]:
+        Asset.objects.bulk_create([
+            Asset(
+                ticker=f'TK{i}', name=f'{words[i % 10].title()} {words[i // 10 % 10].title()} {i}',
+                category=AssetCategory.values[i % 2], current_price=Decimal(10),
+            )
+            for i in range(created, count)
+        ], batch_size=5000)
+        created = count
+
+        start = time.perf_counter()
+        index = build_index()
+        build = time.perf_counter() - start
+        timings = []
+        for _ in range(20):
+            for query in queries:
+                start = time.perf_counter()
+                index.scored(normalize_query(query))
+                timings.append(time.perf_counter() - start)
+        timings.sort()
+        with override_settings(MARKET_DATA_PROVIDERS={'default': {'BACKEND': 'portfolio.providers.SyntheticProvider'}}):
+            search_module._install(index)
+            with CaptureQueriesContext(connection) as ctx:
+                results = search_assets_online('global en')
+            search_module._index = None
+        out(
+            f"{count:>7} assets: index built in {build:.2f}s, query p50 {timings[len(timings) // 2] * 1000:.2f} ms, "
+            f"p99 {timings[int(len(timings) * 0.99)] * 1000:.2f} ms; search_assets_online: {len(results)} results, "
+            f"{len(ctx.captured_queries)} queries"
+        )
+
+@scenario('search_burst')
+def search_burst(out, sizes):
+    """Keystroke bursts missing the local index, sync search on 4 worker threads vs. the async view, synthetic provider with 200 ms per call"""
+    synthetic = {'default': {'BACKEND': 'portfolio.providers.SyntheticProvider', 'OPTIONS': {'latency': 0.2}}}
+    url = reverse('portfolio:asset_search')
+
+    def reset():
+        search_module._install(TickerIndex())
+        with search_module._lock:
+            search_module._learned = TickerIndex()
+
+    with override_settings(MARKET_DATA_PROVIDERS=synthetic):
+        provider = get_provider()
+        calls = []
+        for method in ('search', 'asearch'):
+            original = getattr(provider, method)
+            def counted(query, original=original):
+                calls.append(query)
+                return original(query)
+            setattr(provider, method, counted)
+        try:
+            for sessions in sizes or [10, 50]:
+                # Sessions type 5 letters of a word each, two sessions per word
+                run = time.monotonic_ns() % 10**6
+                words = [f'zq{i // 2}x{run}' for i in range(sessions)]
+                bursts = [[word[:n] for n in range(len(word) - 4, len(word) + 1)] for word in words]
+
+                reset()
+                calls.clear()
+                start = time.perf_counter()
+                with ThreadPoolExecutor(max_workers=4) as pool:
+                    list(pool.map(search_assets_online, [q for burst in bursts for q in burst]))
+                elapsed = time.perf_counter() - start
+                out(f"{sessions:>4} sessions x 5 keystrokes, sync (4 workers): {len(calls):>4} provider calls in {elapsed:6.2f}s")
+
+                reset()
+                cache.delete_many([f"search:online:{hashlib.sha1(q.encode()).hexdigest()}" for burst in bursts for q in burst])
+                calls.clear()
+                clients = [AsyncClient() for _ in range(sessions)]
+                for i, client in enumerate(clients):
+                    client.force_login(_bench_user(f'burst-{sessions}-{i}')[0])
+
+                async def session(client, burst):
+                    requests = []
+                    for q in burst:
+                        requests.append(asyncio.ensure_future(client.get(url, {'q': q}, headers={'HX-Request': 'true'})))
+                        await asyncio.sleep(0.02)
+                    return [r.status_code for r in await asyncio.gather(*requests)]
+
+                async def run_bursts():
+                    return await asyncio.gather(*(session(client, burst) for client, burst in zip(clients, bursts)))
+
+                start = time.perf_counter()
+                statuses = [status for codes in async_to_sync(run_bursts)() for status in codes]
+                elapsed = time.perf_counter() - start
+                out(
+                    f"{sessions:>4} sessions x 5 keystrokes, async view:        {len(calls):>4} provider calls in {elapsed:6.2f}s "
+                    f"({statuses.count(200)} rendered, {statuses.count(204)} dropped as obsolete)"
+                )
+        finally:
+            for method in ('search', 'asearch'):
+                delattr(provider, method)
+
+@scenario('asset_import')
+def asset_import(out, sizes):
+    """Importing a list of tickers, one create_asset_from_ticker call per ticker vs. import_assets, synthetic provider with 100 ms per call"""
+    synthetic = {'default': {'BACKEND': 'portfolio.providers.SyntheticProvider', 'OPTIONS': {'latency': 0.1}}}
+    with override_settings(MARKET_DATA_PROVIDERS=synthetic):
+        for count in sizes or [20, 200]:
+            run = time.monotonic_ns() % 10**6
+            for label in ('per ticker', 'bulk'):
+                tickers = [f'IMP{run}{label[0]}{i}' for i in range(count)]
+                with CaptureQueriesContext(connection) as ctx:
+                    start = time.perf_counter()
+                    if label == 'per ticker':
+                        imported = sum(1 for ticker in tickers if _create_asset_one_by_one(ticker))
+                    else:
+                        report = import_assets(tickers)
+                        imported = len(report['created'])
+                    elapsed = time.perf_counter() - start
+                out(f"{count:>5} tickers, {label:>10}: {imported} imported in {elapsed:6.2f}s, {len(ctx.captured_queries)} queries")
+
+def _create_asset_one_by_one(ticker):
+    # The former create_asset_from_ticker: history, then details, then update_or_create
+    provider = get_provider()
+    closes = close_series(provider.history([ticker], period='1d'), ticker)
+    if closes.empty:
+        return None
+    info = provider.details(ticker)
+    return Asset.objects.update_or_create(ticker=ticker, defaults={
+        'name': info.get('shortName') or ticker,
+        'category': AssetCategory.CRYPTO if info.get('quoteType') == 'CRYPTOCURRENCY' else AssetCategory.STOCKS,
+        'current_price': Decimal(str(closes.iloc[-1].item())),
+        'last_updated': timezone.now(),
+    })[0]
+
+def _price_update_calls(assets):
+    # Upstream requests of one price update over (pk, ticker, category) assets,
+    # sharded like tasks._update_prices_in_shards
+    calls = 0
+    for i in range(0, len(assets), PRICE_SHARD_SIZE):
+        shard = assets[i:i + PRICE_SHARD_SIZE]
+        stocks = sum(1 for _, _, category in shard if category == AssetCategory.STOCKS)
+        cryptos = len(shard) - stocks
+        calls += -(-stocks // settings.YF_DOWNLOAD_CHUNK_SIZE) + -(-cryptos // TICKERS_CHUNK_SIZES['binance'])
+    return calls
+
+@scenario('refresh_schedule')
+def refresh_schedule(out, sizes):
+    """One simulated day of price refreshes (US, Paris and crypto tickers, 20% held, 5% viewed): everything every 15 minutes vs. the due assets every 5 minutes"""
+    for count in sizes or [1000, 10000]:
+        rng = np.random.default_rng(count)
+        kinds = rng.choice(['us', 'pa', 'crypto'], size=count, p=[0.45, 0.35, 0.2])
+        assets = [
+            (i, {'us': f'US{i}', 'pa': f'FR{i}.PA', 'crypto': f'C{i}/USDT'}[kind],
+             AssetCategory.CRYPTO if kind == 'crypto' else AssetCategory.STOCKS)
+            for i, kind in enumerate(kinds)
+        ]
+        # The order of scheduling.due_asset_ids
+        assets.sort(key=lambda asset: (asset[2], asset[1]))
+        held = {i for i in range(count) if rng.random() < 0.2}
+        viewed = {ticker for pk, ticker, _ in assets if pk not in held and rng.random() < 0.05}
+        everything = 96 * _price_update_calls(assets)
+        # A Wednesday and a Saturday, from midnight UTC
+        for label, day in (('weekday', datetime.date(2026, 3, 4)), ('weekend', datetime.date(2026, 3, 7))):
+            checked = {}
+            # The day starts with every asset refreshed just before midnight
+            select_due(assets, held, viewed, checked, datetime.datetime.combine(
+                day, datetime.time(), tzinfo=datetime.timezone.utc) - datetime.timedelta(seconds=SCHEDULER_TICK))
+            quotes = calls = 0
+            start = time.perf_counter()
+            for tick in range(86400 // SCHEDULER_TICK):
+                now = datetime.datetime.combine(day, datetime.time(), tzinfo=datetime.timezone.utc) + datetime.timedelta(seconds=tick * SCHEDULER_TICK)
+                due = set(select_due(assets, held, viewed, checked, now))
+                quotes += len(due)
+                calls += _price_update_calls([a for a in assets if a[0] in due])
+            elapsed = (time.perf_counter() - start) / (86400 // SCHEDULER_TICK)
+            out(
+                f"{count:>6} assets, {label}: every 15 min {96 * count:>8} quotes / {everything:>6} calls, "
+                f"due only {quotes:>8} quotes / {calls:>6} calls ({1 - calls / everything:.0%} fewer calls), "
+                f"{elapsed * 1000:.1f} ms per tick"
+            )
+
+def _legacy_user_valuation(user_id):
+    # The former compute_user_valuation loop: Decimal arithmetic on model instances
+    total_value = total_invested = 0
+    categories = {}
+    rows = []
+    for holding in Holding.objects.filter(portfolio__user_id=user_id).with_value():
+        total_value += holding.value
+        total_invested += holding.invested
+        rows.append({
+            'current_value': holding.value,
+            'current_price': holding.asset.current_price,
+            'pnl': holding.gain,
+            'pnl_percent': (holding.gain / holding.invested * 100) if holding.invested else 0,
+        })
+        category = categories.setdefault(holding.asset.category, {'value': 0, 'invested': 0, 'count': 0})
+        category['value'] += holding.value
+        category['invested'] += holding.invested
+        category['count'] += 1
+    return total_value, total_invested, categories
+
+def _legacy_portfolio_page(portfolio_id):
+    # The former portfolio_detail: annotated model instances, Holding properties
+    # recomputed by every template access
+    portfolio = Portfolio.objects.with_valuation().get(pk=portfolio_id)
+    for holding in Holding.objects.filter(portfolio_id=portfolio_id).with_value():
+        value = holding.quantity * holding.asset.current_price
+        invested = holding.quantity * holding.average_buy_price
+        for _ in range(3):
+            value - holding.quantity * holding.average_buy_price
+        (value - invested) / invested * 100 if invested > 0 else 0
+    return portfolio.total_value
+
+@scenario('valuation_engine')
+def valuation_engine(out, sizes):
+    """Valuation of one account with many holdings, Decimal loops vs. NumPy arrays (valuation_engine.py)"""
+    run = time.monotonic_ns() % 10**6
+    assets = Asset.objects.bulk_create([
+        Asset(ticker=f'VE{run}-{i}', name=f'Engine {i}', category=AssetCategory.values[i % 4],
+              current_price=Decimal(10 + i % 500) / 7)
+        for i in range(2000)
+    ], batch_size=1000)
+    for count in sizes or [10000, 100000]:
+        user, _ = _bench_user(f'engine-{count}')
+        portfolios = Portfolio.objects.bulk_create([Portfolio(user=user, name=f'Engine {i}') for i in range(10)])
+        Holding.objects.bulk_create([
+            Holding(portfolio=portfolios[i % 10], asset=assets[i % len(assets)],
+                    quantity=Decimal(i % 97 + 1) / 3, average_buy_price=Decimal(i % 400 + 5) / 7)
+            for i in range(count)
+        ], batch_size=5000)
+        holdings = Holding.objects.filter(portfolio__user=user)
+
+        def timed(func):
+            start = time.perf_counter()
+            result = func()
+            return result, (time.perf_counter() - start) * 1000
+
+        (legacy_total, _, _), legacy = timed(lambda: _legacy_user_valuation(user.pk))
+        valuation, engine = timed(lambda: compute_user_valuation(user.pk))
+        out(
+            f"{count:>7} holdings, dashboard valuation:  Decimal loop {legacy:8.1f} ms, arrays {engine:8.1f} ms "
+            f"(net worth {legacy_total:.2f} vs {valuation['total_net_worth']})"
+        )
+
+        _, legacy = timed(lambda: (holdings.totals(), list(holdings.by_category()), holdings.by_asset().first()))
+        _, engine = timed(lambda: (lambda a: (a.total_value(), a.by_category(), a.sum_by(a.columns['asset_id'])))(
+            HoldingArrays.load(holdings, 'asset_id')))
+        out(f"{count:>7} holdings, insights figures:     3 SQL aggregates {legacy:8.1f} ms, arrays {engine:8.1f} ms")
+
+        legacy_total, legacy = timed(lambda: _legacy_portfolio_page(portfolios[0].pk))
+        valuation, engine = timed(lambda: compute_portfolio_valuation(portfolios[0].pk))
+        out(
+            f"{count:>7} holdings, portfolio_detail ({count // 10} rows): Decimal properties {legacy:8.1f} ms, "
+            f"arrays {engine:8.1f} ms (total {legacy_total:.2f} vs {valuation['total_value']})"
+        )
+
+        _, legacy = timed(lambda: list(Portfolio.objects.filter(user=user).with_valuation().values_list('pk', 'total_value', 'total_invested')))
+        _, engine = timed(lambda: (lambda a: (a.sum_by(a.columns['portfolio_id']), a.sum_by(a.columns['portfolio_id'], 'invested')))(
+            HoldingArrays.load(holdings, 'portfolio_id')))
+        out(f"{count:>7} holdings, snapshot totals:      SQL GROUP BY {legacy:8.1f} ms, arrays {engine:8.1f} ms")
+
+class _AsgiStream:
+    """
+    One price stream request driven straight through an ASGI app.
+    """
+    def __init__(self, app, path, cookie):
+        self.incoming = asyncio.Queue()
+        self.outgoing = asyncio.Queue()
+        scope = {
+            'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET', 'scheme': 'http',
+            'path': path, 'raw_path': path.encode(), 'root_path': '', 'query_string': b'',
+            'headers': [(b'host', b'testserver'), (b'cookie', cookie.encode())],
+            'client': ('127.0.0.1', 0), 'server': ('testserver', 80),
+        }
+        self.incoming.put_nowait({'type': 'http.request', 'body': b'', 'more_body': False})
+        self.task = asyncio.ensure_future(app(scope, self.incoming.get, self.outgoing.put))
+
+    async def opened(self):
+        # Status, after the first chunk ('retry:') of a successful stream
+        start = await asyncio.wait_for(self.outgoing.get(), 30)
+        if start['status'] == 200:
+            await self.next_chunk()
+        return start['status']
+
+    async def next_chunk(self, timeout=30):
+        message = await asyncio.wait_for(self.outgoing.get(), timeout)
+        return message.get('body', b'').decode()
+
+    async def close(self):
+        self.incoming.put_nowait({'type': 'http.disconnect'})
+        try:
+            await asyncio.wait_for(self.task, 5)
+        except asyncio.TimeoutError:
+            # Django's handler does not watch for disconnects while streaming
+            pass
+
+async def _hold_streams(app, cookie, count, ticker):
+    path = reverse('portfolio:price_stream')
+    streams = [_AsgiStream(app, path, cookie) for _ in range(count)]
+    statuses = await asyncio.gather(*(stream.opened() for stream in streams))
+    idle = threading.active_count()
+    get_broker().publish({'prices': {ticker: 1.0}})
+    chunks = await asyncio.gather(*(stream.next_chunk() for stream in streams))
+    await asyncio.gather(*(stream.close() for stream in streams))
+    return statuses, idle, sum(chunk.startswith('event: prices') for chunk in chunks)
+
+@scenario('stream_threads', atomic=False)
+def stream_threads(out, sizes):
+    """Threads held by open price streams, through Django's ASGI handler vs. the stream router of asgi.py"""
+    from wealthgravity.asgi import application, django_application
+    user, client = _bench_user('stream')
+    asset = Asset.objects.create(
+        ticker=f'STRM{time.monotonic_ns() % 10**6}', name='Stream', category=AssetCategory.STOCKS, current_price=Decimal(10),
+    )
+    portfolio = Portfolio.objects.create(user=user, name='Stream')
+    Holding.objects.create(portfolio=portfolio, asset=asset, quantity=1, average_buy_price=10)
+    cookie = f"{settings.SESSION_COOKIE_NAME}={client.cookies[settings.SESSION_COOKIE_NAME].value}"
+    try:
+        for count in sizes or [10, 100, 500]:
+            for label, app in [('Django handler', django_application), ('stream router', application)]:
+                before = threading.active_count()
+                statuses, idle, delivered = asyncio.run(_hold_streams(app, cookie, count, asset.ticker))
+                out(
+                    f"{count:>5} streams, {label:>14}: {before} threads before, {idle:>4} while open, "
+                    f"{statuses.count(200)} opened, {delivered} got the update"
+                )
+    finally:
+        client.logout()
+        user.delete()
+        asset.delete()
@@ -0,0 +1,123 @@
+"""
+Stale-while-revalidate reads with single-flight refreshes.
+
+Entries carry a soft expiry (`fresh_until`) inside a cache entry that lives for
+the hard TTL. Past the soft expiry the stale value is still served at once, and
+only the caller winning the refresh lock recomputes it, in the background.
+When the entry is missing altogether, the lock winner computes it inline while
+everybody else waits for its result, so one key costs one upstream call
+however many workers miss at the same moment.
+"""
+import threading
+import time
+from django.core.cache import cache
+from django.db import connection
+import logging
+
+logger = logging.getLogger(__name__)
+
+# How long a refresh may hold the lock before another caller may retry
+REFRESH_LOCK_TTL = 30
+# How long the lock is kept after a failed refresh, so that an upstream outage
+# costs one call per key every few seconds rather than one per request
+REFRESH_BACKOFF = 5
+# How long callers wait for a concurrent cold fetch before fetching themselves
+COLD_WAIT = 5
+COLD_POLL_INTERVAL = 0.05
+
+def _lock_key(key):
+    return f'{key}:refresh'
+
+def _store(key, value, fresh_for, keep_for):
+    cache.set(key, {'value': value, 'fresh_until': time.time() + fresh_for}, keep_for)
+
+def _back_off(key):
+    # Turns the refresh lock into a short backoff
+    cache.set(_lock_key(key), 1, REFRESH_BACKOFF)
+
+def _refresh(key, fetch, fresh_for, keep_for):
+    try:
+        _store(key, fetch(), fresh_for, keep_for)
+    except Exception as e:
+        # The stale value keeps being served until keep_for runs out
+        logger.error(f"Error refreshing {key}: {e}")
+        _back_off(key)
+    else:
+        cache.delete(_lock_key(key))
+
+def _refresh_in_background(key, fetch, fresh_for, keep_for):
+    def run():
+        try:
+            _refresh(key, fetch, fresh_for, keep_for)
+        finally:
+            # The thread's own database connection, if fetch() used one
+            connection.close()
+    threading.Thread(target=run, name=f'refresh {key}', daemon=True).start()
+
+def get_or_refresh(key, fetch, fresh_for, keep_for, fallback=None, fallback_for=60):
+    """
+    Returns the value cached under `key`, computed by `fetch()`.
+
+    The value is fresh for `fresh_for` seconds and kept (served stale while
+    refreshing) for `keep_for` seconds. If fetch() raises on a cold miss,
+    `fallback(exception)` is returned and cached as fresh for `fallback_for`
+    seconds; without a fallback the exception propagates.
+    """
+    entry = cache.get(key)
+    if entry is not None:
+        if entry['fresh_until'] <= time.time() and cache.add(_lock_key(key), 1, REFRESH_LOCK_TTL):
+            _refresh_in_background(key, fetch, fresh_for, keep_for)
+        return entry['value']
+
+    locked = cache.add(_lock_key(key), 1, REFRESH_LOCK_TTL)
+    if not locked:
+        # Someone else is computing it: wait for their result
+        deadline = time.monotonic() + COLD_WAIT
+        while time.monotonic() < deadline:
+            time.sleep(COLD_POLL_INTERVAL)
+            entry = cache.get(key)
+            if entry is not None:
+                return entry['value']
+        logger.warning(f"Gave up waiting for {key}, fetching it")
+
+    try:
+        value = fetch()
+        _store(key, value, fresh_for, keep_for)
+    except Exception as e:
+        if fallback is None:
+            raise
+        logger.error(f"Error fetching {key}: {e}")
+        value = fallback(e)
+        _store(key, value, fallback_for, keep_for)
+    finally:
+        # Released only once the value is stored, so no second cold fetch slips in
+        if locked:
+            cache.delete(_lock_key(key))
+    return value
+
+def refresh(key, fetch, fresh_for, keep_for, min_fresh=0):
+    """
+    Recomputes the value under `key` ahead of time, unless it stays fresh for
+    another `min_fresh` seconds or another caller is already refreshing it.
+    Returns whether fetch() ran. Exceptions of fetch() propagate, the entry
+    in place is left untouched and not refreshed again for REFRESH_BACKOFF
+    seconds.
+    """
+    entry = cache.get(key)
+    if entry is not None and entry['fresh_until'] > time.time() + min_fresh:
+        return False
+    if not cache.add(_lock_key(key), 1, REFRESH_LOCK_TTL):
+        return False
+    try:
+        _store(key, fetch(), fresh_for, keep_for)
+    except Exception:
+        _back_off(key)
+        raise
+    cache.delete(_lock_key(key))
+    return True
+
+def is_fresh(entry):
+    """
+    Whether a raw cache entry written by this module is within its soft expiry.
+    """
+    return entry is not None and entry['fresh_until'] > time.time()
@@ -0,0 +1,22 @@
+"""
+System checks of the portfolio app.
+"""
+from django.core import checks
+from django.core.cache import caches
+from .tiered_cache import is_process_local
+
+@checks.register(checks.Tags.caches)
+def check_shared_cache(app_configs, **kwargs):
+    # Valuations, refresh locks, cache warming and the price schedule are
+    # coordinated through the default cache
+    if is_process_local(caches['default']):
+        return [checks.Warning(
+            "The default cache is local to each process.",
+            hint=(
+                "Web and Celery processes will not see each other's cache entries: refresh locks, warmed "
+                "market data and the price schedule stay per process. Leave CACHE_URL unset (database) "
+                "or point it to Redis unless a single process serves everything."
+            ),
+            id='portfolio.W001',
+        )]
+    return []
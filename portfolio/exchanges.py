@@ -0,0 +1,95 @@
+"""
+Long-lived ccxt exchange clients.
+
+Building a ccxt exchange per run reloads its markets and throws away its HTTP
+session (and the TLS connections in it). Clients are kept per process instead,
+markets are reloaded once MARKETS_TTL has passed, and tickers are fetched in
+chunks sized to what the exchange accepts per request, in parallel.
+"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import ccxt
+from .telemetry import bind_run, upstream
+import logging
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_EXCHANGE = 'binance'
+MARKETS_TTL = 60 * 60
+# Symbols per fetch_tickers request (query string length / weight limits)
+TICKERS_CHUNK_SIZES = {'binance': 100}
+DEFAULT_TICKERS_CHUNK_SIZE = 50
+FETCH_WORKERS = 4
+
+_clients = {}
+_markets_loaded_at = {}
+# Guards the registries above; markets are loaded under a lock of their
+# exchange only, so a slow exchange never holds up the others
+_lock = threading.Lock()
+_markets_locks = {}
+
+def get_exchange(name=DEFAULT_EXCHANGE):
+    """
+    Process-wide client of a ccxt exchange, created on first use.
+    """
+    with _lock:
+        exchange = _clients.get(name)
+        if exchange is None:
+            exchange = getattr(ccxt, name)({'enableRateLimit': True})
+            _clients[name] = exchange
+        return exchange
+
+def _markets_lock(exchange_id):
+    with _lock:
+        return _markets_locks.setdefault(exchange_id, threading.Lock())
+
+def load_markets(exchange):
+    """
+    Markets of `exchange`, reloaded from the API at most every MARKETS_TTL seconds.
+    Concurrent callers wait for a single reload.
+    """
+    with _markets_lock(exchange.id):
+        loaded_at = _markets_loaded_at.get(exchange.id)
+        if loaded_at is None or time.monotonic() - loaded_at > MARKETS_TTL:
+            with upstream(exchange.id, 'load_markets'):
+                exchange.load_markets(reload=loaded_at is not None)
+            _markets_loaded_at[exchange.id] = time.monotonic()
+    return exchange.markets
+
+def _fetch_chunk(exchange, symbols):
+    # A failing chunk is split in halves so one bad symbol only costs itself
+    try:
+        with upstream(exchange.id, 'fetch_tickers'):
+            return exchange.fetch_tickers(symbols)
+    except Exception as e:
+        if len(symbols) == 1:
+            logger.error(f"Error fetching crypto {symbols[0]} on {exchange.id}: {e}")
+            return {}
+        middle = len(symbols) // 2
+        return {**_fetch_chunk(exchange, symbols[:middle]), **_fetch_chunk(exchange, symbols[middle:])}
+
+def fetch_tickers(symbols, exchange_name=DEFAULT_EXCHANGE):
+    """
+    Tickers ({symbol: ccxt ticker dict}) of `symbols`. Symbols the exchange
+    does not list are skipped; missing symbols are simply absent from the result.
+    """
+    exchange = get_exchange(exchange_name)
+    markets = load_markets(exchange)
+    requested = list(dict.fromkeys(symbols))
+    known = [s for s in requested if s in markets]
+    if len(known) < len(requested):
+        logger.warning(f"{len(requested) - len(known)} symbols are not listed on {exchange.id}")
+    if not known:
+        return {}
+
+    size = TICKERS_CHUNK_SIZES.get(exchange.id, DEFAULT_TICKERS_CHUNK_SIZE)
+    chunks = [known[i:i + size] for i in range(0, len(known), size)]
+    if len(chunks) == 1:
+        return _fetch_chunk(exchange, chunks[0])
+
+    tickers = {}
+    with ThreadPoolExecutor(max_workers=min(FETCH_WORKERS, len(chunks))) as pool:
+        for result in pool.map(bind_run(lambda chunk: _fetch_chunk(exchange, chunk)), chunks):
+            tickers.update(result)
+    return tickers
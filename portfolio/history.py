@@ -0,0 +1,243 @@
+import datetime
+import re
+import time
+import numpy as np
+import pandas as pd
+from django.db import connection, transaction
+from django.db.models import Q, Sum
+from django.utils import timezone
+from .models import AssetPrice, Holding, NetWorthHistory, Portfolio, PortfolioHistory, Transaction
+import logging
+
+logger = logging.getLogger(__name__)
+
+def refresh_net_worth_history(user_ids=None, dates=None, since=None):
+    """
+    Rebuilds the NetWorthHistory rollup from PortfolioHistory.
+    Pass user_ids, dates and/or since (first date) to only refresh that slice
+    (e.g. today's row after the nightly snapshot). Returns the number of
+    rollup rows written.
+    """
+    history = PortfolioHistory.objects.all()
+    rollup = NetWorthHistory.objects.all()
+    if user_ids is not None:
+        history = history.filter(portfolio__user_id__in=user_ids)
+        rollup = rollup.filter(user_id__in=user_ids)
+    if dates is not None:
+        history = history.filter(date__in=dates)
+        rollup = rollup.filter(date__in=dates)
+    if since is not None:
+        history = history.filter(date__gte=since)
+        rollup = rollup.filter(date__gte=since)
+
+    # One grouped query: sum every portfolio of a user per day
+    rows = (
+        history.order_by()
+        .values('portfolio__user_id', 'date')
+        .annotate(total=Sum('total_value'), invested=Sum('invested_value'))
+    )
+    objs = [
+        NetWorthHistory(
+            user_id=row['portfolio__user_id'],
+            date=row['date'],
+            total_value=row['total'],
+            invested_value=row['invested'],
+        )
+        for row in rows
+    ]
+
+    # Replace the slice wholesale so dates whose portfolio history disappeared
+    # (deleted portfolio) are dropped from the rollup as well.
+    with transaction.atomic():
+        rollup.delete()
+        NetWorthHistory.objects.bulk_create(objs, batch_size=1000)
+    return len(objs)
+
+def revalue_portfolio_snapshot(portfolio_id, user_id, date):
+    """
+    Re-values an existing PortfolioHistory row from the current holdings and
+    refreshes the owner's rollup for that day. Used when holdings change after
+    the day's snapshot was already taken. Does nothing if there is no snapshot.
+    """
+    totals = Holding.objects.filter(portfolio_id=portfolio_id).totals()
+    updated = PortfolioHistory.objects.filter(portfolio_id=portfolio_id, date=date).update(
+        total_value=round(totals['total_value'], 2),
+        invested_value=round(totals['total_invested'], 2),
+    )
+    if updated:
+        refresh_net_worth_history(user_ids=[user_id], dates=[date])
+    return updated
+
+# Portfolios reconstructed per pass, bounds the (holdings x days) matrices
+REBUILD_CHUNK_SIZE = 250
+WRITE_BATCH_SIZE = 5000
+# Stored closes older than the first rebuilt day, used to forward-fill it
+PRICE_LOOKBACK_DAYS = 10
+
+# Description written by views.holding_create: "Achat AAPL (1.5 @ 180.00)".
+# Only read for buys recorded before the asset/quantity/unit_price fields.
+BUY_DESCRIPTION = re.compile(r'^Achat (?P<ticker>\S+) \((?P<quantity>[\d.]+) @ (?P<price>[\d.]+)\)$')
+
+def _price_matrix(assets, since, until):
+    """
+    (assets x days) float matrix of daily closes from AssetPrice, carried
+    forward over weekends/holidays. Assets without any stored close use
+    their current price.
+    """
+    days = pd.date_range(since, until, freq='D').date
+    rows = AssetPrice.objects.filter(
+        asset_id__in=[a[0] for a in assets],
+        date__gte=since - datetime.timedelta(days=PRICE_LOOKBACK_DAYS),
+        date__lte=until,
+    ).values_list('asset_id', 'date', 'close')
+    frame = pd.DataFrame.from_records(list(rows), columns=['asset_id', 'date', 'close'])
+    if frame.empty:
+        matrix = pd.DataFrame(np.nan, index=[a[0] for a in assets], columns=days)
+    else:
+        frame['close'] = frame['close'].astype(float)
+        all_days = sorted(set(days) | set(frame['date']))
+        matrix = (
+            frame.pivot(index='asset_id', columns='date', values='close')
+            .reindex(index=[a[0] for a in assets], columns=all_days)
+            .ffill(axis=1)
+            .bfill(axis=1)
+            .loc[:, days]
+        )
+    values = matrix.to_numpy(dtype=float, copy=True)
+    current = np.array([a[1] for a in assets], dtype=float)
+    missing = np.isnan(values)
+    values[missing] = np.broadcast_to(current[:, None], values.shape)[missing]
+    return values
+
+def _rebuild_chunk(portfolio_ids, since, until):
+    """
+    Rebuilds the history of a chunk of portfolios. Quantities and costs are
+    laid out as (holdings x days) matrices: today's position minus every buy
+    recorded after each day. Returns (portfolio_id, date, total, invested) rows.
+    """
+    holdings = list(
+        Holding.objects.filter(portfolio_id__in=portfolio_ids)
+        .order_by('portfolio_id', 'pk')
+        .values_list('portfolio_id', 'portfolio__user_id', 'asset_id', 'asset__ticker',
+                     'asset__current_price', 'quantity', 'average_buy_price')
+    )
+    n_days = (until - since).days + 1
+    history_dates = [connection.ops.adapt_datefield_value(since + datetime.timedelta(days=i)) for i in range(n_days)]
+    with_holdings = {h[0] for h in holdings}
+    rows = [(pid, d, 0, 0) for pid in portfolio_ids if pid not in with_holdings for d in history_dates]
+    if not holdings:
+        return rows
+
+    assets = list(dict.fromkeys((h[2], h[4]) for h in holdings))
+    asset_index = {asset_id: i for i, (asset_id, _) in enumerate(assets)}
+    prices = _price_matrix(assets, since, until)[[asset_index[h[2]] for h in holdings]]
+
+    quantity = np.array([h[5] for h in holdings], dtype=float)
+    cost = quantity * np.array([h[6] for h in holdings], dtype=float)
+
+    # Buys after each day, split across the user's holdings of that asset pro rata
+    by_user_asset = {}
+    tickers = {}
+    for i, h in enumerate(holdings):
+        by_user_asset.setdefault((h[1], h[2]), []).append(i)
+        tickers[h[3]] = h[2]
+    bought_qty = np.zeros((len(holdings), n_days + 1))
+    bought_cost = np.zeros((len(holdings), n_days + 1))
+    buys = Transaction.objects.filter(
+        Q(asset__isnull=False, quantity__isnull=False, unit_price__isnull=False) | Q(description__startswith='Achat '),
+        user_id__in={h[1] for h in holdings}, date__gt=since,
+    ).values_list('pk', 'user_id', 'date', 'asset_id', 'quantity', 'unit_price', 'description')
+    unparsed = []
+    for pk, user_id, date, asset_id, bought, price, description in buys:
+        if asset_id is None or bought is None or price is None:
+            match = BUY_DESCRIPTION.match(description)
+            if match is None:
+                unparsed.append(pk)
+                continue
+            asset_id, bought, price = tickers.get(match['ticker']), match['quantity'], match['price']
+        targets = by_user_asset.get((user_id, asset_id))
+        if not targets:
+            continue
+        held = quantity[targets].sum()
+        weights = quantity[targets] / held if held else np.full(len(targets), 1 / len(targets))
+        day = min((date - since).days, n_days)  # buys after `until` land in the last column
+        bought_qty[targets, day] += float(bought) * weights
+        bought_cost[targets, day] += float(bought) * float(price) * weights
+    if unparsed:
+        logger.warning(
+            f"Skipped {len(unparsed)} buy transactions whose description could not be read: "
+            f"ids {', '.join(map(str, unparsed[:20]))}{', ...' if len(unparsed) > 20 else ''}"
+        )
+
+    # after[:, d] = everything bought strictly after day d
+    after_qty = bought_qty[:, ::-1].cumsum(axis=1)[:, ::-1][:, 1:]
+    after_cost = bought_cost[:, ::-1].cumsum(axis=1)[:, ::-1][:, 1:]
+    quantities = np.clip(quantity[:, None] - after_qty, 0, None)
+    invested = np.clip(cost[:, None] - after_cost, 0, None)
+
+    # Sum holdings rows per portfolio (holdings are sorted by portfolio)
+    owners = np.array([h[0] for h in holdings])
+    starts = np.flatnonzero(np.r_[True, owners[1:] != owners[:-1]])
+    totals = np.round(np.add.reduceat(quantities * prices, starts, axis=0), 2)
+    invested_totals = np.round(np.add.reduceat(invested, starts, axis=0), 2)
+
+    for pid, total_row, invested_row in zip(owners[starts].tolist(), totals.tolist(), invested_totals.tolist()):
+        rows.extend(zip([pid] * n_days, history_dates, total_row, invested_row))
+    return rows
+
+def _upsert_history(rows):
+    """
+    Writes (portfolio_id, date, total_value, invested_value) tuples with
+    multi-row INSERT ... ON CONFLICT (portfolio, date) DO UPDATE statements.
+    At this volume model instantiation and SQL compilation in bulk_create
+    cost far more than the database itself.
+    """
+    meta = PortfolioHistory._meta
+    qn = connection.ops.quote_name
+    columns = [meta.get_field(name).column for name in ('portfolio', 'date', 'total_value', 'invested_value')]
+    max_params = connection.features.max_query_params
+    batch_size = min(WRITE_BATCH_SIZE, max_params // len(columns)) if max_params else WRITE_BATCH_SIZE
+    prefix = f"INSERT INTO {qn(meta.db_table)} ({', '.join(qn(c) for c in columns)}) VALUES "
+    suffix = (
+        f" ON CONFLICT ({qn(columns[0])}, {qn(columns[1])}) DO UPDATE SET "
+        f"{qn(columns[2])} = EXCLUDED.{qn(columns[2])}, {qn(columns[3])} = EXCLUDED.{qn(columns[3])}"
+    )
+    with connection.cursor() as cursor:
+        for i in range(0, len(rows), batch_size):
+            batch = rows[i:i + batch_size]
+            sql = prefix + ', '.join(['(%s, %s, %s, %s)'] * len(batch)) + suffix
+            cursor.execute(sql, [value for row in batch for value in row])
+
+def rebuild_portfolio_history(since, until=None, portfolio_ids=None, chunk_size=REBUILD_CHUNK_SIZE):
+    """
+    Rebuilds PortfolioHistory from `since` to `until` (yesterday by default)
+    out of holdings, buy transactions (their asset, quantity and unit_price,
+    or the description of older ones) and stored daily prices, then refreshes
+    the owners' net worth rollup. Rows are written with multi-row upserts.
+    Returns a dict of run statistics.
+    """
+    start = time.perf_counter()
+    until = until or timezone.localdate() - datetime.timedelta(days=1)
+    stats = {'portfolios': 0, 'rows': 0, 'duration': 0}
+    if since > until:
+        return stats
+
+    portfolios = Portfolio.objects.order_by('pk')
+    if portfolio_ids is not None:
+        portfolios = portfolios.filter(pk__in=portfolio_ids)
+    ids = list(portfolios.values_list('pk', flat=True))
+
+    for i in range(0, len(ids), chunk_size):
+        rows = _rebuild_chunk(ids[i:i + chunk_size], since, until)
+        with transaction.atomic():
+            _upsert_history(rows)
+        stats['rows'] += len(rows)
+        logger.info(f"Rebuilt history of {min(i + chunk_size, len(ids))}/{len(ids)} portfolios")
+
+    user_ids = list(portfolios.order_by('user_id').values_list('user_id', flat=True).distinct())
+    for i in range(0, len(user_ids), chunk_size):
+        refresh_net_worth_history(user_ids=user_ids[i:i + chunk_size], since=since)
+
+    stats['portfolios'] = len(ids)
+    stats['duration'] = time.perf_counter() - start
+    return stats
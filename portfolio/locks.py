@@ -0,0 +1,211 @@
+"""
+Leases keeping periodic tasks from overlapping.
+
+A lease is a lock with an expiry: the holder renews it while it works (see
+Lease.heartbeat) and it lapses on its own if the holder dies, so a crashed
+worker never blocks the next run for longer than LEASE_TTL. Each lease is
+identified by a random token, so only its holder can renew or release it,
+and the token can be handed to other tasks (the shards and callback of a
+chord) that carry the run on. Until those start, the task that dispatched
+them keeps the lease alive from its process (Lease.keep_alive).
+
+A run that finds the lease taken either gives up, or asks for a rerun
+(Lease.request_rerun) that the holder honours once it is done, so any
+number of overlapping requests coalesce into a single extra run.
+"""
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from django.conf import settings
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Seconds a lease lasts without being renewed
+LEASE_TTL = 600
+
+class InMemoryLeaseStore:
+    """
+    In-process leases. Used by tests and single-process setups.
+    """
+    def __init__(self):
+        self._leases = {}  # key -> (token, expires_at)
+        self._flags = {}  # key -> expires_at
+        self._lock = threading.Lock()
+
+    def _owner(self, key):
+        token, expires_at = self._leases.get(key, (None, 0))
+        return token if expires_at > time.monotonic() else None
+
+    def acquire(self, key, token, ttl):
+        with self._lock:
+            if self._owner(key) is not None:
+                return False
+            self._leases[key] = (token, time.monotonic() + ttl)
+            return True
+
+    def renew(self, key, token, ttl):
+        with self._lock:
+            if self._owner(key) != token:
+                return False
+            self._leases[key] = (token, time.monotonic() + ttl)
+            return True
+
+    def release(self, key, token):
+        with self._lock:
+            if self._owner(key) != token:
+                return False
+            del self._leases[key]
+            return True
+
+    def set_flag(self, key, ttl):
+        with self._lock:
+            self._flags[key] = time.monotonic() + ttl
+
+    def pop_flag(self, key):
+        with self._lock:
+            return self._flags.pop(key, 0) > time.monotonic()
+
+class RedisLeaseStore:
+    """
+    Leases shared by every worker, as Redis keys holding the token and
+    expiring with the lease. Renewal and release check the token atomically.
+    """
+    RENEW = """
+        if redis.call('get', KEYS[1]) == ARGV[1] then
+            return redis.call('pexpire', KEYS[1], ARGV[2])
+        end
+        return 0
+    """
+    RELEASE = """
+        if redis.call('get', KEYS[1]) == ARGV[1] then
+            return redis.call('del', KEYS[1])
+        end
+        return 0
+    """
+
+    def __init__(self, url):
+        import redis
+        self._client = redis.Redis.from_url(url)
+        self._renew = self._client.register_script(self.RENEW)
+        self._release = self._client.register_script(self.RELEASE)
+
+    def acquire(self, key, token, ttl):
+        return bool(self._client.set(key, token, nx=True, px=int(ttl * 1000)))
+
+    def renew(self, key, token, ttl):
+        return bool(self._renew(keys=[key], args=[token, int(ttl * 1000)]))
+
+    def release(self, key, token):
+        return bool(self._release(keys=[key], args=[token]))
+
+    def set_flag(self, key, ttl):
+        self._client.set(key, 1, px=int(ttl * 1000))
+
+    def pop_flag(self, key):
+        return self._client.getdel(key) is not None
+
+_store = None
+
+def get_lease_store():
+    """
+    Process-wide lease store selected by settings.TASK_LOCK_URL
+    ('memory://' for the in-process stand-in, a redis:// URL otherwise).
+    """
+    global _store
+    if _store is None:
+        url = settings.TASK_LOCK_URL
+        if url.startswith('memory://'):
+            _store = InMemoryLeaseStore()
+        else:
+            _store = RedisLeaseStore(url)
+    return _store
+
+class Lease:
+    """
+    Lease `name`, held if `token` is given (e.g. received from the task that
+    acquired it), to be acquired otherwise.
+    """
+    def __init__(self, name, token=None, ttl=LEASE_TTL):
+        self.name = name
+        self.token = token
+        self.ttl = ttl
+        self.key = f'task-lease:{name}'
+        self.lost = False
+
+    def acquire(self):
+        """
+        Takes the lease if nobody holds it. Returns whether it was taken.
+        """
+        token = uuid.uuid4().hex
+        if get_lease_store().acquire(self.key, token, self.ttl):
+            self.token = token
+            return True
+        return False
+
+    def renew(self):
+        """
+        Extends the lease by its ttl. False if it lapsed and someone else
+        may hold it by now.
+        """
+        if self.token is None or not get_lease_store().renew(self.key, self.token, self.ttl):
+            self.lost = True
+            return False
+        return True
+
+    def release(self):
+        if self.token is None:
+            return False
+        return get_lease_store().release(self.key, self.token)
+
+    def request_rerun(self):
+        """
+        Asks the current holder to run once more when done (see rerun_requested).
+        """
+        get_lease_store().set_flag(f'{self.key}:rerun', self.ttl)
+
+    def rerun_requested(self):
+        """
+        Whether a rerun was requested since the last call.
+        """
+        return get_lease_store().pop_flag(f'{self.key}:rerun')
+
+    @contextmanager
+    def heartbeat(self):
+        """
+        Renews the lease every ttl / 3 seconds while the block runs.
+        A lease that was lost is reported, not acted upon: the block has
+        started writing and is left to finish.
+        """
+        stop = threading.Event()
+        def beat():
+            while self.renew():
+                if stop.wait(self.ttl / 3):
+                    return
+            logger.warning(f"Lease {self.name} lost, another run may be overlapping")
+        thread = threading.Thread(target=beat, name=f'lease {self.name}', daemon=True)
+        thread.start()
+        try:
+            yield self
+        finally:
+            stop.set()
+            thread.join()
+
+    def keep_alive(self, max_age):
+        """
+        Renews the lease every ttl / 3 seconds from a background thread,
+        until it is released or lost, or for `max_age` seconds at most. For a
+        task handing the lease to a chord: it returns while the shards and
+        the callback may still be queued, and they only renew the lease once
+        they run. Returns the thread.
+        """
+        deadline = time.monotonic() + max_age
+        def beat():
+            while time.monotonic() < deadline:
+                time.sleep(min(self.ttl / 3, max(deadline - time.monotonic(), 0)))
+                if not self.renew():
+                    return
+        thread = threading.Thread(target=beat, name=f'lease {self.name} (queued)', daemon=True)
+        thread.start()
+        return thread
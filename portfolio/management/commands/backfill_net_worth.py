@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+from portfolio.history import refresh_net_worth_history
+from portfolio.models import Portfolio
+
+class Command(BaseCommand):
+    help = 'Rebuilds the per-user daily net worth rollup from portfolio history'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, action='append', dest='users', help='Only rebuild this user id (repeatable)')
+        parser.add_argument('--batch-size', type=int, default=500, help='Number of users rolled up per query')
+
+    def handle(self, *args, **options):
+        user_ids = options['users'] or list(
+            Portfolio.objects.order_by('user_id').values_list('user_id', flat=True).distinct()
+        )
+        if not user_ids:
+            self.stdout.write(self.style.WARNING("No portfolios found. Nothing to backfill."))
+            return
+
+        batch_size = options['batch_size']
+        written = 0
+        for i in range(0, len(user_ids), batch_size):
+            written += refresh_net_worth_history(user_ids=user_ids[i:i + batch_size])
+            self.stdout.write(f"Rolled up {min(i + batch_size, len(user_ids))}/{len(user_ids)} users...")
+
+        self.stdout.write(self.style.SUCCESS(f"Successfully wrote {written} net worth rows for {len(user_ids)} users"))
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+from portfolio import prices
+from portfolio.models import Asset
+
+class Command(BaseCommand):
+    help = 'Downloads daily closes missing from the local price history'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ticker', action='append', dest='tickers', help='Only top up this ticker (repeatable)')
+        parser.add_argument('--days', type=int, default=prices.DEFAULT_HISTORY_DAYS, help='History depth for assets without stored prices')
+
+    def handle(self, *args, **options):
+        assets = Asset.objects.all()
+        if options['tickers']:
+            assets = assets.filter(ticker__in=options['tickers'])
+        if not assets.exists():
+            self.stdout.write(self.style.WARNING("No assets found. Seed assets first."))
+            return
+
+        rows = prices.top_up_prices(assets, days=options['days'])
+        self.stdout.write(self.style.SUCCESS(f"Successfully stored up to {rows} daily prices for {assets.count()} assets"))
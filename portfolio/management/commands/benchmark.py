@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from portfolio.benchmarks import SCENARIOS, run
+
+class Command(BaseCommand):
+    help = 'Runs a performance benchmark scenario. Data created by the scenario is rolled back.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('scenario', choices=sorted(SCENARIOS))
+        parser.add_argument('--sizes', type=int, nargs='+', help='Problem sizes to run (scenario specific)')
+
+    def handle(self, *args, **options):
+        name = options['scenario']
+        self.stdout.write(f"Running benchmark '{name}': {SCENARIOS[name].__doc__.strip()}")
+        run(name, self.stdout.write, sizes=options['sizes'])
+        self.stdout.write(self.style.SUCCESS("Benchmark completed."))
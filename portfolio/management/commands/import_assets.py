@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand, CommandError
+from portfolio.models import AssetCategory
+from portfolio.services import import_assets
+
+class Command(BaseCommand):
+    help = 'Creates or updates assets for a list of tickers, resolved in bulk'
+
+    def add_arguments(self, parser):
+        parser.add_argument('tickers', nargs='*', help='Tickers to import')
+        parser.add_argument('--file', help='File with one ticker per line')
+        parser.add_argument('--category', choices=AssetCategory.values, help='Category of every ticker (inferred by default)')
+
+    def handle(self, *args, **options):
+        tickers = list(options['tickers'])
+        if options['file']:
+            with open(options['file']) as f:
+                tickers += f.read().splitlines()
+        if not tickers:
+            raise CommandError("Give tickers as arguments or with --file")
+
+        report = import_assets(tickers, category=options['category'])
+        for ticker in report['failed']:
+            self.stdout.write(self.style.WARNING(f"Could not import {ticker} (no price found or invalid ticker)"))
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {len(report['created'])} new and {len(report['updated'])} existing assets, "
+            f"{len(report['failed'])} failed"
+        ))
@@ -1,54 +1,33 @@
-import random
-from datetime import timedelta
-from django.core.management.base import BaseCommand
+import datetime
+from django.core.management.base import BaseCommand, CommandError
 from django.utils import timezone
-from portfolio.models import Portfolio, PortfolioHistory
+from portfolio.history import rebuild_portfolio_history
+from portfolio.models import Portfolio
 
 class Command(BaseCommand):
-    help = 'Populates 30 days of fake history for all portfolios'
+    help = 'Rebuilds daily portfolio history from holdings, buy transactions and stored daily prices'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', help='Only rebuild days from this date (YYYY-MM-DD), for incremental runs')
+        parser.add_argument('--days', type=int, default=30, help='Days of history to rebuild when --since is not given')
+        parser.add_argument('--portfolio', type=int, action='append', dest='portfolios', help='Only rebuild this portfolio id (repeatable)')
 
     def handle(self, *args, **options):
-        portfolios = Portfolio.objects.all()
-        
-        if not portfolios.exists():
+        if not Portfolio.objects.exists():
             self.stdout.write(self.style.WARNING("No portfolios found. Create a portfolio first."))
             return
 
-        today = timezone.now().date()
-        
-        for portfolio in portfolios:
-            self.stdout.write(f"Generating history for {portfolio.name}...")
-            
-            # Calculate current total value
-            current_total = sum(h.current_value for h in portfolio.holdings.all())
-            current_invested = sum(h.quantity * h.average_buy_price for h in portfolio.holdings.all())
-            
-            # Generate 30 days of history
-            for i in range(30, 0, -1):
-                date = today - timedelta(days=i)
-                
-                # Random variation +/- 5% per day relative to current value
-                # This treats history as if it fluctuated to reach today's value
-                variation = random.uniform(0.95, 1.05)
-                # We simply apply a random factor to the current value to simulate past values
-                # To make it look more realistic, we should probably walk back from today
-                # But simple random deviation from current is enough for MVP visual
-                
-                # Let's make it a walk: history_value = current * random_factor
-                # To distinguish days, let's add a trend.
-                # Assume market was lower 30 days ago (bull run)
-                trend_factor = 1 - (i * 0.005) # 0.5% growth per day roughly
-                
-                daily_value = float(current_total) * trend_factor * random.uniform(0.98, 1.02)
-                daily_invested = float(current_invested) # Assume invested didn't change (no buys/sells)
-                
-                PortfolioHistory.objects.update_or_create(
-                    portfolio=portfolio,
-                    date=date,
-                    defaults={
-                        'total_value': daily_value,
-                        'invested_value': daily_invested
-                    }
-                )
-                
-        self.stdout.write(self.style.SUCCESS("Successfully populated history for all portfolios"))
+        today = timezone.localdate()
+        if options['since']:
+            try:
+                since = datetime.date.fromisoformat(options['since'])
+            except ValueError:
+                raise CommandError(f"Invalid --since date: {options['since']}")
+        else:
+            since = today - datetime.timedelta(days=options['days'])
+
+        self.stdout.write(f"Rebuilding history since {since}...")
+        stats = rebuild_portfolio_history(since, portfolio_ids=options['portfolios'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Successfully rebuilt {stats['rows']} daily rows for {stats['portfolios']} portfolios in {stats['duration']:.1f}s"
+        ))
@@ -0,0 +1,19 @@
+# Generated by Django 4.2.30 on 2026-10-16 20:52
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('portfolio', '0004_net_worth_history'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='asset',
+            name='last_updated',
+            field=models.DateTimeField(db_index=True, default=django.utils.timezone.now),
+        ),
+    ]
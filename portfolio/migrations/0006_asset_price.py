@@ -0,0 +1,27 @@
+# Generated by Django 4.2.30 on 2026-10-16 20:54
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('portfolio', '0005_asset_last_updated_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AssetPrice',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('close', models.DecimalField(decimal_places=10, max_digits=20)),
+                ('asset', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='prices', to='portfolio.asset')),
+            ],
+            options={
+                'ordering': ['-date'],
+                'unique_together': {('asset', 'date')},
+            },
+        ),
+    ]
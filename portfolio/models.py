@@ -1,4 +1,7 @@
+from decimal import Decimal
 from django.db import models
+from django.db.models import Count, F, Q, Sum, Value
+from django.db.models.functions import Coalesce
 from django.contrib.auth.models import User
 from django.utils import timezone
 
@@ -17,16 +20,109 @@ class Asset(models.Model):
     name = models.CharField(max_length=100)
     category = models.CharField(max_length=20, choices=AssetCategory.choices)
     current_price = models.DecimalField(max_digits=20, decimal_places=10, default=0.0)
-    last_updated = models.DateTimeField(default=timezone.now)
+    last_updated = models.DateTimeField(default=timezone.now, db_index=True)
 
     def __str__(self):
         return f"{self.name} ({self.ticker})"
 
+class AssetPrice(models.Model):
+    """
+    Daily closing price of an asset, filled by portfolio.prices.
+    """
+    asset = models.ForeignKey(Asset, on_delete=models.CASCADE, related_name='prices')
+    date = models.DateField()
+    close = models.DecimalField(max_digits=20, decimal_places=10)
+
+    class Meta:
+        ordering = ['-date']
+        # Composite (asset, date) index serving both lookups and range scans
+        unique_together = ['asset', 'date']
+
+    def __str__(self):
+        return f"{self.asset.ticker} - {self.date}: {self.close}"
+
+# Output type of quantity * price products, wide enough for both operands
+VALUE_FIELD = models.DecimalField(max_digits=40, decimal_places=20)
+
+def _sum_value(left, right, **extra):
+    """SUM(left * right) that comes back as 0 instead of NULL for empty groups"""
+    return Coalesce(
+        Sum(F(left) * F(right), output_field=VALUE_FIELD, **extra),
+        Value(Decimal(0), output_field=VALUE_FIELD),
+    )
+
+class PortfolioQuerySet(models.QuerySet):
+    def with_valuation(self, by_category=False):
+        """
+        Annotates total_value, total_invested and pnl computed by the database.
+        With by_category=True, also annotates <category>_value (e.g. crypto_value)
+        for every AssetCategory.
+        """
+        annotations = {
+            'total_value': _sum_value('holdings__quantity', 'holdings__asset__current_price'),
+            'total_invested': _sum_value('holdings__quantity', 'holdings__average_buy_price'),
+        }
+        if by_category:
+            for category in AssetCategory.values:
+                annotations[f'{category.lower()}_value'] = _sum_value(
+                    'holdings__quantity', 'holdings__asset__current_price',
+                    filter=Q(holdings__asset__category=category),
+                )
+        return self.annotate(**annotations).annotate(pnl=F('total_value') - F('total_invested'))
+
+class HoldingQuerySet(models.QuerySet):
+    def with_value(self):
+        """
+        Selects the asset and annotates value, invested and gain of every holding.
+        """
+        return self.select_related('asset').annotate(
+            value=models.ExpressionWrapper(F('quantity') * F('asset__current_price'), output_field=VALUE_FIELD),
+            invested=models.ExpressionWrapper(F('quantity') * F('average_buy_price'), output_field=VALUE_FIELD),
+        ).annotate(gain=F('value') - F('invested'))
+
+    def totals(self):
+        """
+        Aggregates total_value, total_invested and count of the holdings in one query.
+        """
+        return self.aggregate(
+            total_value=_sum_value('quantity', 'asset__current_price'),
+            total_invested=_sum_value('quantity', 'average_buy_price'),
+            count=Count('pk'),
+        )
+
+    def by_category(self):
+        """
+        Per-category value, invested value and number of holdings, largest first.
+        """
+        return (
+            self.order_by()
+            .values('asset__category')
+            .annotate(
+                value=_sum_value('quantity', 'asset__current_price'),
+                invested=_sum_value('quantity', 'average_buy_price'),
+                count=Count('pk'),
+            )
+            .order_by('-value')
+        )
+
+    def by_asset(self):
+        """
+        Per-asset value summed across portfolios, largest first.
+        """
+        return (
+            self.order_by()
+            .values('asset__ticker')
+            .annotate(value=_sum_value('quantity', 'asset__current_price'))
+            .order_by('-value')
+        )
+
 class Portfolio(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='portfolios')
     name = models.CharField(max_length=100)
     currency = models.CharField(max_length=3, default="EUR")
 
+    objects = PortfolioQuerySet.as_manager()
+
     def __str__(self):
         return f"{self.name} ({self.user.username})"
 
@@ -37,6 +133,9 @@ class Holding(models.Model):
     average_buy_price = models.DecimalField(max_digits=20, decimal_places=10, default=0.0)
     source = models.CharField(max_length=20, choices=ConnectionSource.choices, default=ConnectionSource.MANUAL)
 
+    objects = HoldingQuerySet.as_manager()
+
+    # Lists of holdings are valued as arrays instead, see valuation_engine.py
     @property
     def current_value(self):
         return self.quantity * self.asset.current_price
@@ -76,6 +175,23 @@ class PortfolioHistory(models.Model):
     def __str__(self):
         return f"{self.portfolio.name} - {self.date}: {self.total_value}"
 
+class NetWorthHistory(models.Model):
+    """
+    Daily net worth of a user, summed over all of their portfolios.
+    Rolled up from PortfolioHistory so the dashboard chart is a single range scan.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='net_worth_history')
+    date = models.DateField()
+    total_value = models.DecimalField(max_digits=20, decimal_places=2)
+    invested_value = models.DecimalField(max_digits=20, decimal_places=2)
+
+    class Meta:
+        ordering = ['-date']
+        unique_together = ['user', 'date']
+
+    def __str__(self):
+        return f"{self.user.username} - {self.date}: {self.total_value}"
+
 class Transaction(models.Model):
     class Type(models.TextChoices):
         INCOME = 'INCOME', 'Revenu'
@@ -95,9 +211,18 @@ class Transaction(models.Model):
     date = models.DateField(default=timezone.now)
     source = models.CharField(max_length=20, choices=Source.choices, default=Source.MANUAL)
     created_at = models.DateTimeField(auto_now_add=True)
+    # Set on buys recorded with a holding (views.holding_create); older buys
+    # only spell them out in the description
+    asset = models.ForeignKey(Asset, on_delete=models.SET_NULL, null=True, blank=True, related_name='transactions')
+    quantity = models.DecimalField(max_digits=20, decimal_places=10, null=True, blank=True)
+    unit_price = models.DecimalField(max_digits=20, decimal_places=10, null=True, blank=True)
 
     class Meta:
         ordering = ['-date', '-created_at']
+        indexes = [
+            # Keyset pagination of a user's transactions, see pagination.py
+            models.Index(fields=['user', 'date', 'created_at', 'id'], name='transaction_user_date_idx'),
+        ]
 
     def __str__(self):
         return f"{self.type} - {self.amount} ({self.date})"
@@ -0,0 +1,112 @@
+"""
+Local store of daily closing prices (AssetPrice).
+
+Prices are ingested from market data provider history frames in chunked bulk
+inserts and topped up incrementally, so charts, risk and history code can read local data
+instead of calling the network. Only closed sessions are stored: the bar of a
+session still trading holds the latest price, not the close, and would never
+be corrected once stored.
+"""
+import datetime
+from decimal import Decimal
+from django.db.models import Max
+from django.utils import timezone
+from .models import Asset, AssetPrice
+from .providers import close_series, get_provider
+from .scheduling import last_close, market_session
+import logging
+
+logger = logging.getLogger(__name__)
+
+INGEST_CHUNK_SIZE = 5000
+# How far back to go for assets without any stored price
+DEFAULT_HISTORY_DAYS = 365
+
+def last_closed_date(asset, now=None):
+    """
+    Latest date whose daily bar of `asset` is final: the day of its market's
+    last close, or yesterday (UTC) for assets trading around the clock.
+    """
+    now = now or timezone.now()
+    close = last_close(market_session(asset.ticker, asset.category), now)
+    if close is None:
+        return now.astimezone(datetime.timezone.utc).date() - datetime.timedelta(days=1)
+    return close.date()
+
+def ingest_price_frame(frame, assets, chunk_size=INGEST_CHUNK_SIZE):
+    """
+    Stores the daily closes of `assets` found in a provider history frame,
+    up to their last closed session (see last_closed_date).
+    Rows already stored are skipped (bulk_create with ignore_conflicts).
+    Returns the number of rows offered to the database.
+    """
+    if frame is None or frame.empty:
+        return 0
+
+    now = timezone.now()
+    rows = 0
+    batch = []
+    for asset in assets:
+        series = close_series(frame, asset.ticker)
+        closed = last_closed_date(asset, now)
+        for date, close in zip(series.index, series.to_numpy()):
+            if date.date() <= closed:
+                batch.append(AssetPrice(asset=asset, date=date.date(), close=Decimal(str(close))))
+        if len(batch) >= chunk_size:
+            AssetPrice.objects.bulk_create(batch, batch_size=chunk_size, ignore_conflicts=True)
+            rows += len(batch)
+            batch = []
+    if batch:
+        AssetPrice.objects.bulk_create(batch, batch_size=chunk_size, ignore_conflicts=True)
+        rows += len(batch)
+    return rows
+
+def top_up_prices(assets=None, days=DEFAULT_HISTORY_DAYS):
+    """
+    Downloads only the dates after the last stored close of every asset,
+    going back `days` days for assets without any stored close.
+    Assets sharing the same provider and start date are fetched in one
+    download call: ccxt pairs ('BTC/USDT') from the crypto provider, the rest
+    from the default one.
+    Returns the number of rows offered to the database.
+    """
+    assets = list(assets if assets is not None else Asset.objects.all())
+    if not assets:
+        return 0
+
+    today = timezone.localdate()
+    last_dates = dict(
+        AssetPrice.objects.filter(asset__in=assets)
+        .order_by()
+        .values_list('asset_id')
+        .annotate(last=Max('date'))
+    )
+
+    groups = {}
+    for asset in assets:
+        last = last_dates.get(asset.pk)
+        start = last + datetime.timedelta(days=1) if last else today - datetime.timedelta(days=days)
+        if start <= today:
+            provider = 'crypto' if '/' in asset.ticker else 'default'
+            groups.setdefault((provider, start), []).append(asset)
+
+    rows = 0
+    for (provider, start), group in groups.items():
+        tickers = [a.ticker for a in group]
+        try:
+            frame = get_provider(provider).history(tickers, start=start)
+            rows += ingest_price_frame(frame, group)
+        except Exception as e:
+            logger.error(f"Error topping up prices from {start} for {len(tickers)} tickers: {e}")
+    return rows
+
+def get_price_history(asset, days=30):
+    """
+    Locally stored (date, close) pairs of the last `days` days, oldest first.
+    """
+    since = timezone.localdate() - datetime.timedelta(days=days)
+    return list(
+        AssetPrice.objects.filter(asset=asset, date__gte=since)
+        .order_by('date')
+        .values_list('date', 'close')
+    )
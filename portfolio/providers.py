@@ -0,0 +1,414 @@
+"""
+Market data providers: quotes, daily history, asset details and search.
+
+services.py and prices.py go through get_provider() instead of calling
+yfinance, ccxt or the Yahoo search endpoint directly, so the network source is
+chosen in settings.MARKET_DATA_PROVIDERS. SyntheticProvider answers every call
+offline with deterministic price paths, for load tests and benchmarks.
+
+History frames follow the yf.download(group_by='ticker') layout: a
+DatetimeIndex and (ticker, field) columns, of which only 'Close' is
+guaranteed. Read them with close_series.
+"""
+import asyncio
+import datetime
+import time
+import weakref
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+import yfinance as yf
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from .exchanges import DEFAULT_EXCHANGE, fetch_tickers, get_exchange, load_markets
+from .telemetry import bind_run, upstream
+import logging
+
+logger = logging.getLogger(__name__)
+
+def close_series(frame, ticker):
+    """
+    Close prices of one ticker from a history frame, NaNs dropped.
+    Handles both flat (single ticker) and (ticker, field) column layouts.
+    """
+    if isinstance(frame.columns, pd.MultiIndex):
+        if ticker not in frame.columns.get_level_values(0):
+            return pd.Series(dtype=float)
+        series = frame[ticker]['Close']
+    else:
+        series = frame['Close']
+    return series.dropna()
+
+class MarketDataProvider:
+    """
+    Interface of a market data source. Methods raise on failure; callers
+    decide about fallbacks.
+    """
+    def quotes(self, tickers):
+        """
+        Last price of each ticker ({ticker: float}). Unknown tickers are absent.
+        """
+        raise NotImplementedError
+
+    def history(self, tickers, start=None, period='1mo'):
+        """
+        Daily closes of `tickers` since `start` (a date) or over `period`
+        ('1d', '5d', '1mo', '1y', ... as understood by yfinance).
+        """
+        raise NotImplementedError
+
+    def details(self, ticker):
+        """
+        Descriptive data of one ticker, keyed like yfinance's Ticker.info
+        (shortName, regularMarketPrice, marketCap, sector, ...).
+        """
+        raise NotImplementedError
+
+    def search(self, query):
+        """
+        Quotes matching `query`, keyed like the Yahoo search API results
+        (symbol, shortname, quoteType).
+        """
+        raise NotImplementedError
+
+    async def asearch(self, query):
+        """
+        search() for async callers. Runs search() on a thread unless the
+        provider has a native async implementation.
+        """
+        return await sync_to_async(self.search, thread_sensitive=False)(query)
+
+class YFinanceProvider(MarketDataProvider):
+    """
+    Yahoo Finance through yfinance (quotes, history, details) and the Yahoo
+    autocomplete endpoint (search).
+    """
+    SEARCH_URL = "https://query2.finance.yahoo.com/v1/finance/search"
+    # We use a user-agent to avoid being blocked
+    SEARCH_HEADERS = {'User-Agent': 'Mozilla/5.0'}
+    SEARCH_TIMEOUT = 3
+    # Connections kept open to the search endpoint, per pool
+    SEARCH_POOL_SIZE = 20
+
+    def __init__(self, download=None, chunk_size=None, workers=None):
+        # `download` can be swapped for a fake with yf.download's signature
+        self.download = download or yf.download
+        self.chunk_size = chunk_size or settings.YF_DOWNLOAD_CHUNK_SIZE
+        self.workers = workers or settings.YF_DOWNLOAD_WORKERS
+        self._session = None
+        # One pooled async client per event loop, as httpx clients are bound to theirs
+        self._async_clients = weakref.WeakKeyDictionary()
+
+    def _download_chunk(self, tickers):
+        # A failing chunk is split in halves so one bad ticker only costs itself
+        try:
+            with upstream('yfinance', 'download'):
+                frame = self.download(tickers, period='1d', group_by='ticker', progress=False, threads=False)
+                if frame is None or frame.empty:
+                    raise ValueError("empty download")
+            closes = {}
+            for ticker in tickers:
+                series = close_series(frame, ticker)
+                if len(series):
+                    closes[ticker] = series.iloc[-1].item()
+            return closes
+        except Exception as e:
+            if len(tickers) == 1:
+                logger.error(f"Error downloading stock {tickers[0]}: {e}")
+                return {}
+            middle = len(tickers) // 2
+            return {**self._download_chunk(tickers[:middle]), **self._download_chunk(tickers[middle:])}
+
+    def quotes(self, tickers):
+        """
+        Tickers are downloaded in chunks of `chunk_size`, `workers` at a time,
+        and each chunk is reduced to its last closes right away instead of
+        being concatenated into one wide frame.
+        """
+        tickers = list(dict.fromkeys(tickers))
+        chunks = [tickers[i:i + self.chunk_size] for i in range(0, len(tickers), self.chunk_size)]
+        prices = {}
+        with ThreadPoolExecutor(max_workers=max(1, min(self.workers, len(chunks)))) as pool:
+            for closes in pool.map(bind_run(self._download_chunk), chunks):
+                prices.update(closes)
+        return prices
+
+    def history(self, tickers, start=None, period='1mo'):
+        span = {'start': start.isoformat()} if start else {'period': period}
+        with upstream('yfinance', 'history'):
+            return self.download(list(tickers), group_by='ticker', progress=False, **span)
+
+    def details(self, ticker):
+        with upstream('yfinance', 'details'):
+            return yf.Ticker(ticker).info
+
+    def search(self, query):
+        if self._session is None:
+            import requests
+            from requests.adapters import HTTPAdapter
+            session = requests.Session()
+            session.headers.update(self.SEARCH_HEADERS)
+            adapter = HTTPAdapter(pool_maxsize=self.SEARCH_POOL_SIZE)
+            session.mount('https://', adapter)
+            self._session = session
+        with upstream('yfinance', 'search'):
+            response = self._session.get(self.SEARCH_URL, params={'q': query}, timeout=self.SEARCH_TIMEOUT)
+        return response.json().get('quotes', [])
+
+    async def asearch(self, query):
+        loop = asyncio.get_running_loop()
+        client = self._async_clients.get(loop)
+        if client is None:
+            import httpx
+            client = httpx.AsyncClient(
+                headers=self.SEARCH_HEADERS,
+                timeout=self.SEARCH_TIMEOUT,
+                limits=httpx.Limits(max_connections=self.SEARCH_POOL_SIZE, max_keepalive_connections=self.SEARCH_POOL_SIZE),
+            )
+            self._async_clients[loop] = client
+        response = await client.get(self.SEARCH_URL, params={'q': query})
+        return response.json().get('quotes', [])
+
+class CcxtProvider(MarketDataProvider):
+    """
+    Crypto pairs (BTC/USDT, ...) of one ccxt exchange, see exchanges.py.
+    """
+    def __init__(self, exchange=DEFAULT_EXCHANGE):
+        self.exchange = exchange
+
+    def quotes(self, tickers):
+        prices = {}
+        for symbol, ticker in fetch_tickers(tickers, self.exchange).items():
+            price = ticker.get('last') or ticker.get('close')
+            if price:
+                prices[symbol] = float(price)
+        return prices
+
+    def history(self, tickers, start=None, period='1mo'):
+        exchange = get_exchange(self.exchange)
+        since = start or timezone.localdate() - datetime.timedelta(days=_period_days(period))
+        since_ms = int(datetime.datetime.combine(since, datetime.time(), datetime.timezone.utc).timestamp() * 1000)
+        closes = {}
+        for symbol in tickers:
+            with upstream(exchange.id, 'fetch_ohlcv'):
+                candles = exchange.fetch_ohlcv(symbol, '1d', since=since_ms)
+            closes[symbol] = pd.Series(
+                [c[4] for c in candles],
+                index=pd.to_datetime([c[0] for c in candles], unit='ms'),
+            )
+        return _history_frame(closes)
+
+    def details(self, ticker):
+        exchange = get_exchange(self.exchange)
+        market = load_markets(exchange).get(ticker, {})
+        with upstream(exchange.id, 'fetch_ticker'):
+            quote = exchange.fetch_ticker(ticker)
+        return {
+            'shortName': ticker,
+            'regularMarketPrice': quote.get('last'),
+            'previousClose': quote.get('previousClose') or quote.get('open'),
+            'dayHigh': quote.get('high'),
+            'dayLow': quote.get('low'),
+            'volume': quote.get('baseVolume'),
+            'currency': market.get('quote', 'USD'),
+            'quoteType': 'CRYPTOCURRENCY',
+        }
+
+    def search(self, query):
+        markets = load_markets(get_exchange(self.exchange))
+        q = query.strip().upper()
+        return [
+            {'symbol': symbol, 'shortname': symbol, 'quoteType': 'CRYPTOCURRENCY'}
+            for symbol in markets if q in symbol
+        ][:20]
+
+class SyntheticProvider(MarketDataProvider):
+    """
+    Offline provider generating a geometric Brownian motion per ticker.
+
+    Paths are deterministic for a (seed, ticker) pair and any date window:
+    the Brownian motion is drawn in BLOCK_DAYS blocks whose totals come from
+    one seeded stream, and the daily steps inside a block from a stream seeded
+    with the block number, conditioned on the block total. A window therefore
+    costs its own blocks, not a walk from EPOCH. Every call sleeps `latency`
+    seconds to stand in for the network.
+    """
+    EPOCH = datetime.date(2000, 1, 1)
+    BLOCK_DAYS = 256
+
+    def __init__(self, seed=0, latency=0.0):
+        self.seed = seed
+        self.latency = latency
+
+    def _network(self, method):
+        # Stands in for one upstream request
+        with upstream('synthetic', method):
+            time.sleep(self.latency)
+
+    @staticmethod
+    def _is_crypto(ticker):
+        return '/' in ticker or ticker.endswith('-USD')
+
+    def _key(self, ticker):
+        return zlib.crc32(f'{self.seed}:{ticker}'.encode())
+
+    def _params(self, ticker):
+        rng = np.random.default_rng([self._key(ticker), 0])
+        low, high = (0.5, 0.9) if self._is_crypto(ticker) else (0.15, 0.4)
+        return {
+            'start_price': float(np.exp(rng.uniform(np.log(5), np.log(500)))),
+            'drift': rng.uniform(0.0, 0.1),  # annual
+            'volatility': rng.uniform(low, high),  # annual
+        }
+
+    def _log_prices(self, ticker, first, last):
+        # Log closes of day numbers first..last (days since EPOCH)
+        key = self._key(ticker)
+        params = self._params(ticker)
+        sigma = params['volatility'] / np.sqrt(365)
+        mu = params['drift'] / 365 - sigma ** 2 / 2
+
+        first_block, last_block = first // self.BLOCK_DAYS, last // self.BLOCK_DAYS
+        totals = np.random.default_rng([key, 1]).standard_normal(last_block + 1) * np.sqrt(self.BLOCK_DAYS)
+        block_starts = np.concatenate([[0.0], np.cumsum(totals)])
+        walk = []
+        for block in range(first_block, last_block + 1):
+            steps = np.random.default_rng([key, 2, block]).standard_normal(self.BLOCK_DAYS)
+            # Gaussian steps conditioned on their sum: shift them to the block total
+            steps += (totals[block] - steps.sum()) / self.BLOCK_DAYS
+            walk.append(block_starts[block] + np.cumsum(steps))
+        offset = first_block * self.BLOCK_DAYS
+        walk = np.concatenate(walk)[first - offset:last - offset + 1]
+        days = np.arange(first, last + 1)
+        return np.log(params['start_price']) + mu * days + sigma * walk
+
+    def _closes(self, ticker, start, end):
+        days = pd.date_range(start, end, freq='D' if self._is_crypto(ticker) else 'B')
+        if days.empty:
+            return pd.Series(dtype=float)
+        first, last = (start - self.EPOCH).days, (end - self.EPOCH).days
+        log_prices = self._log_prices(ticker, first, last)
+        offsets = np.asarray((days - pd.Timestamp(start)).days)
+        values = np.round(np.exp(log_prices[offsets]), 4)
+        return pd.Series(values, index=days)
+
+    def quotes(self, tickers):
+        self._network('quotes')
+        today = timezone.localdate()
+        day = (today - self.EPOCH).days
+        # Intraday moves, so consecutive updates within a day see new prices
+        minute = int(time.time() // 60)
+        prices = {}
+        for ticker in dict.fromkeys(tickers):
+            close = float(np.exp(self._log_prices(ticker, day, day)[0]))
+            noise = np.random.default_rng([self._key(ticker), 3, minute]).standard_normal() * 0.002
+            prices[ticker] = round(close * (1 + noise), 4)
+        return prices
+
+    def history(self, tickers, start=None, period='1mo'):
+        self._network('history')
+        end = timezone.localdate()
+        closes = {}
+        for ticker in tickers:
+            if start:
+                closes[ticker] = self._closes(ticker, start, end)
+            elif period.endswith('d') and period[:-1].isdigit():
+                # yfinance counts '5d' in trading days
+                span = int(period[:-1])
+                series = self._closes(ticker, end - datetime.timedelta(days=span * 2 + 7), end)
+                closes[ticker] = series.iloc[-span:]
+            else:
+                closes[ticker] = self._closes(ticker, end - datetime.timedelta(days=_period_days(period)), end)
+        return _history_frame(closes)
+
+    def details(self, ticker):
+        self._network('details')
+        end = timezone.localdate()
+        year = self._closes(ticker, end - datetime.timedelta(days=365), end)
+        rng = np.random.default_rng([self._key(ticker), 4])
+        price = float(year.iloc[-1])
+        previous = float(year.iloc[-2]) if len(year) > 1 else price
+        crypto = self._is_crypto(ticker)
+        shares = float(rng.uniform(1e7, 1e10))
+        return {
+            'shortName': f"{ticker} Synthetic",
+            'longName': f"{ticker} Synthetic Holdings",
+            'regularMarketPrice': price,
+            'previousClose': previous,
+            'open': round(previous * (1 + rng.normal(0, 0.005)), 4),
+            'dayHigh': round(max(price, previous) * 1.01, 4),
+            'dayLow': round(min(price, previous) * 0.99, 4),
+            'fiftyTwoWeekHigh': float(year.max()),
+            'fiftyTwoWeekLow': float(year.min()),
+            'currency': 'USD' if crypto or '.' not in ticker else 'EUR',
+            'marketCap': int(price * shares),
+            'volume': int(shares * rng.uniform(0.001, 0.01)),
+            'averageVolume': int(shares * 0.005),
+            'trailingPE': None if crypto else round(float(rng.uniform(8, 40)), 2),
+            'trailingEps': None if crypto else round(price / float(rng.uniform(8, 40)), 2),
+            'dividendYield': None if crypto else round(float(rng.uniform(0, 0.05)), 4),
+            'beta': round(float(rng.uniform(0.5, 1.8)), 2),
+            'sector': 'Cryptocurrency' if crypto else 'Technology',
+            'industry': None if crypto else 'Software',
+            'country': None if crypto else 'United States',
+            'longBusinessSummary': f"Synthetic asset generated for {ticker}.",
+            'quoteType': 'CRYPTOCURRENCY' if crypto else 'EQUITY',
+        }
+
+    def search(self, query):
+        self._network('search')
+        return self._search_results(query)
+
+    async def asearch(self, query):
+        await asyncio.sleep(self.latency)
+        return self._search_results(query)
+
+    @staticmethod
+    def _search_results(query):
+        q = query.strip().upper()
+        if not q:
+            return []
+        return [
+            {'symbol': q, 'shortname': f"{q} Synthetic", 'quoteType': 'EQUITY'},
+            {'symbol': f'{q}.PA', 'shortname': f"{q} Synthetic Paris", 'quoteType': 'EQUITY'},
+            {'symbol': f'{q}-USD', 'shortname': f"{q} Synthetic Coin", 'quoteType': 'CRYPTOCURRENCY'},
+        ]
+
+def _period_days(period):
+    # Calendar days covered by a yfinance period string
+    units = {'d': 1, 'wk': 7, 'mo': 31, 'y': 366}
+    for unit, days in units.items():
+        if period.endswith(unit) and period[:-len(unit)].isdigit():
+            return int(period[:-len(unit)]) * days
+    return 31
+
+def _history_frame(closes):
+    # {ticker: Series of closes} -> yf.download(group_by='ticker') layout
+    if not closes:
+        return pd.DataFrame()
+    frame = pd.concat({ticker: series.rename('Close').to_frame() for ticker, series in closes.items()}, axis=1)
+    return frame.sort_index()
+
+_providers = {}
+
+def get_provider(name='default'):
+    """
+    Provider configured as settings.MARKET_DATA_PROVIDERS[name], falling back
+    to the 'default' entry. Instances are kept for the life of the process.
+    """
+    config = settings.MARKET_DATA_PROVIDERS
+    name = name if name in config else 'default'
+    if name not in _providers:
+        backend = import_string(config[name]['BACKEND'])
+        _providers[name] = backend(**config[name].get('OPTIONS', {}))
+    return _providers[name]
+
+@receiver(setting_changed)
+def _reset_providers(setting, **kwargs):
+    if setting == 'MARKET_DATA_PROVIDERS':
+        _providers.clear()
@@ -0,0 +1,153 @@
+"""
+Price update channel between the price updater (publisher) and the
+Server-Sent Events stream (subscribers).
+
+Each web process holds a single upstream subscription and fans messages out
+to its connected clients through asyncio queues, so idle clients cost a queue
+each rather than a thread or a Redis connection.
+"""
+import asyncio
+import json
+import threading
+from django.conf import settings
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Messages a slow client may lag behind before the oldest ones are dropped
+SUBSCRIBER_BACKLOG = 10
+
+def _offer(queue, message):
+    if queue.full():
+        queue.get_nowait()
+    queue.put_nowait(message)
+
+class Subscription:
+    """
+    Queue of the messages published while the subscription is open.
+    """
+    def __init__(self, broker):
+        self.broker = broker
+        self.queue = None
+
+    async def __aenter__(self):
+        self.queue = asyncio.Queue(maxsize=SUBSCRIBER_BACKLOG)
+        self._entry = (asyncio.get_running_loop(), self.queue)
+        self.broker._attach(self._entry)
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.broker._detach(self._entry)
+
+    async def get(self, timeout=None):
+        """
+        Next message, or None if nothing was published within `timeout` seconds.
+        """
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+class InMemoryBroker:
+    """
+    In-process channel. Used by tests and single-process setups.
+    """
+    def __init__(self):
+        self._subscribers = set()
+        self._lock = threading.Lock()
+
+    def _fan_out(self, message):
+        # May be called from any thread, queues are only touched on their loop
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for loop, queue in subscribers:
+            try:
+                loop.call_soon_threadsafe(_offer, queue, message)
+            except RuntimeError:
+                # Loop already closed, the subscriber is gone
+                pass
+
+    def publish(self, message):
+        self._fan_out(message)
+
+    def subscribe(self):
+        """
+        Returns a Subscription, to be used as `async with broker.subscribe() as sub`.
+        """
+        return Subscription(self)
+
+    def _attach(self, entry):
+        with self._lock:
+            self._subscribers.add(entry)
+
+    def _detach(self, entry):
+        with self._lock:
+            self._subscribers.discard(entry)
+
+    def subscriber_count(self):
+        return len(self._subscribers)
+
+class RedisBroker(InMemoryBroker):
+    """
+    Redis pub/sub channel, so Celery workers can reach every web process.
+    """
+    def __init__(self, url, channel):
+        super().__init__()
+        self.url = url
+        self.channel = channel
+        self._client = None
+        self._listener = None
+
+    def publish(self, message):
+        import redis
+        if self._client is None:
+            self._client = redis.Redis.from_url(self.url)
+        self._client.publish(self.channel, json.dumps(message))
+
+    def _attach(self, entry):
+        super()._attach(entry)
+        if self._listener is None or self._listener.done():
+            self._listener = asyncio.get_running_loop().create_task(self._listen())
+
+    async def _listen(self):
+        import redis.asyncio
+        client = redis.asyncio.Redis.from_url(self.url)
+        pubsub = client.pubsub()
+        try:
+            await pubsub.subscribe(self.channel)
+            async for raw in pubsub.listen():
+                if raw['type'] == 'message':
+                    self._fan_out(json.loads(raw['data']))
+        except Exception as e:
+            logger.error(f"Price stream subscription lost: {e}")
+        finally:
+            await pubsub.aclose()
+            await client.aclose()
+
+_broker = None
+
+def get_broker():
+    """
+    Process-wide broker selected by settings.PRICE_STREAM_URL
+    ('memory://' for the in-process stand-in, a redis:// URL otherwise).
+    """
+    global _broker
+    if _broker is None:
+        url = settings.PRICE_STREAM_URL
+        if url.startswith('memory://'):
+            _broker = InMemoryBroker()
+        else:
+            _broker = RedisBroker(url, settings.PRICE_STREAM_CHANNEL)
+    return _broker
+
+def publish_prices(prices):
+    """
+    Announces new prices ({ticker: price}) to every connected stream.
+    Never raises: a broken channel must not fail the price update.
+    """
+    if not prices:
+        return
+    try:
+        get_broker().publish({'prices': prices})
+    except Exception as e:
+        logger.error(f"Error publishing price update: {e}")
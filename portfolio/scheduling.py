@@ -0,0 +1,159 @@
+"""
+Adaptive price refresh schedule.
+
+Rather than refreshing every asset at one cadence, each asset gets a refresh
+interval from whether anyone holds it, whether its exchange is in session
+(crypto trades around the clock) and whether someone viewed it recently.
+Every beat only the assets that are due are refreshed. An asset checked
+before its market's latest close is always due, so the closing price is
+picked up once after each session.
+"""
+import datetime
+from zoneinfo import ZoneInfo
+from django.core.cache import cache, caches
+from django.utils import timezone
+from .models import Asset, AssetCategory, Holding
+from .tiered_cache import shared_backend
+
+# Beat period of refresh_due_asset_prices (seconds)
+SCHEDULER_TICK = 300
+# Last refresh attempt per asset id, kept in the shared cache tier (the beat
+# task may run on any worker). Past twice the longest interval every asset is
+# due anyway, so an expired entry costs one full refresh at most.
+CHECKED_KEY = 'price_schedule:checked'
+# How long a detail page view counts as recent interest (seconds)
+VIEW_WINDOW = 60 * 60
+
+# Refresh intervals in seconds, by (market open, held, recently viewed)
+OPEN_HELD = 5 * 60
+OPEN_VIEWED = 15 * 60
+OPEN_IDLE = 60 * 60
+CLOSED_WATCHED = 12 * 60 * 60
+CLOSED_IDLE = 24 * 60 * 60
+CHECKED_TIMEOUT = 2 * CLOSED_IDLE
+
+# Regular sessions by ticker suffix: (time zone, open, close), Monday to Friday.
+# Exchange holidays are not modelled, a holiday costs a few idle refreshes.
+EXCHANGE_SESSIONS = {
+    '.PA': ('Europe/Paris', datetime.time(9), datetime.time(17, 30)),
+    '.AS': ('Europe/Amsterdam', datetime.time(9), datetime.time(17, 30)),
+    '.BR': ('Europe/Brussels', datetime.time(9), datetime.time(17, 30)),
+    '.LS': ('Europe/Lisbon', datetime.time(8), datetime.time(16, 30)),
+    '.DE': ('Europe/Berlin', datetime.time(9), datetime.time(17, 30)),
+    '.F': ('Europe/Berlin', datetime.time(8), datetime.time(20)),
+    '.MI': ('Europe/Rome', datetime.time(9), datetime.time(17, 30)),
+    '.MC': ('Europe/Madrid', datetime.time(9), datetime.time(17, 30)),
+    '.SW': ('Europe/Zurich', datetime.time(9), datetime.time(17, 30)),
+    '.L': ('Europe/London', datetime.time(8), datetime.time(16, 30)),
+    '.TO': ('America/Toronto', datetime.time(9, 30), datetime.time(16)),
+    '.T': ('Asia/Tokyo', datetime.time(9), datetime.time(15)),
+    '.HK': ('Asia/Hong_Kong', datetime.time(9, 30), datetime.time(16)),
+    # Currencies trade around the clock on weekdays
+    '=X': ('UTC', datetime.time(0), datetime.time.max),
+}
+# US listings (no suffix) and indices (^GSPC, ^FCHI ... approximated as US)
+US_SESSION = ('America/New_York', datetime.time(9, 30), datetime.time(16))
+
+def market_session(ticker, category):
+    """
+    Trading session of an asset, or None if it trades around the clock.
+    """
+    if category == AssetCategory.CRYPTO or '/' in ticker:
+        return None
+    for suffix, session in EXCHANGE_SESSIONS.items():
+        if ticker.endswith(suffix):
+            return session
+    if '.' in ticker:
+        # Unknown exchange: treated as always open, i.e. refreshed as before
+        return None
+    return US_SESSION
+
+def is_open(session, now):
+    if session is None:
+        return True
+    zone, opens, closes = session
+    local = now.astimezone(ZoneInfo(zone))
+    return local.weekday() < 5 and opens <= local.time() < closes
+
+def last_close(session, now):
+    """
+    Latest end of a session at or before `now` (None for round the clock).
+    """
+    if session is None:
+        return None
+    zone, _, closes = session
+    local = now.astimezone(ZoneInfo(zone))
+    day = local.date()
+    while True:
+        if day.weekday() < 5:
+            close = datetime.datetime.combine(day, closes, tzinfo=ZoneInfo(zone))
+            if close <= local:
+                return close
+        day -= datetime.timedelta(days=1)
+
+def refresh_interval(open_, held, viewed):
+    if open_:
+        if held:
+            return OPEN_HELD
+        return OPEN_VIEWED if viewed else OPEN_IDLE
+    return CLOSED_WATCHED if held or viewed else CLOSED_IDLE
+
+def select_due(assets, held, viewed, checked, now):
+    """
+    Ids of the (pk, ticker, category) `assets` due for a refresh at `now`,
+    given the held asset ids, the recently viewed tickers and `checked`
+    ({pk: last refresh timestamp}), which is updated for the returned ids.
+    """
+    timestamp = now.timestamp()
+    sessions = {}
+    due = []
+    for pk, ticker, category in assets:
+        session = market_session(ticker, category)
+        key = session or ('24/7',)
+        if key not in sessions:
+            close = last_close(session, now)
+            sessions[key] = (is_open(session, now), close.timestamp() if close else None)
+        open_, closed_at = sessions[key]
+
+        last = checked.get(pk)
+        if last is not None and (closed_at is None or last >= closed_at):
+            if timestamp - last < refresh_interval(open_, pk in held, ticker in viewed):
+                continue
+        due.append(pk)
+        checked[pk] = timestamp
+    return due
+
+def record_asset_view(ticker):
+    """
+    Marks `ticker` as recently viewed, which shortens its refresh interval.
+    """
+    cache.set(f'asset_viewed:{ticker}', 1, VIEW_WINDOW)
+
+def _viewed_tickers(tickers, batch_size=1000):
+    viewed = set()
+    for i in range(0, len(tickers), batch_size):
+        keys = {f'asset_viewed:{ticker}': ticker for ticker in tickers[i:i + batch_size]}
+        viewed.update(keys[key] for key in cache.get_many(list(keys)))
+    return viewed
+
+def due_asset_ids(now=None):
+    """
+    Ids of the stock and crypto assets due for a price refresh, which are
+    recorded as checked now. Called once per SCHEDULER_TICK.
+    """
+    now = now or timezone.now()
+    assets = list(
+        Asset.objects.filter(category__in=[AssetCategory.STOCKS, AssetCategory.CRYPTO])
+        .order_by('category', 'ticker')
+        .values_list('pk', 'ticker', 'category')
+    )
+    held = set(Holding.objects.values_list('asset_id', flat=True).distinct())
+    viewed = _viewed_tickers([ticker for _, ticker, _ in assets])
+    store = shared_backend(caches['default'])
+    checked = store.get(CHECKED_KEY) or {}
+    # Forget deleted assets
+    known = {pk for pk, _, _ in assets}
+    checked = {pk: ts for pk, ts in checked.items() if pk in known}
+    due = select_due(assets, held, viewed, checked, now)
+    store.set(CHECKED_KEY, checked, CHECKED_TIMEOUT)
+    return due
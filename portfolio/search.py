@@ -0,0 +1,217 @@
+"""
+In-process ticker search index.
+
+Asset search runs on every keyup, so queries are first answered from a local
+index of the Asset table plus the tickers past online searches returned
+(shared between processes through the cache). Tickers and name words are
+kept sorted for prefix lookups, and every entry is indexed by the trigrams
+of its ticker and name for fuzzy matches. The provider is only asked when
+the index has nothing good enough.
+"""
+import bisect
+import threading
+import time
+import unicodedata
+import numpy as np
+from django.core.cache import cache
+from django.db import connection
+from .models import Asset, AssetCategory
+import logging
+
+logger = logging.getLogger(__name__)
+
+# The index is rebuilt from the database in the background once older than this (seconds)
+INDEX_TTL = 300
+# Tickers learned from online searches, kept in the shared cache
+LEARNED_KEY = 'ticker_index:learned'
+LEARNED_MAX = 20000
+# Lock serializing the read-modify-write of LEARNED_KEY between processes
+LEARNED_LOCK_KEY = f'{LEARNED_KEY}:lock'
+LEARNED_LOCK_TTL = 10
+LEARNED_LOCK_WAIT = 2
+LEARNED_LOCK_POLL_INTERVAL = 0.02
+# Results returned per query
+SEARCH_LIMIT = 10
+# Trigram similarity (Dice coefficient) a fuzzy match needs
+FUZZY_THRESHOLD = 0.5
+
+def normalize_query(text):
+    """
+    Casefolded text without accents and with single spaces.
+    """
+    text = unicodedata.normalize('NFKD', text or '')
+    text = ''.join(c for c in text if not unicodedata.combining(c))
+    return ' '.join(text.casefold().split())
+
+def _trigrams(text):
+    padded = f'  {text} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+class TickerIndex:
+    """
+    Lookup tables over (ticker, name, category) entries, never modified once
+    built. Later entries win over earlier ones with the same ticker.
+    """
+    def __init__(self, entries=()):
+        self.built_at = time.monotonic()
+        self._by_ticker = {entry['ticker']: entry for entry in entries}
+        self.entries = list(self._by_ticker.values())
+        prefixes = []
+        grams = {}
+        gram_counts = []
+        for i, entry in enumerate(self.entries):
+            ticker, name = normalize_query(entry['ticker']), normalize_query(entry['name'])
+            prefixes.append((ticker, 0, i))
+            for word in name.split():
+                prefixes.append((word, 1, i))
+            entry_grams = _trigrams(ticker) | _trigrams(name)
+            for gram in entry_grams:
+                grams.setdefault(gram, []).append(i)
+            gram_counts.append(len(entry_grams))
+        prefixes.sort()
+        self._prefixes = prefixes
+        self._prefix_keys = [key for key, _, _ in prefixes]
+        # Trigram postings as arrays, so fuzzy scoring is one bincount
+        self._grams = {gram: np.array(ids, dtype=np.int32) for gram, ids in grams.items()}
+        self._gram_counts = np.array(gram_counts, dtype=np.int32)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, ticker):
+        return ticker in self._by_ticker
+
+    def scored(self, query, limit=SEARCH_LIMIT):
+        """
+        (score, entry) pairs matching a normalized query, best first. Every
+        match scores its trigram similarity to the query, plus 3 for an exact
+        ticker, 2 for a ticker prefix or 1 for a name word prefix (of the
+        first query word). Without a prefix, the similarity must reach
+        FUZZY_THRESHOLD.
+        """
+        if not query or not self.entries:
+            return []
+        query_grams = _trigrams(query)
+        postings = [self._grams[gram] for gram in query_grams if gram in self._grams]
+        if postings:
+            shared = np.bincount(np.concatenate(postings), minlength=len(self.entries))
+            similarity = 2 * shared / (len(query_grams) + self._gram_counts)
+        else:
+            similarity = np.zeros(len(self.entries))
+
+        scores = {}
+        first = query.split()[0]
+        start = bisect.bisect_left(self._prefix_keys, first)
+        for key, kind, i in self._prefixes[start:start + limit * 20]:
+            if not key.startswith(first):
+                break
+            base = 3.0 if key == query and kind == 0 else 2.0 - kind
+            scores[i] = max(scores.get(i, 0), base + similarity[i])
+
+        matches = np.flatnonzero(similarity >= FUZZY_THRESHOLD)
+        if len(matches) > limit:
+            matches = matches[np.argpartition(-similarity[matches], limit)[:limit]]
+        for i in matches.tolist():
+            scores.setdefault(i, similarity[i])
+
+        best = sorted(scores, key=lambda i: (-scores[i], self.entries[i]['ticker']))[:limit]
+        return [(float(scores[i]), self.entries[i]) for i in best]
+
+_index = None
+# Tickers learned since _index was built, in a small index of their own
+_learned = TickerIndex()
+_lock = threading.Lock()
+_rebuilding = False
+
+def build_index():
+    learned = cache.get(LEARNED_KEY) or {}
+    entries = list(learned.values())
+    # Assets come last so their names and categories win over learned ones
+    entries += [
+        {'ticker': ticker, 'name': name, 'category': category}
+        for ticker, name, category in Asset.objects.filter(
+            category__in=[AssetCategory.STOCKS, AssetCategory.CRYPTO]
+        ).values_list('ticker', 'name', 'category')
+    ]
+    return TickerIndex(entries)
+
+def _install(index):
+    global _index, _learned
+    with _lock:
+        _index = index
+        _learned = TickerIndex(e for e in _learned.entries if e['ticker'] not in index)
+
+def _rebuild_in_background():
+    global _rebuilding
+    def run():
+        global _rebuilding
+        try:
+            _install(build_index())
+        except Exception as e:
+            logger.error(f"Error rebuilding the ticker index: {e}")
+        finally:
+            _rebuilding = False
+            connection.close()
+    _rebuilding = True
+    threading.Thread(target=run, name='ticker index', daemon=True).start()
+
+def get_index():
+    """
+    Process-wide index of the Asset table and the learned tickers. Built
+    inline the first time; once older than INDEX_TTL it keeps answering
+    while a fresh one is built in the background.
+    """
+    if _index is None:
+        _install(build_index())
+    elif time.monotonic() - _index.built_at > INDEX_TTL and not _rebuilding:
+        with _lock:
+            if not _rebuilding:
+                _rebuild_in_background()
+    return _index
+
+def search(query, limit=SEARCH_LIMIT):
+    """
+    Entries (ticker, name, category) matching `query`, best first.
+    """
+    query = normalize_query(query)
+    scored = get_index().scored(query, limit) + _learned.scored(query, limit)
+    scored.sort(key=lambda pair: (-pair[0], pair[1]['ticker']))
+    results = {}
+    for _, entry in scored:
+        results.setdefault(entry['ticker'], dict(entry))
+    return list(results.values())[:limit]
+
+def _lock_learned():
+    deadline = time.monotonic() + LEARNED_LOCK_WAIT
+    while not cache.add(LEARNED_LOCK_KEY, 1, LEARNED_LOCK_TTL):
+        if time.monotonic() >= deadline:
+            return False
+        time.sleep(LEARNED_LOCK_POLL_INTERVAL)
+    return True
+
+def learn(entries):
+    """
+    Remembers tickers returned by an online search, in this process and in
+    the shared cache for the next index build of every process. The shared
+    entry is updated under a cache lock, so concurrent searches do not drop
+    each other's tickers.
+    """
+    global _learned
+    entries = [{'ticker': e['ticker'], 'name': e['name'], 'category': e['category']} for e in entries]
+    if not entries:
+        return
+    index = get_index()
+    with _lock:
+        _learned = TickerIndex(_learned.entries + [e for e in entries if e['ticker'] not in index])
+    if not _lock_learned():
+        logger.warning(f"Learned tickers busy, {len(entries)} tickers only kept in this process")
+        return
+    try:
+        learned = cache.get(LEARNED_KEY) or {}
+        learned.update((entry['ticker'], entry) for entry in entries)
+        if len(learned) > LEARNED_MAX:
+            # dicts keep insertion order: drop the oldest
+            learned = dict(list(learned.items())[-LEARNED_MAX:])
+        cache.set(LEARNED_KEY, learned, None)
+    finally:
+        cache.delete(LEARNED_LOCK_KEY)
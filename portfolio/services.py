@@ -1,9 +1,18 @@
-import yfinance as yf
-import ccxt
+import asyncio
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
 from decimal import Decimal
-from django.utils import timezone
+from asgiref.sync import sync_to_async
 from django.core.cache import cache
+from django.db import connection, transaction
+from django.utils import timezone
 from .models import Asset, AssetCategory
+from .pubsub import publish_prices
+from .prices import ingest_price_frame
+from .providers import close_series, get_provider
+from .cache import get_or_refresh, refresh
+from .search import learn, normalize_query, search as search_index
+from .telemetry import bind_run
 import logging
 
 logger = logging.getLogger(__name__)
@@ -32,129 +41,159 @@ MARKET_TICKERS = {
     ],
 }
 
+# Asset details and the market overview are fresh for 5 minutes, then served
+# stale for up to an hour while a single caller refreshes them.
+MARKET_DATA_FRESH_FOR = 300
+MARKET_DATA_KEEP_FOR = 60 * 60
+MARKET_OVERVIEW_KEY = 'market_overview'
+
+def asset_details_key(ticker):
+    return f'asset_details:{ticker}'
+
 def fetch_asset_details(ticker):
     """
     Fetches comprehensive details for a single asset from Yahoo Finance.
     Returns a dict with all available financial information.
+    Cached with stale-while-revalidate, see cache.get_or_refresh.
     """
-    cache_key = f'asset_detail_{ticker}'
-    cached = cache.get(cache_key)
-    if cached:
-        return cached
-    
-    try:
-        t = yf.Ticker(ticker)
-        info = t.info
-        
-        # Get historical data for chart
-        hist = t.history(period='1mo')
-        chart_data = []
-        chart_labels = []
-        if not hist.empty:
-            for date, row in hist.iterrows():
-                chart_labels.append(date.strftime('%d/%m'))
-                price = row['Close']
-                if hasattr(price, 'item'):
-                    price = price.item()
-                chart_data.append(round(price, 2))
-        
-        # Calculate 24h change
-        hist_2d = t.history(period='2d')
-        change_pct = 0
-        if len(hist_2d) >= 2:
-            current = hist_2d['Close'].iloc[-1]
-            previous = hist_2d['Close'].iloc[-2]
-            if hasattr(current, 'item'):
-                current = current.item()
-            if hasattr(previous, 'item'):
-                previous = previous.item()
+    return get_or_refresh(
+        asset_details_key(ticker),
+        lambda: _download_asset_details(ticker),
+        MARKET_DATA_FRESH_FOR,
+        MARKET_DATA_KEEP_FOR,
+        fallback=lambda error: _fallback_asset_details(ticker, error),
+    )
+
+def refresh_asset_details(ticker, min_fresh=0):
+    """
+    Refetches the cached details of `ticker` unless they stay fresh for
+    `min_fresh` seconds, see cache.refresh. Used by the cache warmer.
+    """
+    return refresh(
+        asset_details_key(ticker),
+        lambda: _download_asset_details(ticker),
+        MARKET_DATA_FRESH_FOR,
+        MARKET_DATA_KEEP_FOR,
+        min_fresh,
+    )
+
+def _download_asset_details(ticker):
+    provider = get_provider()
+    # One round trip: details and history are fetched side by side, and the
+    # 24h change comes from the last two closes of the chart history.
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        info_future = pool.submit(bind_run(provider.details), ticker)
+        hist = provider.history([ticker], period='1mo')
+        info = info_future.result()
+
+    closes = close_series(hist, ticker)
+    chart_labels = []
+    chart_data = []
+    change_pct = 0
+    if not closes.empty:
+        chart_labels = closes.index.strftime('%d/%m').tolist()
+        chart_data = closes.round(2).tolist()
+        if len(closes) >= 2:
+            current, previous = closes.iloc[-1].item(), closes.iloc[-2].item()
             if previous:
                 change_pct = ((current - previous) / previous) * 100
-        
-        result = {
-            'ticker': ticker,
-            'name': info.get('shortName') or info.get('longName') or ticker,
-            'price': info.get('regularMarketPrice') or info.get('currentPrice') or 0,
-            'change_pct': round(change_pct, 2),
-            'currency': info.get('currency', 'USD'),
-            
-            # Key metrics
-            'market_cap': info.get('marketCap'),
-            'volume': info.get('volume') or info.get('regularMarketVolume'),
-            'avg_volume': info.get('averageVolume'),
-            'pe_ratio': info.get('trailingPE'),
-            'eps': info.get('trailingEps'),
-            'dividend_yield': info.get('dividendYield'),
-            'beta': info.get('beta'),
-            
-            # 52-week range
-            'week_52_high': info.get('fiftyTwoWeekHigh'),
-            'week_52_low': info.get('fiftyTwoWeekLow'),
-            'day_high': info.get('dayHigh') or info.get('regularMarketDayHigh'),
-            'day_low': info.get('dayLow') or info.get('regularMarketDayLow'),
-            'open': info.get('open') or info.get('regularMarketOpen'),
-            'previous_close': info.get('previousClose') or info.get('regularMarketPreviousClose'),
-            
-            # Company info
-            'sector': info.get('sector'),
-            'industry': info.get('industry'),
-            'country': info.get('country'),
-            'website': info.get('website'),
-            'description': info.get('longBusinessSummary', '')[:500] if info.get('longBusinessSummary') else None,
-            'employees': info.get('fullTimeEmployees'),
-            
-            # Chart data
-            'chart_labels': chart_labels,
-            'chart_data': chart_data,
-            
-            # Quote type
-            'quote_type': info.get('quoteType', 'EQUITY'),
-        }
-        
-        # Cache for 5 minutes
-        cache.set(cache_key, result, 300)
-        return result
-        
-    except Exception as e:
-        logger.error(f"Error fetching details for {ticker}: {e}")
-        # Return mock fallback data
-        mock_data = {
-            'AAPL': {'name': 'Apple Inc.', 'price': 185.92, 'change_pct': 0.67, 'market_cap': 2900000000000, 'pe_ratio': 30.5, 'sector': 'Technology'},
-            'MSFT': {'name': 'Microsoft Corp.', 'price': 376.04, 'change_pct': 1.23, 'market_cap': 2800000000000, 'pe_ratio': 35.2, 'sector': 'Technology'},
-            'GOOGL': {'name': 'Alphabet Inc.', 'price': 140.21, 'change_pct': -0.45, 'market_cap': 1800000000000, 'pe_ratio': 25.1, 'sector': 'Technology'},
-            'BTC-USD': {'name': 'Bitcoin', 'price': 45721.00, 'change_pct': 2.41, 'market_cap': 900000000000, 'sector': 'Cryptocurrency'},
-            'ETH-USD': {'name': 'Ethereum', 'price': 2430.50, 'change_pct': 1.15, 'market_cap': 290000000000, 'sector': 'Cryptocurrency'},
-            'MC.PA': {'name': 'LVMH', 'price': 738.50, 'change_pct': 0.89, 'market_cap': 370000000000, 'pe_ratio': 24.5, 'sector': 'Consumer Goods'},
-            '^GSPC': {'name': 'S&P 500', 'price': 4780.20, 'change_pct': 0.35, 'sector': 'Index'},
-            '^FCHI': {'name': 'CAC 40', 'price': 7452.80, 'change_pct': 0.28, 'sector': 'Index'},
-        }
-        fallback = mock_data.get(ticker, {})
-        return {
-            'ticker': ticker,
-            'name': fallback.get('name', ticker),
-            'price': fallback.get('price', 0),
-            'change_pct': fallback.get('change_pct', 0),
-            'currency': 'USD',
-            'market_cap': fallback.get('market_cap'),
-            'pe_ratio': fallback.get('pe_ratio'),
-            'sector': fallback.get('sector'),
-            'chart_labels': ['01/01', '02/01', '03/01', '04/01', '05/01'],
-            'chart_data': [100, 102, 101, 105, 103],
-            'error': str(e),
-        }
+
+        # Keep the downloaded closes for local charts and backfills
+        asset = Asset.objects.filter(ticker=ticker).first()
+        if asset:
+            ingest_price_frame(hist, [asset])
+
+    result = {
+        'ticker': ticker,
+        'name': info.get('shortName') or info.get('longName') or ticker,
+        'price': info.get('regularMarketPrice') or info.get('currentPrice') or 0,
+        'change_pct': round(change_pct, 2),
+        'currency': info.get('currency', 'USD'),
+
+        # Key metrics
+        'market_cap': info.get('marketCap'),
+        'volume': info.get('volume') or info.get('regularMarketVolume'),
+        'avg_volume': info.get('averageVolume'),
+        'pe_ratio': info.get('trailingPE'),
+        'eps': info.get('trailingEps'),
+        'dividend_yield': info.get('dividendYield'),
+        'beta': info.get('beta'),
+
+        # 52-week range
+        'week_52_high': info.get('fiftyTwoWeekHigh'),
+        'week_52_low': info.get('fiftyTwoWeekLow'),
+        'day_high': info.get('dayHigh') or info.get('regularMarketDayHigh'),
+        'day_low': info.get('dayLow') or info.get('regularMarketDayLow'),
+        'open': info.get('open') or info.get('regularMarketOpen'),
+        'previous_close': info.get('previousClose') or info.get('regularMarketPreviousClose'),
+
+        # Company info
+        'sector': info.get('sector'),
+        'industry': info.get('industry'),
+        'country': info.get('country'),
+        'website': info.get('website'),
+        'description': info.get('longBusinessSummary', '')[:500] if info.get('longBusinessSummary') else None,
+        'employees': info.get('fullTimeEmployees'),
+
+        # Chart data
+        'chart_labels': chart_labels,
+        'chart_data': chart_data,
+
+        # Quote type
+        'quote_type': info.get('quoteType', 'EQUITY'),
+    }
+    return result
+
+def _fallback_asset_details(ticker, error):
+    # Return mock fallback data
+    mock_data = {
+        'AAPL': {'name': 'Apple Inc.', 'price': 185.92, 'change_pct': 0.67, 'market_cap': 2900000000000, 'pe_ratio': 30.5, 'sector': 'Technology'},
+        'MSFT': {'name': 'Microsoft Corp.', 'price': 376.04, 'change_pct': 1.23, 'market_cap': 2800000000000, 'pe_ratio': 35.2, 'sector': 'Technology'},
+        'GOOGL': {'name': 'Alphabet Inc.', 'price': 140.21, 'change_pct': -0.45, 'market_cap': 1800000000000, 'pe_ratio': 25.1, 'sector': 'Technology'},
+        'BTC-USD': {'name': 'Bitcoin', 'price': 45721.00, 'change_pct': 2.41, 'market_cap': 900000000000, 'sector': 'Cryptocurrency'},
+        'ETH-USD': {'name': 'Ethereum', 'price': 2430.50, 'change_pct': 1.15, 'market_cap': 290000000000, 'sector': 'Cryptocurrency'},
+        'MC.PA': {'name': 'LVMH', 'price': 738.50, 'change_pct': 0.89, 'market_cap': 370000000000, 'pe_ratio': 24.5, 'sector': 'Consumer Goods'},
+        '^GSPC': {'name': 'S&P 500', 'price': 4780.20, 'change_pct': 0.35, 'sector': 'Index'},
+        '^FCHI': {'name': 'CAC 40', 'price': 7452.80, 'change_pct': 0.28, 'sector': 'Index'},
+    }
+    fallback = mock_data.get(ticker, {})
+    return {
+        'ticker': ticker,
+        'name': fallback.get('name', ticker),
+        'price': fallback.get('price', 0),
+        'change_pct': fallback.get('change_pct', 0),
+        'currency': 'USD',
+        'market_cap': fallback.get('market_cap'),
+        'pe_ratio': fallback.get('pe_ratio'),
+        'sector': fallback.get('sector'),
+        'chart_labels': ['01/01', '02/01', '03/01', '04/01', '05/01'],
+        'chart_data': [100, 102, 101, 105, 103],
+        'error': str(error),
+    }
 
 def fetch_market_data():
     """
     Fetches market data for popular indices, cryptos, and stocks.
     Returns dict with 'indices', 'crypto', 'stocks' keys.
-    Results are cached for 5 minutes.
+    Cached with stale-while-revalidate, see cache.get_or_refresh.
     Falls back to mock data if API fails.
     """
-    cache_key = 'market_overview_data'
-    cached = cache.get(cache_key)
-    if cached:
-        return cached
-    
+    return get_or_refresh(
+        MARKET_OVERVIEW_KEY,
+        _download_market_data,
+        MARKET_DATA_FRESH_FOR,
+        MARKET_DATA_KEEP_FOR,
+        fallback=_fallback_market_data,
+    )
+
+def refresh_market_data(min_fresh=0):
+    """
+    Refetches the cached market overview unless it stays fresh for
+    `min_fresh` seconds, see cache.refresh. Used by the cache warmer.
+    """
+    return refresh(MARKET_OVERVIEW_KEY, _download_market_data, MARKET_DATA_FRESH_FOR, MARKET_DATA_KEEP_FOR, min_fresh)
+
+def _download_market_data():
     result = {'indices': [], 'crypto': [], 'stocks': []}
     api_success = False
     
@@ -165,17 +204,14 @@ def fetch_market_data():
             all_tickers.append(ticker)
     
     try:
-        # Bulk fetch using yfinance
-        data = yf.download(all_tickers, period='2d', group_by='ticker', progress=False)
+        # Bulk fetch from the market data provider
+        data = get_provider().history(all_tickers, period='2d')
         
         if not data.empty:
             for category, items in MARKET_TICKERS.items():
                 for ticker, name in items:
                     try:
-                        if len(all_tickers) == 1:
-                            close_prices = data['Close']
-                        else:
-                            close_prices = data[ticker]['Close']
+                        close_prices = close_series(data, ticker)
                         
                         if len(close_prices) >= 2:
                             current = close_prices.iloc[-1]
@@ -204,227 +240,356 @@ def fetch_market_data():
     except Exception as e:
         logger.error(f"Error in fetch_market_data: {e}")
     
-    # Fallback to mock data if API failed
     if not api_success:
-        logger.info("Using mock market data as fallback")
-        result = {
-            'indices': [
-                {'ticker': '^GSPC', 'name': 'S&P 500', 'price': 4780.20, 'change_pct': 0.35},
-                {'ticker': '^IXIC', 'name': 'NASDAQ', 'price': 15032.50, 'change_pct': 0.52},
-                {'ticker': '^DJI', 'name': 'Dow Jones', 'price': 37532.10, 'change_pct': -0.12},
-                {'ticker': '^FCHI', 'name': 'CAC 40', 'price': 7452.80, 'change_pct': 0.28},
-            ],
-            'crypto': [
-                {'ticker': 'BTC-USD', 'name': 'Bitcoin', 'price': 45721.00, 'change_pct': 2.41},
-                {'ticker': 'ETH-USD', 'name': 'Ethereum', 'price': 2430.50, 'change_pct': 1.15},
-                {'ticker': 'SOL-USD', 'name': 'Solana', 'price': 98.40, 'change_pct': 5.23},
-                {'ticker': 'XRP-USD', 'name': 'XRP', 'price': 0.62, 'change_pct': -0.85},
-            ],
-            'stocks': [
-                {'ticker': 'AAPL', 'name': 'Apple', 'price': 185.92, 'change_pct': 0.67},
-                {'ticker': 'MSFT', 'name': 'Microsoft', 'price': 376.04, 'change_pct': 1.23},
-                {'ticker': 'GOOGL', 'name': 'Google', 'price': 140.21, 'change_pct': -0.45},
-                {'ticker': 'MC.PA', 'name': 'LVMH', 'price': 738.50, 'change_pct': 0.89},
-                {'ticker': 'AI.PA', 'name': 'Air Liquide', 'price': 178.30, 'change_pct': 0.32},
-                {'ticker': 'TTE.PA', 'name': 'TotalEnergies', 'price': 62.45, 'change_pct': -0.18},
-            ],
-        }
-    
-    # Cache for 5 minutes (or 1 minute for mock data)
-    cache.set(cache_key, result, 300 if api_success else 60)
+        raise ValueError("no market data received")
     return result
 
+def _fallback_market_data(error):
+    logger.info("Using mock market data as fallback")
+    return {
+        'indices': [
+            {'ticker': '^GSPC', 'name': 'S&P 500', 'price': 4780.20, 'change_pct': 0.35},
+            {'ticker': '^IXIC', 'name': 'NASDAQ', 'price': 15032.50, 'change_pct': 0.52},
+            {'ticker': '^DJI', 'name': 'Dow Jones', 'price': 37532.10, 'change_pct': -0.12},
+            {'ticker': '^FCHI', 'name': 'CAC 40', 'price': 7452.80, 'change_pct': 0.28},
+        ],
+        'crypto': [
+            {'ticker': 'BTC-USD', 'name': 'Bitcoin', 'price': 45721.00, 'change_pct': 2.41},
+            {'ticker': 'ETH-USD', 'name': 'Ethereum', 'price': 2430.50, 'change_pct': 1.15},
+            {'ticker': 'SOL-USD', 'name': 'Solana', 'price': 98.40, 'change_pct': 5.23},
+            {'ticker': 'XRP-USD', 'name': 'XRP', 'price': 0.62, 'change_pct': -0.85},
+        ],
+        'stocks': [
+            {'ticker': 'AAPL', 'name': 'Apple', 'price': 185.92, 'change_pct': 0.67},
+            {'ticker': 'MSFT', 'name': 'Microsoft', 'price': 376.04, 'change_pct': 1.23},
+            {'ticker': 'GOOGL', 'name': 'Google', 'price': 140.21, 'change_pct': -0.45},
+            {'ticker': 'MC.PA', 'name': 'LVMH', 'price': 738.50, 'change_pct': 0.89},
+            {'ticker': 'AI.PA', 'name': 'Air Liquide', 'price': 178.30, 'change_pct': 0.32},
+            {'ticker': 'TTE.PA', 'name': 'TotalEnergies', 'price': 62.45, 'change_pct': -0.18},
+        ],
+    }
+
+# Rows per UPDATE statement when writing fetched prices
+PRICE_WRITE_BATCH_SIZE = 500
+PRICE_PLACES = Decimal(10) ** -Asset._meta.get_field('current_price').decimal_places
+
 def update_asset_prices(assets):
     """
     Updates the current_price of the given list of Asset objects.
+    Returns counters of the run: {'updated', 'unchanged', 'failed'}.
     """
+    stats = {'updated': 0, 'unchanged': 0, 'failed': 0}
     stocks = [a for a in assets if a.category == AssetCategory.STOCKS]
     cryptos = [a for a in assets if a.category == AssetCategory.CRYPTO]
 
     if stocks:
-        _update_stocks(stocks)
+        _update_stocks(stocks, stats)
     
     if cryptos:
-        _update_cryptos(cryptos)
+        _update_cryptos(cryptos, stats)
+    return stats
 
-def _update_stocks(assets):
-    tickers = [a.ticker for a in assets]
-    if not tickers:
+def _supports_update_from():
+    if connection.vendor == 'postgresql':
+        return True
+    return connection.vendor == 'sqlite' and connection.Database.sqlite_version_info >= (3, 33)
+
+def _set_prices(rows):
+    """
+    Writes current_price/last_updated from `rows` of (pk, price, updated) in
+    one UPDATE ... FROM statement. Unlike bulk_update's CASE WHEN chain, the
+    database joins on the primary key, so the cost stays linear in the batch
+    size. Backends without UPDATE ... FROM (MySQL, SQLite < 3.33) fall back
+    to bulk_update.
+    """
+    if not _supports_update_from():
+        Asset.objects.bulk_update(
+            [Asset(pk=pk, current_price=price, last_updated=updated) for pk, price, updated in rows],
+            ['current_price', 'last_updated'],
+        )
         return
+    meta = Asset._meta
+    qn = connection.ops.quote_name
+    table = qn(meta.db_table)
+    price_field = meta.get_field('current_price')
+    pk, price, updated = (qn(meta.pk.column), qn(price_field.column), qn(meta.get_field('last_updated').column))
+    params = []
+    for row_pk, row_price, row_updated in rows:
+        params += [
+            row_pk,
+            connection.ops.adapt_decimalfield_value(row_price, price_field.max_digits, price_field.decimal_places),
+            connection.ops.adapt_datetimefield_value(row_updated),
+        ]
+    values = ', '.join(['(%s, %s, %s)'] * len(rows))
+    # The CTE names the VALUES columns, whose implicit names differ per backend
+    sql = (
+        f"WITH v (id, price, updated) AS (VALUES {values}) "
+        f"UPDATE {table} SET {price} = v.price, {updated} = v.updated "
+        f"FROM v WHERE {table}.{pk} = v.id"
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+
+def _write_prices(assets, prices, stats):
+    """
+    Writes the fetched prices ({ticker: price}) of `assets` with batched
+    UPDATE statements in a single transaction, so a run costs one round trip
+    per PRICE_WRITE_BATCH_SIZE assets rather than one per asset. Assets whose
+    price did not move are skipped, assets without a price count as failed.
+    The assets only take their new price once it is written.
+    """
+    now = timezone.now()
+    dirty = []
+    changed = {}
+    for asset in assets:
+        price = prices.get(asset.ticker)
+        if price is None:
+            stats['failed'] += 1
+            continue
+        new_price = Decimal(str(price)).quantize(PRICE_PLACES)
+        if new_price == asset.current_price:
+            stats['unchanged'] += 1
+            continue
+        dirty.append((asset, new_price))
+        changed[asset.ticker] = float(price)
 
+    if not dirty:
+        return
+    rows = [(asset.pk, new_price, now) for asset, new_price in dirty]
     try:
-        # yfinance allows bulk download
-        # period='1d' is usually enough to get current price (Close or regularMarketPrice)
-        # Using Tickers to get info is slower but more detailed. download is faster for bulk.
-        # But download returns a DataFrame.
-        # Let's use Tickers object for robustness or download for speed? 
-        # For simplicity and robust current price:
-        # yf.download(tickers, period="1d") returns OHLC data.
-        
-        # Alternative: fetch one by one if list is short, or bulk.
-        # yfinance bulk is tricky if some tickers are invalid.
-        
-        # Let's try bulk download of 'Last Price'
-        data = yf.download(tickers, period="1d", group_by='ticker', progress=False)
-        
-        # If single ticker, data structure is different.
-        is_single = len(tickers) == 1
-        
-        for asset in assets:
-            try:
-                if is_single:
-                     # Accessing the scalar value.
-                     # 'Close' is the closing price. For live market, we might want 'Regular Market Price' 
-                     # but Ticker.info is very slow. 'Close' from download is often previous close or current.
-                     # Let's use the last available 'Close' price.
-                     price = data['Close'].iloc[-1]
-                else:
-                    price = data[asset.ticker]['Close'].iloc[-1]
-                
-                # Handling NaN
-                if hasattr(price, 'item'): 
-                     price = price.item() # convert numpy float to python float
-                
-                if price and price > 0:
-                    asset.current_price = Decimal(str(price))
-                    asset.last_updated = timezone.now()
-                    asset.save(update_fields=['current_price', 'last_updated'])
-            except Exception as e:
-                logger.error(f"Error updating stock {asset.ticker}: {e}")
+        with transaction.atomic():
+            for i in range(0, len(rows), PRICE_WRITE_BATCH_SIZE):
+                _set_prices(rows[i:i + PRICE_WRITE_BATCH_SIZE])
+    except Exception as e:
+        logger.error(f"Error writing {len(dirty)} asset prices: {e}")
+        stats['failed'] += len(dirty)
+        return
+    for asset, new_price in dirty:
+        asset.current_price = new_price
+        asset.last_updated = now
+    stats['updated'] += len(dirty)
+    publish_prices(changed)
 
+def _update_stocks(assets, stats):
+    try:
+        prices = get_provider().quotes([a.ticker for a in assets])
+        # NaN closes were dropped while downloading
+        _write_prices(assets, {ticker: price for ticker, price in prices.items() if price > 0}, stats)
     except Exception as e:
         logger.error(f"Error in stock bulk update: {e}")
+        stats['failed'] += len(assets)
 
-def _update_cryptos(assets):
-    # Instantiate exchange (e.g. Binance or CoinGecko via ccxt if available, or just generic)
-    # efficient approach: use a public aggregator like binance for common pairs
-    exchange = ccxt.binance() 
-    
-    # Note: CCXT fetch_tickers is efficient if supported
+def _update_cryptos(assets, stats):
     try:
-        # Get all needed tickers
         # CCXT symbols are often BTC/USDT. Asset.ticker should match this format.
-        symbols = [a.ticker for a in assets]
-        
-        # fetchTickers might not be supported by all exchanges or for all symbols at once.
-        # Binance supports it.
-        try:
-           ticker_data = exchange.fetch_tickers(symbols)
-        except:
-           # Fallback to one by one if bulk fails
-           ticker_data = {}
-           for sym in symbols:
-               try:
-                   ticker_data[sym] = exchange.fetch_ticker(sym)
-               except Exception as e:
-                   logger.error(f"Error fetching crypto {sym}: {e}")
-
-        for asset in assets:
-            if asset.ticker in ticker_data:
-                data = ticker_data[asset.ticker]
-                price = data.get('last') or data.get('close')
-                if price:
-                    asset.current_price = Decimal(str(price))
-                    asset.last_updated = timezone.now()
-                    asset.save(update_fields=['current_price', 'last_updated'])
+        prices = get_provider('crypto').quotes([a.ticker for a in assets])
+        _write_prices(assets, prices, stats)
     except Exception as e:
         logger.error(f"Error in crypto update: {e}")
+        stats['failed'] += len(assets)
+
+# Online search results are cached per normalized query for a day
+SEARCH_CACHE_TIMEOUT = 60 * 60 * 24
+
+def _search_cache_key(q):
+    return f"search:online:{hashlib.sha1(q.encode()).hexdigest()}"
 
 def search_assets_online(query):
     """
-    Search for assets using Yahoo Finance Autocomplete API.
-    Returns a list of dicts: {'ticker':Str, 'name':Str, 'category': AssetCategory}
+    Searches assets in the local ticker index (see search.py), falling back
+    to the market data provider (Yahoo Finance Autocomplete API by default)
+    when nothing matches locally.
+    Returns a list of dicts: {'ticker':Str, 'name':Str, 'category': AssetCategory, 'exists': Bool}
     """
-    import requests
-    
-    results = []
-    
-    # Simple formatting of the query
-    q = query.strip()
+    q = normalize_query(query)
     if not q:
-        return results
-        
-    # Yahoo Finance AutoComplete
-    # We use a user-agent to avoid being blocked
-    headers = {'User-Agent': 'Mozilla/5.0'}
-    url = f"https://query2.finance.yahoo.com/v1/finance/search?q={q}"
-    
+        return []
+
+    results = search_index(q)
+    if not results:
+        key = _search_cache_key(q)
+        results = cache.get(key)
+        if results is None:
+            results = _search_results(_search_provider(query.strip()))
+            if results is not None:
+                cache.set(key, results, SEARCH_CACHE_TIMEOUT)
+                learn(results)
+        results = results or []
+
+    # One query for every result's exists flag
+    existing = set(Asset.objects.filter(ticker__in=[r['ticker'] for r in results]).values_list('ticker', flat=True))
+    return [{**r, 'exists': r['ticker'] in existing} for r in results]
+
+# Provider searches in flight, by (event loop, normalized query)
+_searches_in_flight = {}
+
+async def asearch_assets_online(query):
+    """
+    search_assets_online for async views. Concurrent misses of the same
+    normalized query share a single provider call.
+    """
+    q = normalize_query(query)
+    if not q:
+        return []
+
+    results = await sync_to_async(search_index)(q)
+    if not results:
+        results = await cache.aget(_search_cache_key(q))
+        if results is None:
+            loop = asyncio.get_running_loop()
+            task = _searches_in_flight.get((loop, q))
+            if task is None:
+                task = loop.create_task(_asearch_online(query.strip(), q))
+                _searches_in_flight[(loop, q)] = task
+                task.add_done_callback(lambda _: _searches_in_flight.pop((loop, q), None))
+            # A cancelled caller must not cancel the search the others wait for
+            results = await asyncio.shield(task)
+        results = results or []
+
+    tickers = [r['ticker'] for r in results]
+    existing = {ticker async for ticker in Asset.objects.filter(ticker__in=tickers).values_list('ticker', flat=True)}
+    return [{**r, 'exists': r['ticker'] in existing} for r in results]
+
+async def _asearch_online(query, q):
     try:
-        response = requests.get(url, headers=headers, timeout=5)
-        data = response.json()
-        
-        for item in data.get('quotes', []):
-            # We only care about EQUITY (Stocks), CRYPTOCURRENCY, ETFs, etc.
-            quote_type = item.get('quoteType', '')
-            symbol = item.get('symbol')
-            shortname = item.get('shortname') or item.get('longname') or symbol
-            
-            category = None
-            if quote_type == 'EQUITY':
-                category = AssetCategory.STOCKS
-            elif quote_type == 'CRYPTOCURRENCY':
-                category = AssetCategory.CRYPTO
-            elif quote_type == 'ETF':
-                category = AssetCategory.STOCKS # Treat ETF as stocks for now
-            elif quote_type == 'MUTUALFUND':
-                category = AssetCategory.STOCKS
-                
-            if category and symbol:
-                results.append({
-                    'ticker': symbol,
-                    'name': shortname,
-                    'category': category,
-                    'exists': Asset.objects.filter(ticker=symbol).exists()
-                })
-                
+        results = _search_results(await get_provider().asearch(query))
     except Exception as e:
         logger.error(f"Error searching Yahoo Finance for {query}: {e}")
-        
+        return None
+    await cache.aset(_search_cache_key(q), results, SEARCH_CACHE_TIMEOUT)
+    await sync_to_async(learn)(results)
     return results
 
-def create_asset_from_ticker(ticker, category=None):
+def _search_provider(query):
     """
-    Fetches details for a ticker and creates it in DB.
+    Raw provider search results, None if the search failed.
     """
-    import yfinance as yf
-    
     try:
-        t = yf.Ticker(ticker)
-        # Fetch minimal history to get current price
-        hist = t.history(period='1d')
+        return get_provider().search(query)
+    except Exception as e:
+        logger.error(f"Error searching Yahoo Finance for {query}: {e}")
+        return None
+
+def _search_results(items):
+    """
+    Stock-like and crypto results of a provider search (None passes through).
+    """
+    if items is None:
+        return None
+    results = []
+    for item in items:
+        # We only care about EQUITY (Stocks), CRYPTOCURRENCY, ETFs, etc.
+        quote_type = item.get('quoteType', '')
+        symbol = item.get('symbol')
+        shortname = item.get('shortname') or item.get('longname') or symbol
         
-        if hist.empty:
-            return None
+        category = None
+        if quote_type == 'EQUITY':
+            category = AssetCategory.STOCKS
+        elif quote_type == 'CRYPTOCURRENCY':
+            category = AssetCategory.CRYPTO
+        elif quote_type == 'ETF':
+            category = AssetCategory.STOCKS # Treat ETF as stocks for now
+        elif quote_type == 'MUTUALFUND':
+            category = AssetCategory.STOCKS
             
-        price = hist['Close'].iloc[-1]
-        
-        # Try to infer name if we don't have it
-        name = t.info.get('shortName') or t.info.get('longName') or ticker
-        
-        # Infer category if not provided
-        if not category:
-            qtype = t.info.get('quoteType')
-            if qtype == 'CRYPTOCURRENCY':
-                category = AssetCategory.CRYPTO
-            else:
-                category = AssetCategory.STOCKS
-        
-        # Convert numpy types to python Native types to avoid Decimal errors
-        if hasattr(price, 'item'):
-             price = price.item()
-                
-        asset, created = Asset.objects.update_or_create(
-            ticker=ticker,
-            defaults={
-                'name': name,
+        if category and symbol:
+            results.append({
+                'ticker': symbol,
+                'name': shortname,
                 'category': category,
-                'current_price': Decimal(str(price)),
-                'last_updated': timezone.now()
-            }
-        )
-        return asset
-        
+            })
+    return results
+
+# Concurrent detail lookups of a bulk import
+IMPORT_WORKERS = 8
+
+def create_asset_from_ticker(ticker, category=None):
+    """
+    Fetches details for a ticker and creates it in DB.
+    Returns the Asset, or None if no price could be found.
+    """
+    report = import_assets([ticker], category=category)
+    return report['assets'][0] if report['assets'] else None
+
+def _resolve_details(ticker):
+    # Name and quote type; a failed lookup only costs the nice name.
+    # ccxt pairs (BTC/USDT) are unknown to the default provider.
+    try:
+        return get_provider('crypto' if '/' in ticker else 'default').details(ticker)
     except Exception as e:
-        logger.error(f"Error creating asset {ticker}: {e}")
-        return None
+        logger.warning(f"Error fetching details of {ticker}: {e}")
+        return {}
+
+def _import_quotes(tickers):
+    # ccxt pairs (BTC/USDT) are priced by the crypto provider, the rest in one batched download
+    pairs = [t for t in tickers if '/' in t]
+    others = [t for t in tickers if '/' not in t]
+    prices = {}
+    if others:
+        prices.update(get_provider().quotes(others))
+    if pairs:
+        prices.update(get_provider('crypto').quotes(pairs))
+    return prices
+
+def import_assets(tickers, category=None, workers=IMPORT_WORKERS):
+    """
+    Creates or updates the assets of many tickers at once. Prices come from
+    one batched quote download, run alongside the detail lookups (names and
+    categories), which go `workers` at a time. Everything is written with a
+    single bulk upsert on ticker.
+    Returns {'assets': [Asset], 'created': [ticker], 'updated': [ticker],
+    'failed': [ticker]}; tickers without a price fail.
+    """
+    max_length = Asset._meta.get_field('ticker').max_length
+    tickers = list(dict.fromkeys(t.strip() for t in tickers if t and t.strip()))
+    failed = [t for t in tickers if len(t) > max_length]
+    tickers = [t for t in tickers if len(t) <= max_length]
+    report = {'assets': [], 'created': [], 'updated': [], 'failed': failed}
+    if not tickers:
+        return report
+
+    with ThreadPoolExecutor(max_workers=workers + 1) as pool:
+        quotes = pool.submit(bind_run(_import_quotes), tickers)
+        details = dict(zip(tickers, pool.map(bind_run(_resolve_details), tickers)))
+        try:
+            prices = quotes.result()
+        except Exception as e:
+            logger.error(f"Error downloading prices of {len(tickers)} imported tickers: {e}")
+            prices = {}
+
+    now = timezone.now()
+    name_length = Asset._meta.get_field('name').max_length
+    assets = []
+    for ticker in tickers:
+        price = prices.get(ticker)
+        if not price or price != price:  # missing or NaN
+            report['failed'].append(ticker)
+            continue
+        info = details[ticker]
+        asset_category = category
+        if not asset_category:
+            crypto = '/' in ticker or info.get('quoteType') == 'CRYPTOCURRENCY'
+            asset_category = AssetCategory.CRYPTO if crypto else AssetCategory.STOCKS
+        assets.append(Asset(
+            ticker=ticker,
+            name=(info.get('shortName') or info.get('longName') or ticker)[:name_length],
+            category=asset_category,
+            current_price=Decimal(str(price)).quantize(PRICE_PLACES),
+            last_updated=now,
+        ))
+    if not assets:
+        return report
 
+    existing = set(Asset.objects.filter(ticker__in=[a.ticker for a in assets]).values_list('ticker', flat=True))
+    Asset.objects.bulk_create(
+        assets,
+        update_conflicts=True,
+        unique_fields=['ticker'],
+        update_fields=['name', 'category', 'current_price', 'last_updated'],
+    )
+    # Primary keys are not returned for upserted rows on every backend
+    report['assets'] = list(Asset.objects.filter(ticker__in=[a.ticker for a in assets]).order_by('ticker'))
+    for asset in assets:
+        report['updated' if asset.ticker in existing else 'created'].append(asset.ticker)
+    return report
@@ -0,0 +1,19 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+from .models import Holding, Portfolio
+from .history import refresh_net_worth_history, revalue_portfolio_snapshot
+from .valuation import bump_holdings_version
+
+@receiver([post_save, post_delete], sender=Holding)
+def holding_changed(sender, instance, **kwargs):
+    # Keep today's snapshot (if already taken) and the user rollup in sync
+    user_id = Portfolio.objects.filter(pk=instance.portfolio_id).values_list('user_id', flat=True).first()
+    if user_id is not None:
+        bump_holdings_version(user_id)
+        revalue_portfolio_snapshot(instance.portfolio_id, user_id, timezone.localdate())
+
+@receiver(post_delete, sender=Portfolio)
+def portfolio_deleted(sender, instance, **kwargs):
+    # The portfolio's history is gone, rebuild the owner's whole rollup
+    refresh_net_worth_history(user_ids=[instance.user_id])
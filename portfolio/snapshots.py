@@ -0,0 +1,64 @@
+import time
+from .models import Portfolio, PortfolioHistory
+import logging
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_CHUNK_SIZE = 5000
+
+def _portfolio_totals(min_id, max_id, limit):
+    """
+    One grouped query valuing a keyset page of portfolios from their holdings
+    joined to assets. Portfolios without holdings come back with 0.
+    """
+    qs = Portfolio.objects.filter(pk__gt=min_id)
+    if max_id is not None:
+        qs = qs.filter(pk__lte=max_id)
+    return list(
+        qs.order_by('pk')
+        .with_valuation()
+        .values_list('pk', 'total_value', 'total_invested')[:limit]
+    )
+
+def snapshot_portfolios(date, min_id=0, max_id=None, chunk_size=SNAPSHOT_CHUNK_SIZE):
+    """
+    Writes the PortfolioHistory row of `date` for every portfolio with
+    min_id < pk <= max_id (all portfolios by default).
+    Portfolios are valued chunk by chunk with a single aggregation each and
+    written with a bulk upsert (ON CONFLICT (portfolio, date) DO UPDATE).
+    Returns a dict of run statistics.
+    """
+    start = time.perf_counter()
+    rows = 0
+    failed_chunks = 0
+    last_id = min_id
+
+    while True:
+        totals = _portfolio_totals(last_id, max_id, chunk_size)
+        if not totals:
+            break
+        last_id = totals[-1][0]
+        try:
+            PortfolioHistory.objects.bulk_create(
+                [
+                    PortfolioHistory(portfolio_id=pk, date=date, total_value=total, invested_value=invested)
+                    for pk, total, invested in totals
+                ],
+                update_conflicts=True,
+                unique_fields=['portfolio', 'date'],
+                update_fields=['total_value', 'invested_value'],
+            )
+            rows += len(totals)
+        except Exception as e:
+            failed_chunks += 1
+            logger.error(f"Error snapshotting portfolios {totals[0][0]}-{last_id}: {e}")
+        if len(totals) < chunk_size:
+            break
+
+    duration = time.perf_counter() - start
+    return {
+        'rows': rows,
+        'failed_chunks': failed_chunks,
+        'duration': duration,
+        'rows_per_second': rows / duration if duration else 0,
+    }
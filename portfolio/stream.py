@@ -0,0 +1,136 @@
+"""
+Server-Sent Events stream of price and valuation deltas.
+
+The stream is served as a plain ASGI app in front of Django (see
+wealthgravity/asgi.py) rather than through Django's ASGIHandler: the handler
+gives every request its own thread-sensitive executor, whose thread lives as
+long as the response, so each open stream would hold a thread. Here an idle
+connection only costs a subscription queue (pubsub.py), and the few blocking
+calls (session, holdings, valuation) run on the loop's shared executor.
+
+The price_stream view serves the same events when the app runs under Django
+alone (runserver, tests).
+"""
+import asyncio
+import json
+from importlib import import_module
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user
+from django.db import close_old_connections
+from django.http import HttpRequest
+from django.http.cookie import parse_cookie
+from django.urls import reverse
+from .models import Holding
+from .pubsub import get_broker
+from .valuation import get_user_valuation
+
+# Keep-alive interval and lifetime of a price stream. EventSource reconnects by
+# itself, which also bounds how long a silently dropped connection lingers.
+STREAM_KEEPALIVE = 15
+STREAM_MAX_AGE = 300
+
+HEADERS = [
+    (b'content-type', b'text/event-stream'),
+    (b'cache-control', b'no-cache'),
+    (b'x-accel-buffering', b'no'),
+]
+
+def _off_loop(func):
+    # On the loop's shared executor, closing the database connection the
+    # call may have opened (no request_finished signal here to do it)
+    def call(*args):
+        try:
+            return func(*args)
+        finally:
+            close_old_connections()
+    return sync_to_async(call, thread_sensitive=False)
+
+def _session_user(session_key):
+    request = HttpRequest()
+    request.session = import_module(settings.SESSION_ENGINE).SessionStore(session_key)
+    user = get_user(request)
+    return user if user.is_authenticated else None
+
+def held_tickers(user):
+    return set(Holding.objects.filter(portfolio__user=user).values_list('asset__ticker', flat=True).distinct())
+
+async def price_events(user_id, held):
+    """
+    Event stream chunks for the user: prices of the held tickers and the
+    resulting net worth and P&L, every time the price updater publishes.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + STREAM_MAX_AGE
+    valuation_of = _off_loop(get_user_valuation)
+    yield "retry: 5000\n\n"
+    async with get_broker().subscribe() as subscription:
+        while loop.time() < deadline:
+            message = await subscription.get(timeout=STREAM_KEEPALIVE)
+            if message is None:
+                yield ": keepalive\n\n"
+                continue
+            prices = {ticker: price for ticker, price in message['prices'].items() if ticker in held}
+            if not prices:
+                continue
+            valuation = await valuation_of(user_id)
+            delta = {
+                'prices': prices,
+                'net_worth': float(valuation['total_net_worth']),
+                'pnl': float(valuation['pnl']),
+            }
+            yield f"event: prices\ndata: {json.dumps(delta)}\n\n"
+
+async def _until_disconnect(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+async def _stream(send, events):
+    await send({'type': 'http.response.start', 'status': 200, 'headers': HEADERS})
+    async for chunk in events:
+        await send({'type': 'http.response.body', 'body': chunk.encode(), 'more_body': True})
+    await send({'type': 'http.response.body', 'body': b''})
+
+def _authenticate(session_key):
+    # (user id, held tickers) of the session's user, None if anonymous
+    user = _session_user(session_key) if session_key else None
+    return (user.pk, held_tickers(user)) if user is not None else None
+
+async def serve(scope, receive, send):
+    """
+    ASGI app of the stream, authenticated by the Django session cookie.
+    """
+    cookies = {}
+    for name, value in scope.get('headers', []):
+        if name == b'cookie':
+            cookies.update(parse_cookie(value.decode('latin-1')))
+    found = await _off_loop(_authenticate)(cookies.get(settings.SESSION_COOKIE_NAME))
+    if found is None:
+        await send({'type': 'http.response.start', 'status': 401, 'headers': []})
+        await send({'type': 'http.response.body', 'body': b''})
+        return
+
+    streaming = asyncio.ensure_future(_stream(send, price_events(*found)))
+    disconnected = asyncio.ensure_future(_until_disconnect(receive))
+    done, pending = await asyncio.wait({streaming, disconnected}, return_when=asyncio.FIRST_COMPLETED)
+    for task in pending:
+        task.cancel()
+    await asyncio.gather(*pending, return_exceptions=True)
+    if streaming in done:
+        streaming.result()
+
+class PriceStreamRouter:
+    """
+    ASGI app serving the price stream itself and everything else with `app`
+    (the Django application).
+    """
+    def __init__(self, app):
+        self.app = app
+        self._path = None
+
+    async def __call__(self, scope, receive, send):
+        if self._path is None:
+            self._path = reverse('portfolio:price_stream')
+        if scope['type'] == 'http' and scope['path'] == self._path:
+            return await serve(scope, receive, send)
+        return await self.app(scope, receive, send)
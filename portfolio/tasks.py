@@ -1,58 +1,268 @@
-from celery import shared_task
+from celery import chord, shared_task
+from celery.signals import worker_ready
+import datetime
+import time
+from contextlib import nullcontext
+from django.core.cache import caches
+from django.db.models import Max, Min
 from django.utils import timezone
-from .models import Asset, Portfolio, PortfolioHistory
+from .models import Asset, Portfolio
 from .services import update_asset_prices
+from .history import refresh_net_worth_history
+from .snapshots import snapshot_portfolios
+from .prices import top_up_prices
+from .locks import Lease
+from .tiered_cache import is_process_local
+from . import scheduling, warming
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Shard sizes for the fan-out tasks below
+SNAPSHOT_SHARD_SIZE = 5000  # portfolio ids per shard
+PRICE_SHARD_SIZE = 200  # tickers per shard
+# Leases keeping runs from overlapping (locks.py). Both price tasks write
+# Asset.current_price, so they share one.
+PRICE_LEASE = 'asset-prices'
+SNAPSHOT_LEASE = 'portfolio-snapshots'
+WARMING_LEASE = 'market-cache-warming'
+# Longest a sharded run may take, queueing included: the dispatching task
+# keeps the lease alive that long at most while the chord waits for workers
+CHORD_MAX_AGE = 3 * 60 * 60
+
+def _summarize(results, started):
+    """
+    Aggregates the per-shard results handed to a chord callback.
+    """
+    failures = [r for r in results if r.get('error')]
+    for r in failures:
+        logger.error(f"Shard {r['shard']} failed: {r['error']}")
+    timings = [r['duration'] for r in results]
+    return {
+        'shards': len(results),
+        'failed_shards': len(failures),
+        'duration': time.time() - started,
+        'slowest_shard': max(timings) if timings else 0,
+        'mean_shard': sum(timings) / len(timings) if timings else 0,
+    }
+
+def _heartbeat(name, token):
+    """
+    Keeps the lease of the run a shard belongs to alive while it works.
+    """
+    return Lease(name, token).heartbeat() if token else nullcontext()
+
+def _end_run(name, token, rerun=None):
+    """
+    Releases the lease of a finished run, then starts `rerun` if a run was
+    requested while this one held the lease.
+    """
+    if not token:
+        return
+    lease = Lease(name, token)
+    rerun_requested = lease.rerun_requested()
+    if not lease.release():
+        logger.warning(f"Lease {name} lapsed before the run ended")
+    if rerun is not None and rerun_requested:
+        rerun.delay()
+
 @shared_task
 def update_all_asset_prices():
     """
-    Updates prices for all assets in the database.
-    Runs every 15 minutes.
+    Updates prices for all assets in the database, due or not.
+    Work is split into ticker batches run as a group. Requested while
+    another price update runs, it runs once more after it instead.
     """
-    assets = list(Asset.objects.all())
-    if not assets:
+    lease = Lease(PRICE_LEASE)
+    if not lease.acquire():
+        lease.request_rerun()
+        logger.info("Asset prices already updating, a full update will follow.")
+        return
+    asset_ids = list(Asset.objects.order_by('category', 'ticker').values_list('pk', flat=True))
+    if not asset_ids:
         logger.info("No assets to update.")
+        _end_run(PRICE_LEASE, lease.token)
         return
-    
-    logger.info(f"Updating prices for {len(assets)} assets...")
-    update_asset_prices(assets)
-    logger.info("Asset prices updated.")
+    _update_prices_in_shards(asset_ids, lease)
+
+@shared_task
+def refresh_due_asset_prices():
+    """
+    Updates the prices of the assets due for a refresh, see scheduling.py.
+    Runs every scheduling.SCHEDULER_TICK seconds, skipped while another
+    price update runs (the assets stay due for the next tick).
+    """
+    lease = Lease(PRICE_LEASE)
+    if not lease.acquire():
+        logger.info("Asset prices already updating, skipped.")
+        return
+    asset_ids = scheduling.due_asset_ids()
+    if not asset_ids:
+        logger.info("No asset prices due.")
+        _end_run(PRICE_LEASE, lease.token, rerun=update_all_asset_prices)
+        return
+    _update_prices_in_shards(asset_ids, lease)
+
+def _update_prices_in_shards(asset_ids, lease):
+    # Ids are expected in (category, ticker) order, so shards stay single-provider.
+    # The lease is released by the chord callback, kept alive from here until then.
+    shards = [asset_ids[i:i + PRICE_SHARD_SIZE] for i in range(0, len(asset_ids), PRICE_SHARD_SIZE)]
+    logger.info(f"Updating prices for {len(asset_ids)} assets in {len(shards)} shards...")
+    try:
+        chord(update_asset_prices_shard.s(ids, lease=lease.token) for ids in shards)(
+            asset_prices_updated.s(time.time(), lease=lease.token)
+        )
+    except Exception:
+        _end_run(PRICE_LEASE, lease.token)
+        raise
+    lease.keep_alive(CHORD_MAX_AGE)
+
+@shared_task
+def update_asset_prices_shard(asset_ids, lease=None):
+    """
+    Updates the prices of one batch of assets.
+    """
+    start = time.perf_counter()
+    shard = f"{asset_ids[0]}..{asset_ids[-1]}" if asset_ids else "empty"
+    try:
+        with _heartbeat(PRICE_LEASE, lease):
+            stats = update_asset_prices(list(Asset.objects.filter(pk__in=asset_ids)))
+        return {'shard': shard, 'assets': len(asset_ids), 'duration': time.perf_counter() - start, **stats}
+    except Exception as e:
+        return {
+            'shard': shard, 'assets': len(asset_ids), 'duration': time.perf_counter() - start,
+            'updated': 0, 'unchanged': 0, 'failed': len(asset_ids), 'error': str(e),
+        }
+
+@shared_task
+def asset_prices_updated(results, started, lease=None):
+    """
+    Chord callback of update_all_asset_prices and refresh_due_asset_prices.
+    """
+    _end_run(PRICE_LEASE, lease, rerun=update_all_asset_prices)
+    summary = _summarize(results, started)
+    for counter in ('assets', 'updated', 'unchanged', 'failed'):
+        summary[counter] = sum(r.get(counter, 0) for r in results)
+    logger.info(
+        f"Asset prices updated: {summary['assets']} assets ({summary['updated']} updated, "
+        f"{summary['unchanged']} unchanged, {summary['failed']} failed), {summary['shards']} shards "
+        f"({summary['failed_shards']} failed) in {summary['duration']:.2f}s, "
+        f"slowest shard {summary['slowest_shard']:.2f}s"
+    )
+    return summary
+
+@shared_task
+def top_up_asset_prices():
+    """
+    Stores the daily closes published since the last run.
+    Runs daily after the markets close (22:30 UTC, see CELERY_BEAT_SCHEDULE).
+    """
+    rows = top_up_prices()
+    logger.info(f"Asset price history topped up: {rows} rows.")
+    return rows
 
 @shared_task
 def snapshot_daily_portfolio():
     """
     Snapshots the value of all portfolios.
-    Runs daily at midnight.
+    Runs daily at midnight UTC (CELERY_BEAT_SCHEDULE). Work is split into portfolio id ranges run as a group.
+    Skipped while the previous snapshot run is still going.
     """
+    lease = Lease(SNAPSHOT_LEASE)
+    if not lease.acquire():
+        logger.info("Portfolio snapshots already running, skipped.")
+        return
     today = timezone.localdate()
-    logger.info(f"Taking portfolio snapshots for {today}")
-    
-    portfolios = Portfolio.objects.all()
-    
-    for portfolio in portfolios:
-        try:
-            total_value = 0
-            invested_value = 0
-            
-            # Recalculate totals from holdings
-            for holding in portfolio.holdings.all():
-                # We assume Asset price is fresh enough (updated every 15m)
-                total_value += holding.current_value
-                invested_value += holding.quantity * holding.average_buy_price
-            
-            # Create or update history for today
-            PortfolioHistory.objects.update_or_create(
-                portfolio=portfolio,
-                date=today,
-                defaults={
-                    'total_value': total_value,
-                    'invested_value': invested_value
-                }
-            )
-        except Exception as e:
-            logger.error(f"Error snapshotting portfolio {portfolio.name}: {e}")
-            
-    logger.info("Portfolio snapshots completed.")
+    bounds = Portfolio.objects.aggregate(lo=Min('pk'), hi=Max('pk'))
+    if bounds['lo'] is None:
+        logger.info("No portfolios to snapshot.")
+        _end_run(SNAPSHOT_LEASE, lease.token)
+        return
+
+    # Shards cover (min_id, max_id] so consecutive ranges never overlap
+    ranges = [
+        (lo - 1, min(lo - 1 + SNAPSHOT_SHARD_SIZE, bounds['hi']))
+        for lo in range(bounds['lo'], bounds['hi'] + 1, SNAPSHOT_SHARD_SIZE)
+    ]
+    logger.info(f"Taking portfolio snapshots for {today} in {len(ranges)} shards")
+    try:
+        chord(
+            snapshot_portfolio_shard.s(today.isoformat(), min_id, max_id, lease=lease.token)
+            for min_id, max_id in ranges
+        )(portfolio_snapshots_completed.s(today.isoformat(), time.time(), lease=lease.token))
+    except Exception:
+        _end_run(SNAPSHOT_LEASE, lease.token)
+        raise
+    lease.keep_alive(CHORD_MAX_AGE)
+
+@shared_task
+def snapshot_portfolio_shard(date, min_id, max_id, lease=None):
+    """
+    Snapshots the portfolios with min_id < pk <= max_id.
+    """
+    start = time.perf_counter()
+    shard = f"{min_id + 1}..{max_id}"
+    try:
+        # Set-based valuation + bulk upsert, see snapshots.snapshot_portfolios
+        with _heartbeat(SNAPSHOT_LEASE, lease):
+            stats = snapshot_portfolios(datetime.date.fromisoformat(date), min_id=min_id, max_id=max_id)
+        stats['shard'] = shard
+        if stats['failed_chunks']:
+            stats['error'] = f"{stats['failed_chunks']} chunks failed"
+        return stats
+    except Exception as e:
+        return {'shard': shard, 'rows': 0, 'duration': time.perf_counter() - start, 'error': str(e)}
+
+@shared_task
+def portfolio_snapshots_completed(results, date, started, lease=None):
+    """
+    Chord callback of snapshot_daily_portfolio.
+    """
+    # Roll the day's snapshots up into the per-user net worth series
+    try:
+        with _heartbeat(SNAPSHOT_LEASE, lease):
+            refresh_net_worth_history(dates=[datetime.date.fromisoformat(date)])
+    finally:
+        _end_run(SNAPSHOT_LEASE, lease)
+
+    summary = _summarize(results, started)
+    summary['rows'] = sum(r['rows'] for r in results)
+    summary['rows_per_second'] = summary['rows'] / summary['duration'] if summary['duration'] else 0
+    logger.info(
+        f"Portfolio snapshots completed: {summary['rows']} rows, {summary['shards']} shards "
+        f"({summary['failed_shards']} failed) in {summary['duration']:.2f}s "
+        f"({summary['rows_per_second']:.0f} rows/s), slowest shard {summary['slowest_shard']:.2f}s"
+    )
+    return summary
+
+@shared_task
+def warm_market_cache():
+    """
+    Refreshes the cached market overview and asset details before they go stale.
+    Runs every warming.WARM_INTERVAL seconds, and once when a worker boots.
+    Skipped while the previous run is still going, and when the cache is
+    local to the worker process: the web processes would never see it.
+    """
+    if is_process_local(caches['default']):
+        logger.error("Market cache warming skipped: the default cache is local to this process (see CACHE_URL).")
+        return
+    lease = Lease(WARMING_LEASE)
+    if not lease.acquire():
+        logger.info("Market cache already warming, skipped.")
+        return
+    try:
+        with lease.heartbeat():
+            stats = warming.warm_market_cache()
+    finally:
+        _end_run(WARMING_LEASE, lease.token)
+    logger.info(
+        f"Market cache warmed: {stats['refreshed']} refreshed, {stats['skipped']} still fresh, "
+        f"{stats['failed']} failed, coverage {stats['coverage']:.0%} of {stats['targets']} entries "
+        f"in {stats['duration']:.2f}s"
+    )
+    return stats
+
+@worker_ready.connect
+def warm_market_cache_on_boot(sender, **kwargs):
+    # The first requests after a deploy should not wait for the next beat
+    warm_market_cache.delay()
@@ -0,0 +1,287 @@
+"""
+Performance metrics of the Celery tasks, in the Prometheus text format.
+
+Each task run collects its metrics in process, through Celery's
+task_prerun/task_postrun signals: its duration, the item counters of its
+result (assets updated, rows written, ...), the upstream requests made by the
+market data providers (see upstream()) and the SQL writes it issued. When
+the run ends they are added in one round trip to a store shared by every
+worker (a Redis hash, or an in-process stand-in), which the /metrics view
+renders for Prometheus.
+
+The counters of the tiered cache (tiered_cache.py) live in each web process
+and are rendered along, labelled with the pid of the process serving the
+scrape.
+
+Runs are tracked per execution context (a ContextVar), so tasks running in
+separate threads or greenlets of one worker never count into each other's
+run; tasks run eagerly inside another are tracked as runs of their own.
+Thread pools working for a run pass it on to their threads with bind_run().
+"""
+import contextvars
+import os
+import re
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from celery.signals import task_postrun, task_prerun
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+import logging
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+METRICS_KEY = 'wealthgravity:metrics'
+# Upper bounds of the histogram buckets (seconds)
+TASK_DURATION_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+UPSTREAM_DURATION_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+# Counters of task results (the dicts returned by tasks.py) exported as items
+ITEM_COUNTERS = (
+    'assets', 'updated', 'unchanged', 'failed', 'rows', 'refreshed', 'skipped', 'failed_shards', 'failed_chunks',
+)
+
+# name: (type, help)
+METRICS = {
+    'wealthgravity_task_runs_total': ('counter', "Task runs by final state."),
+    'wealthgravity_task_duration_seconds': ('histogram', "Task run duration."),
+    'wealthgravity_task_items_total': ('counter', "Items counted in task results, by counter."),
+    'wealthgravity_task_db_writes_total': ('counter', "SQL write statements issued by tasks."),
+    'wealthgravity_task_db_rows_written_total': ('counter', "Rows affected by the SQL writes of tasks."),
+    'wealthgravity_upstream_requests_total': ('counter', "Market data requests made by tasks, by outcome."),
+    'wealthgravity_upstream_request_duration_seconds': ('histogram', "Market data request duration."),
+    'wealthgravity_cache_warming_coverage': ('gauge', "Share of the warmed cache entries fresh after the last run."),
+    'wealthgravity_cache_warming_duration_seconds': ('gauge', "Duration of the last cache warming run."),
+    'wealthgravity_cache_warming_finished_timestamp_seconds': ('gauge', "End of the last cache warming run."),
+    'wealthgravity_cache_requests_total': ('counter', "Cache lookups of the serving process, by tier and result."),
+    'wealthgravity_cache_invalidations_total': ('counter', "L1 entries dropped on writes of other processes."),
+    'wealthgravity_cache_l1_evictions_total': ('counter', "L1 entries evicted to stay within its bounds."),
+    'wealthgravity_cache_l1_entries': ('gauge', "Entries in the L1 of the serving process."),
+    'wealthgravity_cache_l1_bytes': ('gauge', "Pickled bytes in the L1 of the serving process."),
+}
+
+_LE = re.compile(r',?le="([^"]*)"')
+
+def _sample(name, labels):
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for v in labels.values())
+    pairs = ','.join(f'{k}="{v}"' for k, v in zip(labels, escaped))
+    return f'{name}{{{pairs}}}' if pairs else name
+
+class Run:
+    """
+    Metrics of one task run, as increments of samples
+    ('name{label="value",...}'). Safe to update from several threads.
+    """
+    def __init__(self, task):
+        self.task = task
+        self.started = time.perf_counter()
+        self.samples = defaultdict(float)
+        self._lock = threading.Lock()
+
+    def inc(self, name, labels, value=1):
+        with self._lock:
+            self.samples[_sample(name, {'task': self.task, **labels})] += value
+
+    def observe(self, name, labels, value, buckets):
+        labels = {'task': self.task, **labels}
+        with self._lock:
+            # Buckets are cumulative, as exposed, and all present from the first observation
+            for bound in buckets:
+                self.samples[_sample(f'{name}_bucket', {**labels, 'le': bound})] += value <= bound
+            self.samples[_sample(f'{name}_bucket', {**labels, 'le': '+Inf'})] += 1
+            self.samples[_sample(f'{name}_sum', labels)] += value
+            self.samples[_sample(f'{name}_count', labels)] += 1
+
+class InMemoryMetricsStore:
+    """
+    In-process store. Used by tests and single-process setups.
+    """
+    def __init__(self):
+        self._samples = defaultdict(float)
+        self._lock = threading.Lock()
+
+    def add(self, samples):
+        with self._lock:
+            for sample, value in samples.items():
+                self._samples[sample] += value
+
+    def read(self):
+        with self._lock:
+            return dict(self._samples)
+
+class RedisMetricsStore:
+    """
+    Samples as the fields of one Redis hash, shared by every worker.
+    """
+    def __init__(self, url):
+        import redis
+        self._client = redis.Redis.from_url(url)
+
+    def add(self, samples):
+        pipe = self._client.pipeline(transaction=False)
+        for sample, value in samples.items():
+            pipe.hincrbyfloat(METRICS_KEY, sample, value)
+        pipe.execute()
+
+    def read(self):
+        return {k.decode(): float(v) for k, v in self._client.hgetall(METRICS_KEY).items()}
+
+_store = None
+
+def get_metrics_store():
+    """
+    Process-wide store selected by settings.METRICS_URL
+    ('memory://' for the in-process stand-in, a redis:// URL otherwise).
+    """
+    global _store
+    if _store is None:
+        url = settings.METRICS_URL
+        if url.startswith('memory://'):
+            _store = InMemoryMetricsStore()
+        else:
+            _store = RedisMetricsStore(url)
+    return _store
+
+# Runs in progress in the current context, innermost last
+_runs = contextvars.ContextVar('wealthgravity_task_runs', default=())
+
+def current_run():
+    runs = _runs.get()
+    return runs[-1] if runs else None
+
+def bind_run(func):
+    """
+    `func` counting into the runs of the caller from whichever thread calls
+    it, for the worker threads of a pool (threads start in an empty context).
+    """
+    runs = _runs.get()
+    def call(*args, **kwargs):
+        token = _runs.set(runs)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _runs.reset(token)
+    return call
+
+@task_prerun.connect
+def _run_started(task_id, task, **kwargs):
+    _runs.set(_runs.get() + (Run(task.name),))
+
+@task_postrun.connect
+def _run_finished(task_id, task, retval=None, state=None, **kwargs):
+    runs = _runs.get()
+    if not runs:
+        return
+    run = runs[-1]
+    _runs.set(runs[:-1])
+    run.observe('wealthgravity_task_duration_seconds', {}, time.perf_counter() - run.started, TASK_DURATION_BUCKETS)
+    run.inc('wealthgravity_task_runs_total', {'state': state or 'UNKNOWN'})
+    if isinstance(retval, dict):
+        for counter in ITEM_COUNTERS:
+            if isinstance(retval.get(counter), (int, float)):
+                run.inc('wealthgravity_task_items_total', {'counter': counter}, retval[counter])
+    try:
+        get_metrics_store().add(run.samples)
+    except Exception as e:
+        # Metrics must never fail a task
+        logger.warning(f"Error storing metrics of {run.task}: {e}")
+
+@contextmanager
+def upstream(provider, method):
+    """
+    Counts and times one market data request made by the current task run
+    (a no-op outside of tasks). Requests that raise count as errors.
+    """
+    run = current_run()
+    if run is None:
+        yield
+        return
+    start = time.perf_counter()
+    outcome = 'error'
+    try:
+        yield
+        outcome = 'ok'
+    finally:
+        labels = {'provider': provider, 'method': method}
+        run.inc('wealthgravity_upstream_requests_total', {**labels, 'outcome': outcome})
+        run.observe(
+            'wealthgravity_upstream_request_duration_seconds', labels, time.perf_counter() - start,
+            UPSTREAM_DURATION_BUCKETS,
+        )
+
+_WRITES = ('insert', 'update', 'delete')
+
+def _count_writes(execute, sql, params, many, context):
+    run = current_run()
+    if run is None:
+        return execute(sql, params, many, context)
+    statement = sql.lstrip()[:6].lower()
+    result = execute(sql, params, many, context)
+    if statement in _WRITES:
+        run.inc('wealthgravity_task_db_writes_total', {'statement': statement})
+        rowcount = getattr(context['cursor'], 'rowcount', -1)
+        if rowcount and rowcount > 0:
+            run.inc('wealthgravity_task_db_rows_written_total', {}, rowcount)
+    return result
+
+@receiver(connection_created)
+def _watch_writes(sender, connection, **kwargs):
+    # execute_wrappers belong to the (thread-local) connection handler and survive reconnects
+    if _count_writes not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_count_writes)
+
+def _sort_key(pair):
+    # Series together, their buckets in increasing order of le
+    sample = pair[0]
+    match = _LE.search(sample)
+    if match is None:
+        return sample, 0.0
+    return _LE.sub('', sample, count=1), float(match.group(1))
+
+def _cache_samples():
+    # Tiered cache counters are per process: the pid label tells the
+    # processes a scrape may land on apart
+    from .tiered_cache import tier_stats
+    samples = {}
+    for name, stats in tier_stats().items():
+        labels = {'cache': name, 'pid': os.getpid()}
+        for tier in ('l1', 'l2'):
+            for result, counter in (('hit', 'hits'), ('miss', 'misses')):
+                sample = _sample('wealthgravity_cache_requests_total', {**labels, 'tier': tier, 'result': result})
+                samples[sample] = stats[f'{tier}_{counter}']
+        samples[_sample('wealthgravity_cache_invalidations_total', labels)] = stats['invalidations']
+        samples[_sample('wealthgravity_cache_l1_evictions_total', labels)] = stats['l1_evictions']
+        samples[_sample('wealthgravity_cache_l1_entries', labels)] = stats['l1_entries']
+        samples[_sample('wealthgravity_cache_l1_bytes', labels)] = stats['l1_bytes']
+    return samples
+
+def render():
+    """
+    Stored samples, plus the last cache warming run and the tiered cache
+    counters of this process, in the Prometheus text format.
+    """
+    from .warming import get_warming_stats
+    samples = get_metrics_store().read()
+    warming = get_warming_stats()
+    if warming:
+        samples['wealthgravity_cache_warming_coverage'] = warming['coverage']
+        samples['wealthgravity_cache_warming_duration_seconds'] = warming['duration']
+        samples['wealthgravity_cache_warming_finished_timestamp_seconds'] = warming['finished_at']
+    samples.update(_cache_samples())
+
+    families = defaultdict(list)
+    for sample, value in samples.items():
+        name = sample.split('{', 1)[0]
+        for suffix in ('_bucket', '_sum', '_count'):
+            if name.endswith(suffix) and name[:-len(suffix)] in METRICS:
+                name = name[:-len(suffix)]
+        families[name].append((sample, value))
+
+    lines = []
+    for name in sorted(families):
+        kind, help_text = METRICS.get(name, ('untyped', ''))
+        lines += [f'# HELP {name} {help_text}', f'# TYPE {name} {kind}']
+        lines += [f'{sample} {value!r}' for sample, value in sorted(families[name], key=_sort_key)]
+    return '\n'.join(lines) + '\n'
@@ -1,3 +1,715 @@
-from django.test import TestCase
+import asyncio
+import base64
+import datetime
+import threading
+import time
+from decimal import Decimal
+from unittest import mock
+from django.conf import settings
+from django.core.cache import caches
+from django.contrib.auth.models import User
+from django.db import DatabaseError
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from wealthgravity.celery import app as celery_app
+from . import exchanges, locks, search, tasks, telemetry
+from .cache import get_or_refresh, refresh
+from .locks import InMemoryLeaseStore, Lease
+from .history import rebuild_portfolio_history
+from .models import (
+    Asset, AssetCategory, AssetPrice, Holding, NetWorthHistory, Portfolio, PortfolioHistory, Transaction,
+)
+from .pagination import TRANSACTIONS_PAGE_SIZE, transactions_page
+from .prices import top_up_prices
+from .pubsub import InMemoryBroker
+from .scheduling import CHECKED_KEY, CHECKED_TIMEOUT, due_asset_ids, is_open, last_close, market_session
+from .search import FUZZY_THRESHOLD, TickerIndex, _trigrams, normalize_query
+from .services import _write_prices, import_assets
+from .stream import PriceStreamRouter
+from .tasks import PRICE_LEASE, _end_run
+from .telemetry import InMemoryMetricsStore
+from .tiered_cache import shared_backend, tier_stats
+from .valuation import get_user_valuation
 
-# Create your tests here.
+def encode_cursor_raw(raw):
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+class LeaseTests(SimpleTestCase):
+    def setUp(self):
+        patcher = mock.patch.object(locks, '_store', InMemoryLeaseStore())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_acquire_is_exclusive(self):
+        first, second = Lease('job'), Lease('job')
+        self.assertTrue(first.acquire())
+        self.assertFalse(second.acquire())
+        self.assertTrue(first.release())
+        self.assertTrue(second.acquire())
+
+    def test_only_the_holder_renews_and_releases(self):
+        holder = Lease('job')
+        holder.acquire()
+        intruder = Lease('job', token='not-the-token')
+        self.assertFalse(intruder.renew())
+        self.assertTrue(intruder.lost)
+        self.assertFalse(intruder.release())
+        self.assertTrue(Lease('job', token=holder.token).renew())
+
+    def test_lease_expires_without_renewal(self):
+        holder = Lease('job', ttl=0.05)
+        holder.acquire()
+        time.sleep(0.1)
+        self.assertTrue(Lease('job').acquire())
+        self.assertFalse(holder.renew())
+        self.assertFalse(holder.release())
+
+    def test_heartbeat_keeps_the_lease(self):
+        holder = Lease('job', ttl=0.15)
+        holder.acquire()
+        with holder.heartbeat():
+            time.sleep(0.3)
+            self.assertFalse(Lease('job').acquire())
+        self.assertFalse(holder.lost)
+
+    def test_keep_alive_until_released(self):
+        dispatcher = Lease('job', ttl=0.15)
+        dispatcher.acquire()
+        thread = dispatcher.keep_alive(max_age=5)
+        time.sleep(0.3)
+        self.assertFalse(Lease('job').acquire())
+        # The chord callback claims the run and ends it
+        self.assertTrue(Lease('job', token=dispatcher.token).release())
+        thread.join(1)
+        self.assertFalse(thread.is_alive())
+        self.assertTrue(Lease('job').acquire())
+
+    def test_keep_alive_gives_up_after_max_age(self):
+        dispatcher = Lease('job', ttl=0.1)
+        dispatcher.acquire()
+        dispatcher.keep_alive(max_age=0.2).join(1)
+        time.sleep(0.15)
+        self.assertTrue(Lease('job').acquire())
+
+    def test_rerun_requests_coalesce(self):
+        holder = Lease(PRICE_LEASE)
+        holder.acquire()
+        for _ in range(3):
+            blocked = Lease(PRICE_LEASE)
+            self.assertFalse(blocked.acquire())
+            blocked.request_rerun()
+        rerun = mock.Mock()
+        _end_run(PRICE_LEASE, holder.token, rerun=rerun)
+        rerun.delay.assert_called_once_with()
+        self.assertFalse(Lease(PRICE_LEASE).rerun_requested())
+        self.assertTrue(Lease(PRICE_LEASE).acquire())
+
+class TieredCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.name = self.id()
+        settings = override_settings(CACHES={
+            'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+            'tiered': {
+                'BACKEND': 'portfolio.tiered_cache.TieredCache',
+                'LOCATION': self.name,
+                'OPTIONS': {'L2': 'l2', 'L1_TIMEOUT': 60},
+            },
+            'l2': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': self.name},
+        })
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.cache = caches['tiered']
+        self.l2 = caches['l2']
+
+    def test_reads_are_served_from_l1(self):
+        self.cache.set('key', 1)
+        self.l2.set('key', 2)
+        self.assertEqual(self.cache.get('key'), 1)
+        self.assertEqual(self.cache.stats()['l1_hits'], 1)
+
+    def test_write_replaces_the_l1_copy(self):
+        self.cache.set('key', 1)
+        self.cache.get('key')
+        self.cache.set('key', 2)
+        self.assertEqual(self.cache.get('key'), 2)
+        self.cache.delete('key')
+        self.assertIsNone(self.cache.get('key'))
+        self.cache.add('key', 3)
+        self.assertEqual(self.cache.get('key'), 3)
+
+    def test_writes_are_broadcast(self):
+        self.cache.tier.invalidation = mock.Mock()
+        self.addCleanup(setattr, self.cache.tier, 'invalidation', None)
+        self.cache.set('key', 1)
+        self.cache.delete_many(['key', 'other'])
+        self.assertEqual(self.cache.tier.invalidation.publish.call_args_list, [
+            mock.call([self.cache.make_key('key')]),
+            mock.call([self.cache.make_key('key'), self.cache.make_key('other')]),
+        ])
+
+    def test_invalidation_from_another_process_drops_the_l1_copy(self):
+        self.cache.set('key', 1)
+        # Written by another process, announced on the invalidation channel
+        self.l2.set('key', 2)
+        self.cache.tier.invalidated([self.cache.make_key('key')])
+        self.assertEqual(self.cache.get('key'), 2)
+        self.assertEqual(self.cache.stats()['invalidations'], 1)
+
+    def test_resubscribe_clears_l1(self):
+        self.cache.set('key', 1)
+        self.l2.set('key', 2)
+        self.cache.tier.invalidated(None)
+        self.assertEqual(self.cache.get('key'), 2)
+
+    def test_threads_share_one_l1(self):
+        self.cache.set('key', 1)
+        seen = []
+        thread = threading.Thread(target=lambda: seen.append((caches['tiered'] is self.cache, caches['tiered'].get('key'))))
+        thread.start()
+        thread.join()
+        self.assertEqual(seen, [(False, 1)])
+        self.assertEqual(tier_stats()[self.name]['l1_hits'], 1)
+
+class InMemoryBrokerTests(SimpleTestCase):
+    async def test_messages_fan_out_to_every_subscription(self):
+        broker = InMemoryBroker()
+        async with broker.subscribe() as first, broker.subscribe() as second:
+            self.assertEqual(broker.subscriber_count(), 2)
+            # Published from a worker thread, like the price updater does
+            await asyncio.to_thread(broker.publish, {'prices': {'AAPL': 1.0}})
+            self.assertEqual(await first.get(timeout=1), {'prices': {'AAPL': 1.0}})
+            self.assertEqual(await second.get(timeout=1), {'prices': {'AAPL': 1.0}})
+            self.assertIsNone(await first.get(timeout=0.01))
+        self.assertEqual(broker.subscriber_count(), 0)
+
+    async def test_slow_subscriber_keeps_the_latest_messages(self):
+        broker = InMemoryBroker()
+        async with broker.subscribe() as subscription:
+            for i in range(subscription.queue.maxsize + 5):
+                broker.publish({'prices': {'AAPL': i}})
+            await asyncio.sleep(0)
+            received = []
+            while (message := await subscription.get(timeout=0.01)) is not None:
+                received.append(message['prices']['AAPL'])
+        self.assertEqual(received, list(range(5, subscription.queue.maxsize + 5)))
+
+    async def test_messages_before_subscribing_are_not_received(self):
+        broker = InMemoryBroker()
+        broker.publish({'prices': {'AAPL': 1.0}})
+        async with broker.subscribe() as subscription:
+            self.assertIsNone(await subscription.get(timeout=0.01))
+
+class PriceStreamRouterTests(SimpleTestCase):
+    async def call(self, path, headers=()):
+        app = mock.AsyncMock()
+        sent = []
+        async def receive():
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+        async def send(message):
+            sent.append(message)
+        scope = {'type': 'http', 'method': 'GET', 'path': path, 'headers': list(headers)}
+        await PriceStreamRouter(app)(scope, receive, send)
+        return app, sent
+
+    async def test_other_paths_go_to_django(self):
+        app, sent = await self.call(reverse('portfolio:dashboard'))
+        app.assert_awaited_once()
+        self.assertEqual(sent, [])
+
+    async def test_stream_requires_a_session(self):
+        app, sent = await self.call(reverse('portfolio:price_stream'), [(b'cookie', b'csrftoken=x')])
+        app.assert_not_awaited()
+        self.assertEqual(sent[0]['status'], 401)
+
+class ValuationCacheTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='valuation')
+        self.asset = Asset.objects.create(ticker='VAL', name='Val', category=AssetCategory.STOCKS, current_price=10)
+        portfolio = Portfolio.objects.create(user=self.user, name='Main')
+        self.holding = Holding.objects.create(portfolio=portfolio, asset=self.asset, quantity=2, average_buy_price=5)
+
+    def test_price_written_by_another_process(self):
+        self.assertEqual(get_user_valuation(self.user.pk)['total_net_worth'], 20)
+        # A worker writing prices leaves this process' cache untouched
+        Asset.objects.filter(pk=self.asset.pk).update(current_price=15, last_updated=timezone.now())
+        valuation = get_user_valuation(self.user.pk)
+        self.assertEqual(valuation['total_net_worth'], 30)
+        self.assertEqual(valuation['pnl'], 20)
+
+    def test_holding_change(self):
+        get_user_valuation(self.user.pk)
+        self.holding.quantity = 3
+        self.holding.save()
+        self.assertEqual(get_user_valuation(self.user.pk)['total_net_worth'], 30)
+
+    def test_figures_are_decimal_with_weights(self):
+        other = Asset.objects.create(ticker='OTH', name='Other', category=AssetCategory.CRYPTO, current_price=30)
+        Holding.objects.create(portfolio=self.holding.portfolio, asset=other, quantity=1, average_buy_price=40)
+        valuation = get_user_valuation(self.user.pk)
+        crypto = valuation['holdings_by_category'][AssetCategory.CRYPTO][0]
+        self.assertEqual(crypto['current_value'], Decimal('30.00'))
+        self.assertEqual(crypto['pnl_percent'], Decimal('-25.00'))
+        self.assertEqual(crypto['weight'], Decimal('60.00'))
+        self.assertEqual(valuation['categories'][AssetCategory.STOCKS]['weight'], Decimal('40.00'))
+        self.assertEqual(valuation['allocation_data'], [60.0, 40.0])
+
+    def test_holding_figures_follow_field_changes(self):
+        self.assertEqual(self.holding.current_value, 20)
+        self.holding.quantity += 1
+        self.holding.average_buy_price = 6
+        self.assertEqual(self.holding.current_value, 30)
+        self.assertEqual(self.holding.pnl, 12)
+
+    def test_cached_between_changes(self):
+        get_user_valuation(self.user.pk)
+        with mock.patch('portfolio.valuation.compute_user_valuation') as compute:
+            get_user_valuation(self.user.pk)
+        compute.assert_not_called()
+
+class WarmMarketCacheTaskTests(SimpleTestCase):
+    @override_settings(CACHES={
+        'default': {'BACKEND': 'portfolio.tiered_cache.TieredCache', 'LOCATION': 'warming-local', 'OPTIONS': {'L2': 'l2'}},
+        'l2': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+    })
+    def test_skipped_on_a_process_local_cache(self):
+        with mock.patch('portfolio.warming.warm_market_cache') as warm, self.assertLogs('portfolio.tasks', 'ERROR'):
+            self.assertIsNone(tasks.warm_market_cache())
+        warm.assert_not_called()
+
+    @override_settings(CACHES={
+        'default': {'BACKEND': 'portfolio.tiered_cache.TieredCache', 'LOCATION': 'warming-shared', 'OPTIONS': {'L2': 'l2'}},
+        'l2': {'BACKEND': 'django.core.cache.backends.db.DatabaseCache', 'LOCATION': 'django_cache'},
+    })
+    def test_runs_on_a_shared_cache(self):
+        stats = {'refreshed': 1, 'skipped': 0, 'failed': 0, 'coverage': 1, 'targets': 1, 'duration': 0}
+        with mock.patch.object(locks, '_store', InMemoryLeaseStore()), \
+                mock.patch('portfolio.warming.warm_market_cache', return_value=stats) as warm:
+            self.assertEqual(tasks.warm_market_cache(), stats)
+        warm.assert_called_once_with()
+
+class WritePricesTests(TestCase):
+    def setUp(self):
+        self.assets = [
+            Asset.objects.create(ticker=ticker, name=ticker, category=AssetCategory.STOCKS, current_price=10)
+            for ticker in ('UP', 'SAME', 'MISSING')
+        ]
+        patcher = mock.patch('portfolio.services.publish_prices')
+        self.publish = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def write(self):
+        stats = {'updated': 0, 'unchanged': 0, 'failed': 0}
+        _write_prices(self.assets, {'UP': 12.5, 'SAME': 10.0}, stats)
+        return stats
+
+    def test_updated_and_unchanged(self):
+        self.assertEqual(self.write(), {'updated': 1, 'unchanged': 1, 'failed': 1})
+        self.assertEqual(Asset.objects.get(ticker='UP').current_price, Decimal('12.5'))
+        self.assertEqual(self.assets[0].current_price, Decimal('12.5'))
+        self.assertEqual(Asset.objects.get(ticker='SAME').last_updated, self.assets[1].last_updated)
+        self.publish.assert_called_once_with({'UP': 12.5})
+
+    def test_bulk_update_fallback(self):
+        with mock.patch('portfolio.services._supports_update_from', return_value=False):
+            self.assertEqual(self.write()['updated'], 1)
+        self.assertEqual(Asset.objects.get(ticker='UP').current_price, Decimal('12.5'))
+
+    def test_failed_write_leaves_the_assets_untouched(self):
+        updated = self.assets[0].last_updated
+        with mock.patch('portfolio.services._set_prices', side_effect=DatabaseError('down')), \
+                self.assertLogs('portfolio.services', 'ERROR'):
+            self.assertEqual(self.write(), {'updated': 0, 'unchanged': 1, 'failed': 2})
+        self.assertEqual(self.assets[0].current_price, 10)
+        self.assertEqual(self.assets[0].last_updated, updated)
+        self.assertEqual(Asset.objects.get(ticker='UP').current_price, 10)
+        self.publish.assert_not_called()
+
+class TopUpPricesTests(TestCase):
+    def test_pairs_go_to_the_crypto_provider(self):
+        Asset.objects.create(ticker='AAPL', name='Apple', category=AssetCategory.STOCKS)
+        Asset.objects.create(ticker='BTC/USDT', name='Bitcoin', category=AssetCategory.CRYPTO)
+        providers = {'default': mock.Mock(), 'crypto': mock.Mock()}
+        for provider in providers.values():
+            provider.history.return_value = None
+        with mock.patch('portfolio.prices.get_provider', side_effect=providers.__getitem__):
+            self.assertEqual(top_up_prices(days=10), 0)
+        start = timezone.localdate() - datetime.timedelta(days=10)
+        providers['default'].history.assert_called_once_with(['AAPL'], start=start)
+        providers['crypto'].history.assert_called_once_with(['BTC/USDT'], start=start)
+
+class TransactionsPaginationTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='pages')
+        self.client.force_login(self.user)
+
+    def create(self, count, date=datetime.date(2026, 1, 1), created_at=None):
+        created = Transaction.objects.bulk_create([
+            Transaction(user=self.user, amount=1, category='Test', date=date) for _ in range(count)
+        ])
+        if created_at:
+            Transaction.objects.filter(pk__in=[t.pk for t in created]).update(created_at=created_at)
+        return created
+
+    def test_ties_on_date_and_created_at(self):
+        instant = timezone.now()
+        self.create(3, created_at=instant)
+        self.create(2, date=datetime.date(2025, 12, 31), created_at=instant)
+        seen, cursor = [], None
+        while True:
+            rows, cursor = transactions_page(Transaction.objects.filter(user=self.user), cursor, size=2)
+            seen += [t.pk for t in rows]
+            if cursor is None:
+                break
+        expected = Transaction.objects.filter(user=self.user).order_by('-date', '-created_at', '-id')
+        self.assertEqual(seen, [t.pk for t in expected])
+
+    def test_invalid_cursor_is_a_bad_request(self):
+        for cursor in ('garbage', 'not base64!', encode_cursor_raw('2026-01-01|now|1'),
+                       encode_cursor_raw(f'2026-01-01|2026-01-01T00:00:00+00:00|{2 ** 64}')):
+            with self.subTest(cursor=cursor):
+                response = self.client.get(reverse('portfolio:transactions'), {'cursor': cursor})
+                self.assertEqual(response.status_code, 400)
+
+    def test_last_page_stops_loading(self):
+        self.create(TRANSACTIONS_PAGE_SIZE + 1)
+        response = self.client.get(reverse('portfolio:transactions'))
+        self.assertContains(response, 'hx-trigger="revealed"')
+        cursor = response.context['next_cursor']
+        response = self.client.get(reverse('portfolio:transactions'), {'cursor': cursor}, HTTP_HX_REQUEST='true')
+        self.assertEqual(len(response.context['transactions']), 1)
+        self.assertIsNone(response.context['next_cursor'])
+        self.assertNotContains(response, 'hx-trigger="revealed"')
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'refresh'}})
+class GetOrRefreshTests(SimpleTestCase):
+    def setUp(self):
+        caches['default'].clear()
+
+    def test_concurrent_cold_misses_fetch_once(self):
+        calls = []
+        def fetch():
+            calls.append(1)
+            time.sleep(0.1)
+            return 'value'
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(get_or_refresh('key', fetch, 60, 600)))
+            for _ in range(5)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, ['value'] * 5)
+        self.assertEqual(len(calls), 1)
+
+    def test_stale_hit_is_served_while_one_refresh_runs(self):
+        get_or_refresh('key', lambda: 'old', -1, 600)
+        fetch = mock.Mock(return_value='new')
+        with mock.patch('portfolio.cache._refresh_in_background') as background:
+            self.assertEqual(get_or_refresh('key', fetch, 60, 600), 'old')
+            self.assertEqual(get_or_refresh('key', fetch, 60, 600), 'old')
+        background.assert_called_once_with('key', fetch, 60, 600)
+        fetch.assert_not_called()
+
+    def test_failed_refresh_backs_off(self):
+        get_or_refresh('key', lambda: 'old', -1, 600)
+        with mock.patch('portfolio.cache.REFRESH_BACKOFF', 0.1):
+            with self.assertRaises(RuntimeError):
+                refresh('key', mock.Mock(side_effect=RuntimeError('down')), 60, 600)
+            fetch = mock.Mock(return_value='new')
+            self.assertFalse(refresh('key', fetch, 60, 600))
+            fetch.assert_not_called()
+            time.sleep(0.15)
+            self.assertTrue(refresh('key', fetch, 60, 600))
+        self.assertEqual(get_or_refresh('key', fetch, 60, 600), 'new')
+
+class TelemetryTests(SimpleTestCase):
+    def test_runs_are_tracked_per_context(self):
+        task = mock.Mock()
+        task.name = 'job'
+        seen = {}
+        store = InMemoryMetricsStore()
+        with mock.patch('portfolio.telemetry.get_metrics_store', return_value=store):
+            telemetry._run_started('id', task)
+            run = telemetry.current_run()
+            other = threading.Thread(target=lambda: seen.update(other=telemetry.current_run()))
+            bound = threading.Thread(target=telemetry.bind_run(lambda: seen.update(bound=telemetry.current_run())))
+            for thread in (other, bound):
+                thread.start()
+                thread.join()
+            telemetry._run_finished('id', task, retval={'updated': 2}, state='SUCCESS')
+        self.assertEqual(seen, {'other': None, 'bound': run})
+        self.assertIsNone(telemetry.current_run())
+        self.assertEqual(store.read()['wealthgravity_task_items_total{task="job",counter="updated"}'], 2)
+
+    def test_render(self):
+        run = telemetry.Run('update "prices"\\now')
+        run.observe('wealthgravity_task_duration_seconds', {}, 0.3, (0.1, 0.5, 1))
+        run.observe('wealthgravity_task_duration_seconds', {}, 0.05, (0.1, 0.5, 1))
+        store = InMemoryMetricsStore()
+        store.add(run.samples)
+        with mock.patch('portfolio.telemetry.get_metrics_store', return_value=store), \
+                mock.patch('portfolio.warming.get_warming_stats', return_value=None), \
+                mock.patch('portfolio.telemetry._cache_samples', return_value={}):
+            lines = telemetry.render().splitlines()
+        labels = 'task="update \\"prices\\"\\\\now"'
+        self.assertEqual(lines, [
+            '# HELP wealthgravity_task_duration_seconds Task run duration.',
+            '# TYPE wealthgravity_task_duration_seconds histogram',
+            f'wealthgravity_task_duration_seconds_bucket{{{labels},le="0.1"}} 1.0',
+            f'wealthgravity_task_duration_seconds_bucket{{{labels},le="0.5"}} 2.0',
+            f'wealthgravity_task_duration_seconds_bucket{{{labels},le="1"}} 2.0',
+            f'wealthgravity_task_duration_seconds_bucket{{{labels},le="+Inf"}} 2.0',
+            f'wealthgravity_task_duration_seconds_count{{{labels}}} 2.0',
+            f'wealthgravity_task_duration_seconds_sum{{{labels}}} 0.35',
+        ])
+
+class DashboardTableETagTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='etag')
+        self.client.force_login(self.user)
+        self.asset = Asset.objects.create(ticker='TAG', name='Tag', category=AssetCategory.STOCKS, current_price=10)
+        portfolio = Portfolio.objects.create(user=self.user, name='Main')
+        self.holding = Holding.objects.create(portfolio=portfolio, asset=self.asset, quantity=1, average_buy_price=5)
+        self.url = reverse('portfolio:dashboard_table')
+
+    def etag(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        return response['ETag']
+
+    def test_matching_etag_is_not_modified(self):
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=self.etag())
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+
+    def test_price_change_changes_the_etag(self):
+        etag = self.etag()
+        Asset.objects.filter(pk=self.asset.pk).update(current_price=11, last_updated=timezone.now())
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+        self.assertNotEqual(self.etag(), etag)
+
+    def test_holdings_change_changes_the_etag(self):
+        etag = self.etag()
+        self.holding.quantity = 2
+        self.holding.save()
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+        self.assertNotEqual(self.etag(), etag)
+
+class LoadMarketsTests(SimpleTestCase):
+    def setUp(self):
+        patcher = mock.patch.dict(exchanges._markets_loaded_at, clear=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def exchange(self, name, loading=None):
+        exchange = mock.Mock(id=name, markets={'BTC/USDT': {}})
+        if loading is not None:
+            exchange.load_markets.side_effect = lambda reload: loading.wait(1)
+        return exchange
+
+    def test_slow_exchange_does_not_block_the_others(self):
+        loading = threading.Event()
+        slow, fast = self.exchange('slow', loading), self.exchange('fast')
+        callers = [threading.Thread(target=exchanges.load_markets, args=(slow,)) for _ in range(3)]
+        for thread in callers:
+            thread.start()
+        while not slow.load_markets.called:
+            time.sleep(0.01)
+        self.assertEqual(exchanges.load_markets(fast), {'BTC/USDT': {}})
+        self.assertFalse(loading.is_set())
+        loading.set()
+        for thread in callers:
+            thread.join()
+        slow.load_markets.assert_called_once_with(reload=False)
+        fast.load_markets.assert_called_once_with(reload=False)
+
+class RebuildPortfolioHistoryTests(TestCase):
+    def test_matches_hand_computed_values(self):
+        user = User.objects.create_user(username='history')
+        asset = Asset.objects.create(ticker='HIST', name='Hist', category=AssetCategory.STOCKS, current_price=120)
+        portfolio = Portfolio.objects.create(user=user, name='Main')
+        # Today: 3 shares for 330 in total
+        Holding.objects.create(portfolio=portfolio, asset=asset, quantity=3, average_buy_price=110)
+        day0 = datetime.date(2026, 1, 5)
+        day1, day2 = day0 + datetime.timedelta(days=1), day0 + datetime.timedelta(days=2)
+        AssetPrice.objects.create(asset=asset, date=day0, close=100)
+        AssetPrice.objects.create(asset=asset, date=day2, close=110)
+        buy = {'user': user, 'amount': 0, 'category': 'Investment'}
+        Transaction.objects.create(**buy, date=day1, description='Achat', asset=asset, quantity=1, unit_price=120)
+        Transaction.objects.create(**buy, date=day2, description='Achat HIST (1 @ 100)')
+        unreadable = Transaction.objects.create(**buy, date=day2, description='Achat de HIST')
+
+        with self.assertLogs('portfolio.history', 'WARNING') as logs:
+            rebuild_portfolio_history(day0, day2)
+        self.assertIn(f'ids {unreadable.pk}', logs.output[0])
+        history = PortfolioHistory.objects.filter(portfolio=portfolio).order_by('date')
+        self.assertEqual(
+            [(row.date, row.total_value, row.invested_value) for row in history],
+            [
+                # 1 share held (the other two are bought later), at 100
+                (day0, Decimal('100.00'), Decimal('110.00')),
+                # 2 shares, no close stored this day: the previous one carries over
+                (day1, Decimal('200.00'), Decimal('230.00')),
+                (day2, Decimal('330.00'), Decimal('330.00')),
+            ],
+        )
+        self.assertEqual(NetWorthHistory.objects.get(user=user, date=day1).total_value, Decimal('200.00'))
+
+def ticker(symbol, name):
+    return {'ticker': symbol, 'name': name, 'category': AssetCategory.STOCKS}
+
+class TickerIndexTests(SimpleTestCase):
+    def setUp(self):
+        self.index = TickerIndex([
+            ticker('AAPL', 'Apple Inc.'), ticker('AAP', 'Advance Auto Parts'), ticker('APA', 'APA Corp'),
+            ticker('MSFT', 'Microsoft'), ticker('AB', 'AllianceBernstein'), ticker('AQN', 'Algonquin Power'),
+        ])
+
+    def similarity(self, query, entry):
+        query_grams = _trigrams(query)
+        entry_grams = _trigrams(normalize_query(entry['ticker'])) | _trigrams(normalize_query(entry['name']))
+        return 2 * len(query_grams & entry_grams) / (len(query_grams) + len(entry_grams))
+
+    def test_prefix_matches_are_ranked_by_kind(self):
+        scored = self.index.scored('aap')
+        self.assertEqual([entry['ticker'] for _, entry in scored], ['AAP', 'AAPL'])
+        # Exact ticker, then ticker prefix, each plus its trigram similarity
+        self.assertAlmostEqual(scored[0][0], 3 + self.similarity('aap', scored[0][1]))
+        self.assertAlmostEqual(scored[1][0], 2 + self.similarity('aap', scored[1][1]))
+
+    def test_prefix_scan_stops_past_the_prefix(self):
+        tickers = {entry['ticker'] for _, entry in self.index.scored('ap')}
+        # 'apa' ticker and the 'apa'/'apple' name words, not AB or AQN next to them
+        self.assertEqual(tickers, {'AAPL', 'APA'})
+        self.assertEqual(dict((e['ticker'], s) for s, e in self.index.scored('apple'))['AAPL'],
+                         1 + self.similarity('apple', self.index.entries[0]))
+
+    def test_fuzzy_match_needs_the_threshold(self):
+        scored = self.index.scored('microsfot')
+        self.assertEqual([entry['ticker'] for _, entry in scored], ['MSFT'])
+        self.assertAlmostEqual(scored[0][0], self.similarity('microsfot', scored[0][1]))
+        self.assertGreaterEqual(scored[0][0], FUZZY_THRESHOLD)
+        self.assertEqual(self.index.scored('zzzz'), [])
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'learn'}})
+class LearnTests(SimpleTestCase):
+    def setUp(self):
+        caches['default'].clear()
+        for name, value in (('_index', TickerIndex()), ('_learned', TickerIndex())):
+            patcher = mock.patch.object(search, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_concurrent_learns_keep_every_ticker(self):
+        shared = caches['default']
+        def slow_get(key, default=None):
+            value = shared.get(key, default)
+            time.sleep(0.02)
+            return value
+        # One cache object for every thread (the proxy is per thread), with a slow read
+        slow = mock.Mock(wraps=shared, get=slow_get)
+        with mock.patch('portfolio.search.cache', slow):
+            threads = [
+                threading.Thread(target=search.learn, args=([ticker(f'T{i}', f'Ticker {i}')],)) for i in range(5)
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(set(shared.get(search.LEARNED_KEY)), {f'T{i}' for i in range(5)})
+        self.assertIsNone(shared.get(search.LEARNED_LOCK_KEY))
+
+class MarketSessionTests(SimpleTestCase):
+    def test_sessions_by_ticker_suffix(self):
+        cases = {
+            ('MC.PA', AssetCategory.STOCKS): 'Europe/Paris',
+            ('SAP.DE', AssetCategory.STOCKS): 'Europe/Berlin',
+            ('7203.T', AssetCategory.STOCKS): 'Asia/Tokyo',
+            ('EURUSD=X', AssetCategory.STOCKS): 'UTC',
+            ('AAPL', AssetCategory.STOCKS): 'America/New_York',
+            ('^GSPC', AssetCategory.STOCKS): 'America/New_York',
+            ('BTC-USD', AssetCategory.CRYPTO): None,
+            ('BTC/USDT', AssetCategory.STOCKS): None,
+            ('XYZ.QQ', AssetCategory.STOCKS): None,
+        }
+        for (ticker, category), zone in cases.items():
+            with self.subTest(ticker=ticker):
+                session = market_session(ticker, category)
+                self.assertEqual(session[0] if session else None, zone)
+
+    def test_open_and_last_close(self):
+        # Monday 10:00 in Paris, 04:00 in New York
+        now = datetime.datetime(2026, 1, 5, 9, tzinfo=datetime.timezone.utc)
+        paris, new_york = market_session('MC.PA', AssetCategory.STOCKS), market_session('AAPL', AssetCategory.STOCKS)
+        self.assertTrue(is_open(paris, now))
+        self.assertFalse(is_open(new_york, now))
+        # Friday's close, over the weekend
+        self.assertEqual(
+            last_close(new_york, now), datetime.datetime(2026, 1, 2, 21, tzinfo=datetime.timezone.utc),
+        )
+
+class DueAssetIdsTests(TestCase):
+    def test_schedule_is_kept_in_the_shared_tier_with_a_timeout(self):
+        asset = Asset.objects.create(ticker='BTC/USDT', name='Bitcoin', category=AssetCategory.CRYPTO)
+        now = timezone.now()
+        store = mock.Mock()
+        store.get.return_value = None
+        with mock.patch('portfolio.scheduling.shared_backend', return_value=store):
+            self.assertEqual(due_asset_ids(now), [asset.pk])
+        store.set.assert_called_once_with(CHECKED_KEY, {asset.pk: now.timestamp()}, CHECKED_TIMEOUT)
+
+    def test_checked_assets_wait_for_their_interval(self):
+        asset = Asset.objects.create(ticker='BTC/USDT', name='Bitcoin', category=AssetCategory.CRYPTO)
+        self.addCleanup(shared_backend(caches['default']).delete, CHECKED_KEY)
+        now = timezone.now()
+        self.assertEqual(due_asset_ids(now), [asset.pk])
+        self.assertEqual(due_asset_ids(now + datetime.timedelta(minutes=5)), [])
+        self.assertEqual(due_asset_ids(now + datetime.timedelta(hours=1, seconds=1)), [asset.pk])
+
+class ImportAssetsTests(TestCase):
+    def setUp(self):
+        self.existing = Asset.objects.create(ticker='MSFT', name='Old name', category=AssetCategory.STOCKS, current_price=1)
+        stocks, crypto = mock.Mock(), mock.Mock()
+        stocks.quotes.return_value = {'AAPL': 180.5, 'MSFT': 400.25}
+        def details(ticker):
+            if ticker == 'AAPL':
+                raise ConnectionError('timeout')
+            return {'shortName': f'{ticker} Inc.'}
+        stocks.details.side_effect = details
+        crypto.quotes.return_value = {'BTC/USDT': 65000.0}
+        crypto.details.return_value = {'shortName': 'BTC/USDT'}
+        self.providers = {'default': stocks, 'crypto': crypto}
+        patcher = mock.patch('portfolio.services.get_provider', side_effect=lambda name='default': self.providers[name])
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_new_and_existing_tickers(self):
+        report = import_assets(['AAPL', ' MSFT ', 'BTC/USDT', 'NOPE', 'AAPL', ''])
+        self.assertEqual(sorted(report['created']), ['AAPL', 'BTC/USDT'])
+        self.assertEqual(report['updated'], ['MSFT'])
+        self.assertEqual(report['failed'], ['NOPE'])
+        self.assertEqual([a.ticker for a in report['assets']], ['AAPL', 'BTC/USDT', 'MSFT'])
+        self.providers['default'].quotes.assert_called_once_with(['AAPL', 'MSFT', 'NOPE'])
+        self.providers['crypto'].quotes.assert_called_once_with(['BTC/USDT'])
+        self.providers['crypto'].details.assert_called_once_with('BTC/USDT')
+
+        assets = {a.ticker: a for a in Asset.objects.all()}
+        self.assertEqual(assets['MSFT'].pk, self.existing.pk)
+        self.assertEqual((assets['MSFT'].name, assets['MSFT'].current_price), ('MSFT Inc.', Decimal('400.25')))
+        # A failed details lookup keeps the ticker as the name
+        self.assertEqual(assets['AAPL'].name, 'AAPL')
+        self.assertEqual(assets['BTC/USDT'].category, AssetCategory.CRYPTO)
+        self.assertEqual(assets['AAPL'].category, AssetCategory.STOCKS)
+        self.assertNotIn('NOPE', assets)
+
+class BeatScheduleTests(SimpleTestCase):
+    def test_entries_name_registered_tasks(self):
+        registered = set(celery_app.tasks)
+        for name, entry in settings.CELERY_BEAT_SCHEDULE.items():
+            with self.subTest(entry=name):
+                self.assertIn(entry['task'], registered)
+        scheduled = {entry['task'] for entry in settings.CELERY_BEAT_SCHEDULE.values()}
+        self.assertLessEqual({'portfolio.tasks.top_up_asset_prices', 'portfolio.tasks.snapshot_daily_portfolio'}, scheduled)
@@ -0,0 +1,382 @@
+"""
+Two-tier cache backend: a bounded in-process LRU (L1) in front of a shared
+cache (L2, Redis in production).
+
+Reads are served from L1 when possible and fall through to L2, whose hits are
+copied into L1 for at most L1_TIMEOUT seconds. Writes go to L2 first, and the
+written keys are then broadcast on a Redis channel so that every other
+process drops its L1 copy. Atomic operations (add, incr) always run on L2, so
+the refresh locks of cache.get_or_refresh stay correct across processes.
+
+Configured in settings.CACHES:
+
+    'default': {
+        'BACKEND': 'portfolio.tiered_cache.TieredCache',
+        'OPTIONS': {'L2': 'shared', 'INVALIDATION_URL': 'redis://...'},
+    },
+    'shared': {'BACKEND': 'django.core.cache.backends.redis.RedisCache', ...},
+"""
+import json
+import os
+import pickle
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+import logging
+
+logger = logging.getLogger(__name__)
+
+_MISSING = object()
+# Seconds to wait before resubscribing after the invalidation channel dropped
+RESUBSCRIBE_DELAY = 1
+
+class LRUStore:
+    """
+    Thread-safe LRU of pickled values, bounded by entry count and total
+    pickled size. Entries carry their own expiry.
+    """
+    def __init__(self, max_entries, max_bytes):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.evictions = 0
+        self._data = OrderedDict()  # key -> (expires_at, pickled)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return _MISSING
+            if entry[0] <= time.monotonic():
+                self._pop(key)
+                return _MISSING
+            self._data.move_to_end(key)
+        return pickle.loads(entry[1])
+
+    def set(self, key, value, timeout):
+        pickled = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        if len(pickled) > self.max_bytes:
+            # Never worth flushing the whole tier for one value
+            self.delete(key)
+            return
+        with self._lock:
+            self._pop(key)
+            self._data[key] = (time.monotonic() + timeout, pickled)
+            self.size += len(pickled)
+            while len(self._data) > self.max_entries or self.size > self.max_bytes:
+                self._pop(next(iter(self._data)))
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._pop(key)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.size = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def _pop(self, key):
+        entry = self._data.pop(key, None)
+        if entry is not None:
+            self.size -= len(entry[1])
+
+class RedisInvalidation:
+    """
+    Broadcasts written keys on a Redis channel and evicts the keys other
+    processes wrote from the local L1.
+    """
+    def __init__(self, url, channel, on_message):
+        self.url = url
+        self.channel = channel
+        self.on_message = on_message
+        self.origin = uuid.uuid4().hex
+        self._client = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def publish(self, keys):
+        self.ensure_listening()
+        try:
+            self._client.publish(self.channel, json.dumps({'origin': self.origin, 'keys': keys}))
+        except Exception as e:
+            logger.error(f"Error broadcasting cache invalidation: {e}")
+
+    def ensure_listening(self):
+        # Threads do not survive a fork: restart the listener in each worker
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            import redis
+            self._client = redis.Redis.from_url(self.url)
+            self.origin = uuid.uuid4().hex
+            self._pid = os.getpid()
+            threading.Thread(target=self._listen, name='cache invalidation', daemon=True).start()
+
+    def _listen(self):
+        while True:
+            try:
+                pubsub = self._client.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self.channel)
+                # Anything broadcast while we were not subscribed is lost
+                self.on_message(None)
+                for raw in pubsub.listen():
+                    message = json.loads(raw['data'])
+                    if message['origin'] != self.origin:
+                        self.on_message(message['keys'])
+            except Exception as e:
+                logger.error(f"Cache invalidation channel lost: {e}")
+                time.sleep(RESUBSCRIBE_DELAY)
+
+class _Tier:
+    """
+    Process-wide state of a TieredCache: its L1, counters and invalidation
+    listener. Django builds one backend instance per thread (or async task),
+    which all share it, so a process has one L1, one bound and one listener.
+    """
+    def __init__(self, options):
+        self.l1 = LRUStore(
+            max_entries=int(options.get('L1_MAX_ENTRIES', 10000)),
+            max_bytes=int(options.get('L1_MAX_BYTES', 32 * 1024 * 1024)),
+        )
+        self.metrics = {'l1_hits': 0, 'l1_misses': 0, 'l2_hits': 0, 'l2_misses': 0, 'invalidations': 0}
+        self._lock = threading.Lock()
+        url = options.get('INVALIDATION_URL')
+        self.invalidation = None
+        if url:
+            self.invalidation = RedisInvalidation(url, options.get('INVALIDATION_CHANNEL', 'cache:invalidate'), self.invalidated)
+
+    def count(self, tier, hits, misses):
+        with self._lock:
+            self.metrics[f'{tier}_hits'] += hits
+            self.metrics[f'{tier}_misses'] += misses
+
+    def invalidated(self, keys):
+        # None: the channel was (re)subscribed and may have missed messages
+        if keys is None:
+            self.l1.clear()
+            return
+        for key in keys:
+            self.l1.delete(key)
+        with self._lock:
+            self.metrics['invalidations'] += len(keys)
+
+    def stats(self):
+        with self._lock:
+            metrics = dict(self.metrics)
+        return {**metrics, 'l1_entries': len(self.l1), 'l1_bytes': self.l1.size, 'l1_evictions': self.l1.evictions}
+
+# (name, pid) -> _Tier. Keyed by pid as forked workers must not share the
+# parent's L1 or listener thread.
+_tiers = {}
+_tiers_lock = threading.Lock()
+
+def _get_tier(name, options):
+    pid = os.getpid()
+    tier = _tiers.get((name, pid))
+    if tier is None:
+        with _tiers_lock:
+            tier = _tiers.get((name, pid))
+            if tier is None:
+                # Drop the tiers inherited from the parent process
+                for key in [key for key in _tiers if key[1] != pid]:
+                    del _tiers[key]
+                tier = _tiers[(name, pid)] = _Tier(options)
+    return tier
+
+def tier_stats():
+    """
+    {name: stats} of the tiered caches used by this process, see TieredCache.stats.
+    """
+    pid = os.getpid()
+    return {name: tier.stats() for (name, tier_pid), tier in list(_tiers.items()) if tier_pid == pid}
+
+class TieredCache(BaseCache):
+    """
+    Django cache backend combining an in-process LRUStore (L1) with the
+    cache alias named by the L2 option. Its L1 and counters are shared by
+    every thread of the process (see _Tier), under the name
+    '<LOCATION or L2 alias>'.
+
+    OPTIONS:
+        L2                  alias of the shared cache in settings.CACHES
+        L1_MAX_ENTRIES      LRU bound on entries (default 10000)
+        L1_MAX_BYTES        LRU bound on pickled bytes (default 32 MiB)
+        L1_TIMEOUT          longest an L2 value is served from L1 (default 10s)
+        INVALIDATION_URL    redis:// URL to broadcast invalidations on; without
+                            it L1 copies only expire (single process setups)
+        INVALIDATION_CHANNEL
+    """
+    def __init__(self, location, params):
+        super().__init__(params)
+        self._options = params.get('OPTIONS', {})
+        self._l2_alias = self._options.get('L2', 'shared')
+        self._l2 = None
+        self.name = location or self._l2_alias
+        self.l1_timeout = float(self._options.get('L1_TIMEOUT', 10))
+        self._tier = None
+        self._pid = None
+
+    @property
+    def tier(self):
+        if self._pid != os.getpid():
+            self._tier = _get_tier(self.name, self._options)
+            self._pid = os.getpid()
+        return self._tier
+
+    @property
+    def l1(self):
+        return self.tier.l1
+
+    @property
+    def l2(self):
+        if self._l2 is None:
+            self._l2 = caches[self._l2_alias]
+        return self._l2
+
+    def _l1_timeout(self, timeout):
+        timeout = self._l2_timeout(timeout)
+        return self.l1_timeout if timeout is None else min(timeout, self.l1_timeout)
+
+    def _count(self, tier, hits, misses):
+        self.tier.count(tier, hits, misses)
+
+    def _written(self, *keys):
+        tier = self.tier
+        for key in keys:
+            tier.l1.delete(key)
+        if tier.invalidation is not None:
+            tier.invalidation.publish(list(keys))
+
+    def _listen(self):
+        if self.tier.invalidation is not None:
+            self.tier.invalidation.ensure_listening()
+
+    def get(self, key, default=None, version=None):
+        self._listen()
+        local_key = self.make_and_validate_key(key, version=version)
+        value = self.l1.get(local_key)
+        if value is not _MISSING:
+            self._count('l1', 1, 0)
+            return value
+        self._count('l1', 0, 1)
+        value = self.l2.get(key, _MISSING, version=version)
+        if value is _MISSING:
+            self._count('l2', 0, 1)
+            return default
+        self._count('l2', 1, 0)
+        self.l1.set(local_key, value, self.l1_timeout)
+        return value
+
+    def get_many(self, keys, version=None):
+        self._listen()
+        found = {}
+        missing = []
+        for key in keys:
+            value = self.l1.get(self.make_and_validate_key(key, version=version))
+            if value is _MISSING:
+                missing.append(key)
+            else:
+                found[key] = value
+        self._count('l1', len(found), len(missing))
+        if missing:
+            fetched = self.l2.get_many(missing, version=version)
+            self._count('l2', len(fetched), len(missing) - len(fetched))
+            for key, value in fetched.items():
+                self.l1.set(self.make_and_validate_key(key, version=version), value, self.l1_timeout)
+            found.update(fetched)
+        return found
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        local_key = self.make_and_validate_key(key, version=version)
+        self.l2.set(key, value, timeout=self._l2_timeout(timeout), version=version)
+        self._written(local_key)
+        if self._l1_timeout(timeout) > 0:
+            self.l1.set(local_key, value, self._l1_timeout(timeout))
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        failed = self.l2.set_many(data, timeout=self._l2_timeout(timeout), version=version)
+        local_keys = [self.make_and_validate_key(key, version=version) for key in data]
+        self._written(*local_keys)
+        if self._l1_timeout(timeout) > 0:
+            for (key, value), local_key in zip(data.items(), local_keys):
+                if key not in failed:
+                    self.l1.set(local_key, value, self._l1_timeout(timeout))
+        return failed
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        # Decided by L2 alone: add() doubles as a cross-process lock
+        added = self.l2.add(key, value, timeout=self._l2_timeout(timeout), version=version)
+        if added:
+            self._written(self.make_and_validate_key(key, version=version))
+        return added
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        self.l1.delete(self.make_and_validate_key(key, version=version))
+        return self.l2.touch(key, timeout=self._l2_timeout(timeout), version=version)
+
+    def incr(self, key, delta=1, version=None):
+        value = self.l2.incr(key, delta, version=version)
+        self._written(self.make_and_validate_key(key, version=version))
+        return value
+
+    def decr(self, key, delta=1, version=None):
+        return self.incr(key, -delta, version=version)
+
+    def has_key(self, key, version=None):
+        return self.get(key, _MISSING, version=version) is not _MISSING
+
+    def delete(self, key, version=None):
+        deleted = self.l2.delete(key, version=version)
+        self._written(self.make_and_validate_key(key, version=version))
+        return deleted
+
+    def delete_many(self, keys, version=None):
+        keys = list(keys)
+        self.l2.delete_many(keys, version=version)
+        self._written(*[self.make_and_validate_key(key, version=version) for key in keys])
+
+    def clear(self):
+        self.l2.clear()
+        self.l1.clear()
+        if self.tier.invalidation is not None:
+            self.tier.invalidation.publish(None)
+
+    def close(self, **kwargs):
+        self.l2.close(**kwargs)
+
+    def _l2_timeout(self, timeout):
+        # DEFAULT_TIMEOUT means this backend's TIMEOUT, not the L2 alias' one
+        return self.default_timeout if timeout is DEFAULT_TIMEOUT else timeout
+
+    def stats(self):
+        """
+        Hit/miss counters per tier plus the L1 occupancy, for this process.
+        """
+        return self.tier.stats()
+
+def shared_backend(backend):
+    """
+    The L2 of a TieredCache, any other backend as is. For entries several
+    processes read and write in turn, where an L1 copy may be stale.
+    """
+    return backend.l2 if isinstance(backend, TieredCache) else backend
+
+def is_process_local(backend):
+    """
+    Whether what `backend` stores is only seen by this process: a LocMemCache
+    (or no cache at all), on its own or as the L2 of a TieredCache.
+    """
+    backend = shared_backend(backend)
+    return isinstance(backend, (LocMemCache, DummyCache))
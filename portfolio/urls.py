@@ -6,6 +6,8 @@ app_name = 'portfolio'
 urlpatterns = [
     path('', views.landing_page, name='landing'),
     path('dashboard/', views.dashboard, name='dashboard'),
+    path('dashboard/table/', views.dashboard_table, name='dashboard_table'),
+    path('dashboard/stream/', views.price_stream, name='price_stream'),
     path('portfolios/', views.portfolio_list, name='portfolio_list'),
     path('portfolios/add/', views.portfolio_create, name='portfolio_create'),
     path('portfolios/<int:pk>/delete/', views.portfolio_delete, name='portfolio_delete'),
@@ -17,6 +19,7 @@ urlpatterns = [
     path('assets/', views.asset_list, name='asset_list'),
     path('assets/search/', views.asset_search, name='asset_search'),
     path('asset/add/', views.asset_add, name='asset_add'),
+    path('asset/import/', views.asset_import, name='asset_import'),
     path('insights/', views.insights, name='insights'),
     path('transactions/', views.transactions, name='transactions'),
     path('transactions/create/', views.transaction_create, name='transaction_create'),
@@ -24,4 +27,5 @@ urlpatterns = [
     path('goals/', views.goals, name='goals'),
     path('settings/', views.settings, name='settings'),
     path('market/<str:ticker>/', views.market_asset_detail, name='market_asset_detail'),
+    path('metrics/', views.metrics, name='metrics'),
 ]
@@ -0,0 +1,168 @@
+"""
+Per-user valuation (net worth, per-category breakdown, P&L) cached until
+either prices or the user's holdings change.
+
+The cached entry is stamped with the price version (the latest
+Asset.last_updated, read from the database so that prices written by any
+process, the Celery workers included, are seen) and the user's holdings version
+(bumped on Holding save/delete), so a dashboard poll between two price ticks
+costs one indexed aggregate and one cache round trip. Holdings are valued as
+arrays, see valuation_engine.py.
+"""
+import time
+from django.core.cache import cache
+from django.db.models import Max
+from .models import Asset, AssetCategory, Holding
+from .valuation_engine import HoldingArrays, to_decimal
+
+VALUATION_TIMEOUT = 60 * 60 * 24
+
+def _holdings_version_key(user_id):
+    return f'valuation:holdings_version:{user_id}'
+
+def _valuation_key(user_id):
+    return f'valuation:user:{user_id}'
+
+def _bump(key):
+    # Versions start from a timestamp so an evicted counter never comes back
+    # at a value an older cached valuation was stamped with.
+    if cache.add(key, time.time_ns(), None):
+        return
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, time.time_ns(), None)
+
+def get_price_version():
+    """
+    Timestamp of the latest price write, 0 without any asset.
+    """
+    latest = Asset.objects.aggregate(latest=Max('last_updated'))['latest']
+    return latest.timestamp() if latest else 0
+
+def bump_holdings_version(user_id):
+    """
+    Invalidates the cached valuation of one user. Called on holding changes.
+    """
+    _bump(_holdings_version_key(user_id))
+
+def get_holdings_version(user_id):
+    """
+    Current holdings version of a user (initialized on first read).
+    """
+    key = _holdings_version_key(user_id)
+    version = cache.get(key)
+    if version is None:
+        _bump(key)
+        version = cache.get(key)
+    return version
+
+def compute_user_valuation(user_id):
+    """
+    Values every holding of the user. Holdings are returned as plain dicts
+    shaped like the dashboard table expects, so the result can be cached.
+    """
+    category_labels = dict(AssetCategory.choices)
+    holdings = HoldingArrays.load(
+        Holding.objects.filter(portfolio__user_id=user_id).order_by('pk'),
+        'asset__ticker', 'asset__name', 'quantity',
+    )
+    columns = holdings.columns
+    holdings_by_category = {cat: [] for cat in AssetCategory.values}
+    # Per-holding figures become Decimal here, the templates only format them
+    for ticker, name, category, quantity, price, value, gain, percent, weight in zip(
+        columns['asset__ticker'], columns['asset__name'], holdings.categories, columns['quantity'],
+        holdings.price.tolist(), holdings.value.tolist(), holdings.gain.tolist(), holdings.pnl_percent().tolist(),
+        holdings.weights().tolist(),
+    ):
+        holdings_by_category[category].append({
+            'holding': {
+                'asset': {'ticker': ticker, 'name': name, 'category': category},
+                'quantity': quantity,
+            },
+            'current_value': to_decimal(value),
+            'current_price': to_decimal(price),
+            'pnl': to_decimal(gain),
+            'pnl_percent': to_decimal(percent),
+            'weight': to_decimal(weight * 100),
+        })
+    categories = {
+        category: {
+            'value': to_decimal(row['value']), 'invested': to_decimal(row['invested']),
+            'weight': to_decimal(row['weight'] * 100), 'count': row['count'],
+        }
+        for category, row in holdings.by_category().items()
+    }
+
+    # Remove empty categories
+    holdings_by_category = {cat: items for cat, items in holdings_by_category.items() if items}
+    total_value = to_decimal(holdings.total_value())
+    total_invested = to_decimal(holdings.total_invested())
+    return {
+        'total_net_worth': total_value,
+        'total_invested': total_invested,
+        'pnl': total_value - total_invested,
+        'holdings_by_category': holdings_by_category,
+        'categories': categories,
+        'allocation_labels': [category_labels.get(cat, cat) for cat in categories],
+        'allocation_data': [float(row['weight']) for row in categories.values()],
+    }
+
+def compute_portfolio_valuation(portfolio_id):
+    """
+    Values the holdings of one portfolio. Holdings are plain dicts shaped like
+    the Holding attributes the portfolio page reads.
+    """
+    holdings = HoldingArrays.load(
+        Holding.objects.filter(portfolio_id=portfolio_id).order_by('pk'),
+        'pk', 'asset_id', 'asset__ticker', 'asset__name', 'quantity', 'average_buy_price',
+    )
+    columns = holdings.columns
+    rows = [
+        {
+            'pk': holding_id,
+            'asset': {'pk': asset_id, 'ticker': ticker, 'name': name},
+            'quantity': quantity,
+            'average_buy_price': average_buy_price,
+            'current_value': to_decimal(value),
+            'pnl': to_decimal(gain),
+            'pnl_percent': to_decimal(percent),
+            'weight': to_decimal(weight * 100),
+        }
+        for holding_id, asset_id, ticker, name, quantity, average_buy_price, value, gain, percent, weight in zip(
+            columns['pk'], columns['asset_id'], columns['asset__ticker'], columns['asset__name'],
+            columns['quantity'], columns['average_buy_price'],
+            holdings.value.tolist(), holdings.gain.tolist(), holdings.pnl_percent().tolist(), holdings.weights().tolist(),
+        )
+    ]
+    total_value = to_decimal(holdings.total_value())
+    total_invested = to_decimal(holdings.total_invested())
+    return {
+        'holdings': rows,
+        'total_value': total_value,
+        'total_invested': total_invested,
+        'pnl': total_value - total_invested,
+    }
+
+def get_user_valuation(user_id):
+    """
+    Returns the cached valuation of a user, recomputing it only when the price
+    version or the user's holdings version moved since it was stored.
+    """
+    holdings_key = _holdings_version_key(user_id)
+    valuation_key = _valuation_key(user_id)
+    price_version = get_price_version()
+    # Holdings version and the cached entry come back in a single round trip
+    found = cache.get_many([holdings_key, valuation_key])
+
+    holdings_version = found.get(holdings_key)
+    if holdings_version is None:
+        holdings_version = get_holdings_version(user_id)
+    else:
+        cached = found.get(valuation_key)
+        if cached and cached['versions'] == (price_version, holdings_version):
+            return cached['valuation']
+
+    valuation = compute_user_valuation(user_id)
+    cache.set(valuation_key, {'versions': (price_version, holdings_version), 'valuation': valuation}, VALUATION_TIMEOUT)
+    return valuation
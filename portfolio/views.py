@@ -1,15 +1,24 @@
 from django.shortcuts import render
-from django.db.models import Sum, F
 from django.contrib.auth.decorators import login_required
-from .models import Portfolio, Holding, AssetCategory, PortfolioHistory, Asset, Transaction
-from django.http import JsonResponse
+from django.contrib.auth.views import redirect_to_login
+from django.core.cache import cache
+from .models import Portfolio, Holding, AssetCategory, Asset, Transaction, NetWorthHistory
+from django.http import JsonResponse, HttpResponse, HttpResponseBadRequest, StreamingHttpResponse
 from django.views.decorators.csrf import csrf_exempt
-from django.views.decorators.http import require_POST
+from django.views.decorators.http import require_POST, condition
+from django.views.decorators.cache import cache_control
+import hmac
 import json
+from asgiref.sync import sync_to_async
 from django.utils import timezone
 from .forms import PortfolioForm, HoldingForm
 from django.shortcuts import render, redirect, get_object_or_404
-from .services import search_assets_online, create_asset_from_ticker
+from .services import asearch_assets_online, create_asset_from_ticker, import_assets
+from .valuation import compute_portfolio_valuation, get_user_valuation, get_holdings_version, get_price_version
+from .pagination import transactions_page
+from .scheduling import record_asset_view
+from . import stream, telemetry
+from django.conf import settings as django_settings
 from django.contrib import messages
 import datetime
 
@@ -20,62 +29,22 @@ def landing_page(request):
 
 @login_required
 def dashboard(request):
-    user_portfolios = Portfolio.objects.filter(user=request.user)
+    # Net worth, per-category breakdown and P&L, cached until prices or holdings change
+    valuation = get_user_valuation(request.user.pk)
+    total_net_worth = valuation['total_net_worth']
     
-    # Simple aggregation for all user portfolios
-    holdings = Holding.objects.filter(portfolio__in=user_portfolios).select_related('asset')
-    
-    # Simple aggregation for all user portfolios
-    holdings = Holding.objects.filter(portfolio__in=user_portfolios).select_related('asset')
-    
-    # Calculate Total Net Worth
-    total_net_worth = 0
-    total_invested = 0
-    
-    # Organize holdings by category
-    holdings_by_category = {cat: [] for cat, _ in AssetCategory.choices}
-    
-    for holding in holdings:
-        val = holding.current_value
-        invested = holding.quantity * holding.average_buy_price
-        
-        total_net_worth += val
-        total_invested += invested
-        
-        # Calculate current price safely
-        current_price = val / holding.quantity if holding.quantity else 0
-
-        item = {
-            'holding': holding,
-            'current_value': val,
-            'current_price': current_price,
-            'pnl': val - invested,
-            'pnl_percent': ((val - invested) / invested * 100) if invested else 0
-        }
-        holdings_by_category[holding.asset.category].append(item)
-        
-    # Remove empty categories and prepare chart data
-    final_holdings_by_category = {}
-    allocation_labels = []
-    allocation_data = []
-
-    for cat, items in holdings_by_category.items():
-        if items:
-            final_holdings_by_category[cat] = items
-            # Use the display label for the category if available, otherwise code
-            # We can find the label from AssetCategory.choices
-            label = dict(AssetCategory.choices).get(cat, cat)
-            allocation_labels.append(label)
-            allocation_data.append(len(items))
-            
-    holdings_by_category = final_holdings_by_category
+    # Daily variation and chart both read the per-user rollup in one range scan
+    today_date = timezone.localdate()
+    yesterday = today_date - datetime.timedelta(days=1)
     
-    # Calculate Daily Variation
-    yesterday = timezone.localdate() - datetime.timedelta(days=1)
+    history = list(
+        NetWorthHistory.objects.filter(user=request.user, date__lt=today_date)
+        .order_by('date')
+        .values_list('date', 'total_value')
+    )
     
     # History for Yesterday (for variation)
-    last_history = PortfolioHistory.objects.filter(portfolio__in=user_portfolios, date=yesterday).aggregate(Sum('total_value'))
-    last_total_value = last_history['total_value__sum'] or 0
+    last_total_value = history[-1][1] if history and history[-1][0] == yesterday else 0
     
     if last_total_value:
         daily_variation = total_net_worth - last_total_value
@@ -85,75 +54,65 @@ def dashboard(request):
         daily_variation_percent = 0
 
     # Chart Data Preparation
-    # We want a consolidated history of all portfolios.
-    # Group by date and sum total_value.
-    
-    # Fetch all history for these portfolios, ordered by date
-    history_qs = PortfolioHistory.objects.filter(portfolio__in=user_portfolios).order_by('date')
-    
-    # Aggregate by date in Python (simpler for now than advanced ORM grouping if not huge data)
-    history_map = {}
-    for h in history_qs:
-        d_str = h.date.strftime('%d %b') # e.g. "04 Jan"
-        history_map[d_str] = history_map.get(d_str, 0) + float(h.total_value)
-        
-    # Also add TODAY's value if not present (snapshot runs at night, real-time is updated)
-    today_str = timezone.localdate().strftime('%d %b')
-    if today_str not in history_map:
-         history_map[today_str] = float(total_net_worth)
-    
-    # Sort keys by date? The map iteration order depends on insertion in Python 3.7+,
-    # but let's be safe. We need proper sorting.
-    # Re-sort based on original date objects would be better, but MVP:
-    # Let's rely on the QS ordering.
-    
-    # Better approach:
-    dates_labels = []
-    values_data = []
-    
-    # Get distinct dates from DB
-    distinct_dates = PortfolioHistory.objects.filter(portfolio__in=user_portfolios).values_list('date', flat=True).distinct().order_by('date')
-    
-    for d in distinct_dates:
-        # Sum for this date
-        day_sum = PortfolioHistory.objects.filter(portfolio__in=user_portfolios, date=d).aggregate(Sum('total_value'))['total_value__sum'] or 0
-        dates_labels.append(d.strftime('%Y-%m-%d')) # ISO format for JS parsing or just simplified
-        values_data.append(float(day_sum))
+    dates_labels = [d.strftime('%Y-%m-%d') for d, _ in history]
+    values_data = [float(v) for _, v in history]
         
-    # Append today current real-time value
-    today_date = timezone.localdate()
-    if not distinct_dates.filter(date=today_date).exists():
-        dates_labels.append(today_date.strftime('%Y-%m-%d'))
-        values_data.append(float(total_net_worth))
+    # Append today current real-time value (snapshot runs at night)
+    dates_labels.append(today_date.strftime('%Y-%m-%d'))
+    values_data.append(float(total_net_worth))
 
     context = {
         'total_net_worth': total_net_worth,
         'daily_variation': daily_variation,
         'daily_variation_percent': daily_variation_percent,
-        'holdings_by_category': holdings_by_category,
+        'holdings_by_category': valuation['holdings_by_category'],
         'chart_labels': dates_labels,
         'chart_data': values_data,
         'AssetCategory': AssetCategory,
-        'allocation_labels': allocation_labels,
-        'allocation_data': allocation_data,
+        'allocation_labels': valuation['allocation_labels'],
+        'allocation_data': valuation['allocation_data'],
     }
-    
-    if request.htmx:
-        return render(request, 'portfolio/partials/dashboard_table.html', context)
         
     return render(request, 'portfolio/dashboard.html', context)
 
+def dashboard_table_etag(request):
+    """
+    Cheap validator for the polled holdings table: it only changes when the
+    user's holdings version moves or some asset price was written.
+    """
+    return f"{request.user.pk}-{get_holdings_version(request.user.pk)}-{get_price_version()}"
+
+@login_required
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=dashboard_table_etag)
+def dashboard_table(request):
+    # Polled by the dashboard; answers 304 Not Modified while the ETag matches
+    valuation = get_user_valuation(request.user.pk)
+    return render(request, 'portfolio/partials/dashboard_table.html', {
+        'holdings_by_category': valuation['holdings_by_category'],
+        'AssetCategory': AssetCategory,
+    })
+
+async def price_stream(request):
+    """
+    Server-Sent Events stream of price and valuation deltas for the user's
+    holdings. Under ASGI the stream is served by stream.PriceStreamRouter
+    before Django; this view serves it when Django runs alone.
+    """
+    user = await sync_to_async(lambda: request.user if request.user.is_authenticated else None)()
+    if user is None:
+        return HttpResponse(status=401)
+    held = await sync_to_async(stream.held_tickers)(user)
+
+    response = StreamingHttpResponse(stream.price_events(user.pk, held), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
 @login_required
 def portfolio_list(request):
-    portfolios = Portfolio.objects.filter(user=request.user)
-    
-    # Calculate value for each portfolio
-    for portfolio in portfolios:
-        total = 0
-        holdings = portfolio.holdings.all()
-        for h in holdings:
-            total += h.current_value
-        portfolio.total_value = total
+    # total_value is computed by the database in the same query
+    portfolios = Portfolio.objects.filter(user=request.user).select_related('user').with_valuation()
         
     return render(request, 'portfolio/portfolio_list.html', {'portfolios': portfolios})
 
@@ -183,18 +142,13 @@ def portfolio_delete(request, pk):
 @login_required
 def portfolio_detail(request, pk):
     portfolio = get_object_or_404(Portfolio, pk=pk, user=request.user)
-    
-    # Calculate totals
-    holdings = portfolio.holdings.all().select_related('asset')
-    total_value = 0
-    total_invested = 0
-    
-    for h in holdings:
-        total_value += h.current_value
-        total_invested += h.quantity * h.average_buy_price
-        
-    portfolio.total_value = total_value
-    portfolio.pnl = total_value - total_invested
+
+    # Holdings and totals are valued as arrays, see valuation_engine.py
+    valuation = compute_portfolio_valuation(portfolio.pk)
+    holdings = valuation['holdings']
+    portfolio.total_value = valuation['total_value']
+    portfolio.total_invested = total_invested = valuation['total_invested']
+    portfolio.pnl = valuation['pnl']
     portfolio.pnl_percent = (portfolio.pnl / total_invested * 100) if total_invested else 0
     
     return render(request, 'portfolio/portfolio_detail.html', {
@@ -265,7 +219,10 @@ def holding_create(request, portfolio_id):
                 category='Investment',
                 description=f"Achat {asset.ticker} ({quantity} @ {price})",
                 date=timezone.now().date(),
-                source=Transaction.Source.MANUAL
+                source=Transaction.Source.MANUAL,
+                asset=asset,
+                quantity=quantity,
+                unit_price=price,
             )
             
             return redirect('portfolio:portfolio_detail', pk=portfolio.pk)
@@ -308,17 +265,37 @@ def asset_list(request):
     }
     return render(request, 'portfolio/asset_list.html', context)
 
-@login_required
-def asset_search(request):
+# How long a session's search sequence number is remembered (seconds)
+SEARCH_SEQUENCE_TIMEOUT = 60
+
+async def asset_search(request):
+    """
+    Async so a burst of keystrokes waiting on the provider does not hold
+    worker threads (served by the ASGI app). Each request takes a sequence
+    number per session; a response overtaken by a newer keystroke of the
+    same session is dropped with 204, which htmx does not swap in.
+    """
+    session_key = await sync_to_async(
+        lambda: request.session.session_key if request.user.is_authenticated else None
+    )()
+    if session_key is None:
+        return redirect_to_login(request.get_full_path())
+
     query = request.GET.get('q', '')
+    sequence_key = f'search:sequence:{session_key}'
+    await cache.aadd(sequence_key, 0, SEARCH_SEQUENCE_TIMEOUT)
+    sequence = await cache.aincr(sequence_key)
+
     results = []
     if query:
-        results = search_assets_online(query)
-    
+        results = await asearch_assets_online(query)
+
     if request.htmx:
-        return render(request, 'portfolio/partials/asset_search_results.html', {'results': results, 'query': query})
+        if await cache.aget(sequence_key) != sequence:
+            return HttpResponse(status=204)
+        return await sync_to_async(render)(request, 'portfolio/partials/asset_search_results.html', {'results': results, 'query': query})
         
-    return render(request, 'portfolio/asset_search.html', {'results': results, 'query': query})
+    return await sync_to_async(render)(request, 'portfolio/asset_search.html', {'results': results, 'query': query})
 
 @login_required
 def asset_add(request):
@@ -332,30 +309,62 @@ def asset_add(request):
             
     return redirect('portfolio:asset_list')
 
+# Tickers accepted by one bulk import request
+IMPORT_MAX_TICKERS = 1000
+
+@login_required
+@require_POST
+def asset_import(request):
+    """
+    Bulk import of tickers, either as JSON ({"tickers": [...]}, answered in
+    JSON) or as a form field with one ticker per line or comma.
+    """
+    as_json = request.content_type == 'application/json'
+    if as_json:
+        try:
+            tickers = json.loads(request.body).get('tickers') or []
+        except (ValueError, AttributeError):
+            return HttpResponseBadRequest("Invalid JSON")
+        if not isinstance(tickers, list) or not all(isinstance(t, str) for t in tickers):
+            return HttpResponseBadRequest("'tickers' must be a list of strings")
+    else:
+        tickers = request.POST.get('tickers', '').replace(',', '\n').splitlines()
+    if len(tickers) > IMPORT_MAX_TICKERS:
+        return HttpResponseBadRequest(f"At most {IMPORT_MAX_TICKERS} tickers per import")
+
+    report = import_assets(tickers)
+    if as_json:
+        return JsonResponse({key: report[key] for key in ('created', 'updated', 'failed')})
+
+    imported = len(report['created']) + len(report['updated'])
+    if imported:
+        messages.success(request, f"{imported} actifs importés.")
+    if report['failed']:
+        messages.error(request, f"Impossible d'importer : {', '.join(report['failed'])}.")
+    return redirect('portfolio:asset_list')
+
 @login_required
 def insights(request):
-    # Fetch all holdings for the user
-    portfolios = Portfolio.objects.filter(user=request.user)
-    holdings = Holding.objects.filter(portfolio__in=portfolios).select_related('asset')
+    # Fetch all holdings for the user, aggregated by the database
+    holdings = Holding.objects.filter(portfolio__user=request.user)
+    totals = holdings.totals()
 
     # 1. Total Wealth
-    total_wealth = sum(h.current_value for h in holdings)
+    total_wealth = totals['total_value']
     
     # 2. Allocation by Category
-    allocation = {}
-    for h in holdings:
-        cat = h.asset.get_category_display()
-        allocation[cat] = allocation.get(cat, 0) + float(h.current_value)
+    category_labels = dict(AssetCategory.choices)
+    allocation = {
+        category_labels.get(row['asset__category'], row['asset__category']): float(row['value'])
+        for row in holdings.by_category()
+    }
 
     # 3. Diversification Score (0-100)
     # Simple logic: 100 - (Weight of largest single asset * 100)
     # If 0 assets, score is 0.
     if total_wealth > 0:
-        asset_values = {}
-        for h in holdings:
-            asset_values[h.asset.ticker] = asset_values.get(h.asset.ticker, 0) + float(h.current_value)
-        
-        largest_asset_value = max(asset_values.values()) if asset_values else 0
+        largest_asset = holdings.by_asset().first()
+        largest_asset_value = float(largest_asset['value']) if largest_asset else 0
         largest_weight = largest_asset_value / float(total_wealth)
         diversification_score = int(100 - (largest_weight * 100))
         # Cap score for edge cases (e.g. only 1 asset = score 0)
@@ -380,7 +389,7 @@ def insights(request):
         'diversification_score': diversification_score,
         'volatility_score': volatility_score,
         'projected_dividends': projected_dividends,
-        'holdings_count': holdings.count(),
+        'holdings_count': totals['count'],
         
         # Risk Radar Chart Data
         'risk_labels': ['Volatilité', 'Géographie', 'Secteur', 'Liquidité', 'Devise'],
@@ -391,8 +400,18 @@ def insights(request):
 
 @login_required
 def transactions(request):
-    transactions = Transaction.objects.filter(user=request.user)
-    return render(request, 'portfolio/transactions.html', {'transactions': transactions})
+    try:
+        rows, next_cursor = transactions_page(
+            Transaction.objects.filter(user=request.user), request.GET.get('cursor')
+        )
+    except ValueError:
+        return HttpResponseBadRequest("Curseur invalide")
+
+    context = {'transactions': rows, 'next_cursor': next_cursor}
+    # Infinite scroll: later pages only append rows to the table
+    if request.htmx and request.GET.get('cursor'):
+        return render(request, 'portfolio/partials/transaction_rows.html', context)
+    return render(request, 'portfolio/transactions.html', context)
 
 @login_required
 def transaction_create(request):
@@ -474,12 +493,26 @@ def goals(request):
 def settings(request):
     return render(request, 'portfolio/settings.html')
 
+def metrics(request):
+    """
+    Task metrics in the Prometheus text format, see telemetry.py.
+    Served to staff users, and to scrapers sending the METRICS_TOKEN bearer token.
+    """
+    token = django_settings.METRICS_TOKEN
+    authorization = request.headers.get('Authorization', '')
+    scraper = bool(token) and hmac.compare_digest(authorization.encode(), f'Bearer {token}'.encode())
+    if not (scraper or request.user.is_staff):
+        return HttpResponse(status=401 if not request.user.is_authenticated else 403)
+    return HttpResponse(telemetry.render(), content_type=telemetry.CONTENT_TYPE)
+
 @login_required
 def market_asset_detail(request, ticker):
     from .services import fetch_asset_details
     import json
     
     asset = fetch_asset_details(ticker)
+    # Viewed assets get their prices refreshed more often
+    record_asset_view(ticker)
     
     context = {
         'asset': asset,
@@ -0,0 +1,93 @@
+"""
+Background cache warming of the market overview and asset details.
+
+The periodic warm_market_cache task (and the worker boot hook in tasks.py)
+refetches the market overview and the details of every MARKET_TICKERS entry
+and every held asset before they go stale, so asset_list and
+market_asset_detail are served from the cache instead of calling the
+provider inside the request. This takes a cache shared by the worker and
+the web processes (CACHE_URL): the task skips itself on a process-local one.
+"""
+import time
+from concurrent.futures import ThreadPoolExecutor
+from django.core.cache import cache
+from django.db import connection
+from .cache import is_fresh
+from .models import Asset, AssetCategory
+from .services import (
+    MARKET_OVERVIEW_KEY, MARKET_TICKERS, asset_details_key, refresh_asset_details, refresh_market_data,
+)
+from .telemetry import bind_run
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Cadence of the warm_market_cache beat entry. Entries fresh for longer than
+# this are skipped: they will still be fresh at the next run.
+WARM_INTERVAL = 240
+# Concurrent detail fetches
+WARM_WORKERS = 8
+WARMING_STATS_KEY = 'cache_warming:last_run'
+
+def warm_tickers():
+    """
+    Tickers whose details are kept warm: the market overview ones, then every
+    held stock or crypto asset.
+    """
+    tickers = [ticker for items in MARKET_TICKERS.values() for ticker, _ in items]
+    held = (
+        Asset.objects.filter(holdings__isnull=False, category__in=[AssetCategory.STOCKS, AssetCategory.CRYPTO])
+        .order_by('ticker')
+        .values_list('ticker', flat=True)
+        .distinct()
+    )
+    return list(dict.fromkeys(tickers + list(held)))
+
+def _warm_details(ticker, min_fresh):
+    try:
+        return 'refreshed' if refresh_asset_details(ticker, min_fresh) else 'skipped'
+    except Exception as e:
+        logger.warning(f"Error warming details of {ticker}: {e}")
+        return 'failed'
+    finally:
+        # ingest_price_frame may have opened a connection on this thread
+        connection.close()
+
+def warm_market_cache(min_fresh=WARM_INTERVAL, workers=WARM_WORKERS):
+    """
+    Refreshes the market overview and the details of warm_tickers() that
+    would go stale within `min_fresh` seconds. Returns run statistics, also
+    kept under WARMING_STATS_KEY: targets, refreshed/skipped/failed counts,
+    coverage (share of targets fresh in the cache after the run) and duration.
+    """
+    start = time.perf_counter()
+    stats = {'refreshed': 0, 'skipped': 0, 'failed': 0}
+    try:
+        stats['refreshed' if refresh_market_data(min_fresh) else 'skipped'] += 1
+    except Exception as e:
+        logger.warning(f"Error warming the market overview: {e}")
+        stats['failed'] += 1
+
+    tickers = warm_tickers()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for outcome in pool.map(bind_run(lambda ticker: _warm_details(ticker, min_fresh)), tickers):
+            stats[outcome] += 1
+
+    keys = [MARKET_OVERVIEW_KEY] + [asset_details_key(ticker) for ticker in tickers]
+    entries = cache.get_many(keys)
+    fresh = sum(1 for key in keys if is_fresh(entries.get(key)))
+    stats.update({
+        'targets': len(keys),
+        'fresh': fresh,
+        'coverage': fresh / len(keys),
+        'duration': time.perf_counter() - start,
+        'finished_at': time.time(),
+    })
+    cache.set(WARMING_STATS_KEY, stats, None)
+    return stats
+
+def get_warming_stats():
+    """
+    Statistics of the last warm_market_cache run, or None.
+    """
+    return cache.get(WARMING_STATS_KEY)
@@ -13,4 +13,9 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'wealthgravity.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# The live price stream is served before Django, see portfolio/stream.py
+from portfolio.stream import PriceStreamRouter  # noqa: E402
+
+application = PriceStreamRouter(django_application)
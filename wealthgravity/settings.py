@@ -56,7 +56,7 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
-    "whitenoise.middleware.WhiteNoiseMiddleware", # Add WhiteNoise
+    "portfolio.middleware.AsyncWhiteNoiseMiddleware", # WhiteNoise, async capable
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -141,9 +141,89 @@ STATIC_ROOT = BASE_DIR / 'staticfiles'
 STATICFILES_STORAGE = "whitenoise.storage.CompressedManifestStaticFilesStorage"
 
 # Celery Configuration
-CELERY_BROKER_URL = 'redis://localhost:6379/0'
-CELERY_RESULT_BACKEND = 'redis://localhost:6379/0'
+CELERY_BROKER_URL = os.environ.get('CELERY_BROKER_URL', 'redis://localhost:6379/0')
+CELERY_RESULT_BACKEND = os.environ.get('CELERY_RESULT_BACKEND', 'redis://localhost:6379/0')
 CELERY_TIMEZONE = TIME_ZONE
+# Run tasks (including group/chord fan-out) inline, e.g. for local testing:
+# CELERY_TASK_ALWAYS_EAGER=1, or CELERY_BROKER_URL=memory:// with CELERY_RESULT_BACKEND=cache+memory://
+CELERY_TASK_ALWAYS_EAGER = os.environ.get('CELERY_TASK_ALWAYS_EAGER') == '1'
+CELERY_TASK_EAGER_PROPAGATES = CELERY_TASK_ALWAYS_EAGER
+# Leases keeping periodic tasks from overlapping (portfolio/locks.py).
+# Set TASK_LOCK_URL=memory:// to keep them in-process (tests, single process).
+TASK_LOCK_URL = os.environ.get('TASK_LOCK_URL', CELERY_BROKER_URL)
+
+from celery.schedules import crontab
+
+CELERY_BEAT_SCHEDULE = {
+    # Keep market data fresh ahead of requests, see portfolio/warming.py (WARM_INTERVAL)
+    'warm-market-cache': {'task': 'portfolio.tasks.warm_market_cache', 'schedule': 240},
+    # Prices of the assets due for a refresh, see portfolio/scheduling.py (SCHEDULER_TICK)
+    'refresh-due-asset-prices': {'task': 'portfolio.tasks.refresh_due_asset_prices', 'schedule': 300},
+    # Daily closes of the day, once the US session (the last one, 20:00/21:00 UTC) is over
+    'top-up-asset-prices': {'task': 'portfolio.tasks.top_up_asset_prices', 'schedule': crontab(hour=22, minute=30)},
+    # Portfolio and net worth history of the new day
+    'snapshot-daily-portfolio': {'task': 'portfolio.tasks.snapshot_daily_portfolio', 'schedule': crontab(hour=0, minute=0)},
+}
+
+# Task metrics (portfolio/telemetry.py), served in the Prometheus format at /metrics/.
+# Set METRICS_URL=memory:// to keep them in-process (tests, single process).
+# Only staff users can read them, unless METRICS_TOKEN is set: scrapers sending
+# an 'Authorization: Bearer <token>' header are then let in too.
+METRICS_URL = os.environ.get('METRICS_URL', CELERY_BROKER_URL)
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+
+# Live price stream (Server-Sent Events on the ASGI app).
+# Set PRICE_STREAM_URL=memory:// to keep the channel in-process (tests, single process).
+PRICE_STREAM_URL = os.environ.get('PRICE_STREAM_URL', CELERY_BROKER_URL)
+PRICE_STREAM_CHANNEL = 'prices'
+
+# Cache: a bounded per-process LRU in front of a cache shared by every process
+# (portfolio/tiered_cache.py). Valuations, refresh locks, cache warming and the
+# price schedule rely on the shared tier being seen by the web and Celery processes:
+#   unset      the database (DatabaseCache, table created by `createcachetable`)
+#   redis://   Redis, which also lets L1 copies be invalidated across processes
+#   memory://  a LocMemCache per process (tests, single process only)
+CACHE_URL = os.environ.get('CACHE_URL') or 'db://'
+CACHES = {
+    'default': {
+        'BACKEND': 'portfolio.tiered_cache.TieredCache',
+        'OPTIONS': {
+            'L2': 'shared',
+            'L1_MAX_BYTES': int(os.environ.get('CACHE_L1_MAX_BYTES', 32 * 1024 * 1024)),
+            'L1_TIMEOUT': 10,
+        },
+    },
+}
+if CACHE_URL.startswith('memory://'):
+    CACHES['shared'] = {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}
+elif CACHE_URL.startswith('db://'):
+    CACHES['shared'] = {'BACKEND': 'django.core.cache.backends.db.DatabaseCache', 'LOCATION': 'django_cache'}
+else:
+    CACHES['shared'] = {'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': CACHE_URL}
+    CACHES['default']['OPTIONS']['INVALIDATION_URL'] = CACHE_URL
+
+# Stock price downloads (yfinance): tickers per request and concurrent requests
+YF_DOWNLOAD_CHUNK_SIZE = int(os.environ.get('YF_DOWNLOAD_CHUNK_SIZE', 200))
+YF_DOWNLOAD_WORKERS = int(os.environ.get('YF_DOWNLOAD_WORKERS', 4))
+
+# Market data sources (portfolio/providers.py). 'crypto' serves crypto quotes,
+# 'default' everything else. MARKET_DATA_PROVIDER=synthetic runs fully offline
+# on generated prices (load tests, benchmarks).
+if os.environ.get('MARKET_DATA_PROVIDER') == 'synthetic':
+    MARKET_DATA_PROVIDERS = {
+        'default': {
+            'BACKEND': 'portfolio.providers.SyntheticProvider',
+            'OPTIONS': {
+                'seed': int(os.environ.get('SYNTHETIC_SEED', 0)),
+                'latency': float(os.environ.get('SYNTHETIC_LATENCY', 0)),
+            },
+        },
+    }
+else:
+    MARKET_DATA_PROVIDERS = {
+        'default': {'BACKEND': 'portfolio.providers.YFinanceProvider'},
+        'crypto': {'BACKEND': 'portfolio.providers.CcxtProvider'},
+    }
 
 # Auth Redirect
 LOGIN_REDIRECT_URL = 'portfolio:dashboard'